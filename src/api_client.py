@@ -1,32 +1,472 @@
+import atexit
+import json
 import requests
 import logging
-from config import API_BASE_URL, API_KEY
+import threading
+import time
+from collections import deque
+from requests.adapters import HTTPAdapter
+from cache import TTLCache, MISSING, save_snapshot, load_snapshot
+from search_index import ListingIndexes
+import tracing
+from bulkheads import backend_slot
+from cache_sync import cache_sync
+from metrics import REGISTRY, api_requests, observe_api_request
+from resilience import (
+    CircuitOpenError, CircuitBreaker, RetryBudget, backoff_delay, endpoint_family, is_backend_failure, should_retry,
+    parse_retry_after
+)
+from config import (
+    API_BASE_URL, API_KEY, API_POOL_SIZE, API_CONNECT_TIMEOUT, API_READ_TIMEOUT,
+    API_MAX_RETRIES, API_RETRY_BASE_DELAY, API_RETRY_MAX_DELAY, API_RETRY_BUDGET_RATIO,
+    API_RETRY_BUDGET_RESERVE, API_BREAKER_FAILURE_THRESHOLD, API_BREAKER_RESET_TIMEOUT,
+    CUSTOMER_ORG_CACHE_SIZE, CUSTOMER_ORG_CACHE_TTL, CUSTOMER_ORG_NEGATIVE_TTL,
+    LISTING_CACHE_SIZE, LISTING_CACHE_TTL, USER_CACHE_SIZE, USER_CACHE_TTL, USER_CACHE_NEGATIVE_TTL,
+    USER_CACHE_SNAPSHOT, USER_CACHE_SNAPSHOT_INTERVAL
+)
 
 logger = logging.getLogger(__name__)
 
-def call_api(endpoint, method="GET", params=None, json=None):
+class ApiRejectedError(Exception):
+    # The LivePM API answered with a 4xx: retrying the same request won't help
+    def __init__(self, endpoint, status, reason):
+        self.endpoint = endpoint
+        self.status = status
+        self.reason = reason
+        super().__init__(f"{endpoint} rejected the request ({status}): {reason}")
+
+class ApiUnavailableError(Exception):
+    def __init__(self):
+        super().__init__("The LivePM API could not be reached. Please try again in a moment.")
+
+# Sent with every LivePM call, by both the requests and the aiohttp sessions
+API_HEADERS = {"access_token": API_KEY, "Accept": "application/json"}
+
+_session = None
+_session_lock = threading.Lock()
+
+# Per-call latency and pool usage, see get_api_stats()
+_stats_lock = threading.Lock()
+_stats = {
+    "calls": 0,
+    "errors": 0,
+    "retries": 0,
+    "in_flight": 0,
+    "peak_in_flight": 0,
+    "saturated_calls": 0,
+    "total_latency": 0.0,
+    "max_latency": 0.0,
+}
+_latencies = deque(maxlen=1024)
+
+# One circuit breaker per endpoint family ("/user/*", "/signal/*", ...)
+_breakers = {}
+_breakers_lock = threading.Lock()
+retry_budget = RetryBudget(ratio=API_RETRY_BUDGET_RATIO, reserve=API_RETRY_BUDGET_RESERVE)
+
+customer_org_cache = TTLCache(maxsize=CUSTOMER_ORG_CACHE_SIZE, ttl=CUSTOMER_ORG_CACHE_TTL)
+
+# Slack user ID -> LivePM user ID, or None for a Slack user that isn't registered
+livepm_user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+# Keyed by ("organizations", customer_org_id), ("users", customer_org_id) or ("customer_organizations",)
+listing_cache = TTLCache(maxsize=LISTING_CACHE_SIZE, ttl=LISTING_CACHE_TTL)
+listing_indexes = ListingIndexes(maxsize=LISTING_CACHE_SIZE)
+
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=API_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update(API_HEADERS)
+                _session = session
+    return _session
+
+def record_call_start():
+    with _stats_lock:
+        _stats["calls"] += 1
+        _stats["in_flight"] += 1
+        if _stats["in_flight"] > _stats["peak_in_flight"]:
+            _stats["peak_in_flight"] = _stats["in_flight"]
+        # More concurrent calls than pooled connections means a fresh handshake
+        if _stats["in_flight"] > API_POOL_SIZE:
+            _stats["saturated_calls"] += 1
+
+def record_call_end(started, failed, endpoint, method, status):
+    elapsed = time.perf_counter() - started
+    observe_api_request(endpoint, method, status, elapsed)
+    with _stats_lock:
+        _stats["in_flight"] -= 1
+        _stats["total_latency"] += elapsed
+        if elapsed > _stats["max_latency"]:
+            _stats["max_latency"] = elapsed
+        if failed:
+            _stats["errors"] += 1
+        _latencies.append(elapsed)
+
+def record_retry():
+    with _stats_lock:
+        _stats["retries"] += 1
+
+def get_api_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+        latencies = sorted(_latencies)
+    stats["pool_size"] = API_POOL_SIZE
+    stats["avg_latency"] = stats["total_latency"] / stats["calls"] if stats["calls"] else 0.0
+    for name, quantile in (("p50_latency", 0.5), ("p95_latency", 0.95), ("p99_latency", 0.99)):
+        stats[name] = latencies[min(len(latencies) - 1, int(len(latencies) * quantile))] if latencies else 0.0
+    return stats
+
+def get_breaker(endpoint):
+    family = endpoint_family(endpoint)
+    breaker = _breakers.get(family)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(family, CircuitBreaker(
+                family, failure_threshold=API_BREAKER_FAILURE_THRESHOLD, reset_timeout=API_BREAKER_RESET_TIMEOUT
+            ))
+    return breaker
+
+def _send(session, endpoint, method, params, json, timeout, headers=None):
     url = f"{API_BASE_URL}{endpoint}"
-    headers = {"access_token": API_KEY}
+    started = time.perf_counter()
+    failed = True
+    status = "error"
+    record_call_start()
     try:
         if method == "GET":
-            response = requests.get(url, params=params, headers=headers)
+            response = session.get(url, params=params, timeout=timeout, headers=headers)
         elif method == "POST":
             if params:
-                response = requests.post(url, params=params, headers=headers)
+                response = session.post(url, params=params, timeout=timeout, headers=headers)
             elif json:
-                response = requests.post(url, json=json, headers=headers)
+                response = session.post(url, json=json, timeout=timeout, headers=headers)
             else:
-                response = requests.post(url, headers=headers)
+                response = session.post(url, timeout=timeout, headers=headers)
+        status = response.status_code
         response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        logger.error(f"API call failed: {str(e)}")
-        if hasattr(e, 'response') and e.response is not None:
-            logger.error(f"Response content: {e.response.content}")
+        result = response.json()
+        failed = False
+        return result
+    finally:
+        record_call_end(started, failed, endpoint, method, status)
+
+def _status_code(error):
+    response = getattr(error, 'response', None)
+    return response.status_code if response is not None else None
+
+def rejection_reason(content, status):
+    # The backend's explanation of a 4xx: a detail, error or message field, else the body itself
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", "replace")
+    try:
+        body = json.loads(content or "")
+    except ValueError:
+        body = None
+    if isinstance(body, dict):
+        for key in ("detail", "error", "message"):
+            if body.get(key):
+                return str(body[key])
+    return (content or "")[:200] or f"HTTP {status}"
+
+class CallPolicy:
+    # Retries, circuit breaking and the retry budget for one LivePM call. call_api and
+    # call_api_async both run their attempts through it, so they classify failures alike.
+    def __init__(self, endpoint, method, raise_rejected=False):
+        self.endpoint = endpoint
+        self.method = method
+        self.raise_rejected = raise_rejected
+        self.breaker = get_breaker(endpoint)
+        self.attempt = 0
+
+    def begin(self):
+        try:
+            self.breaker.allow()
+        except CircuitOpenError:
+            api_requests.labels(self.endpoint, self.method, "circuit_open").inc()
+            raise
+        retry_budget.deposit()
+
+    def succeeded(self):
+        self.breaker.record_success()
+
+    def crashed(self):
+        self.breaker.record_failure()
+
+    def failed(self, error, status, connect_failed=False, retry_after=None, content=None):
+        # Seconds to wait before the next attempt, or None to give up. status is None when
+        # no response came back; with raise_rejected a 4xx raises ApiRejectedError instead.
+        if not is_backend_failure(status):
+            # A 4xx means the backend is healthy, the request just wasn't accepted
+            self.breaker.record_success()
+            if self.raise_rejected:
+                raise ApiRejectedError(self.endpoint, status, rejection_reason(content, status)) from error
+        elif (self.attempt < API_MAX_RETRIES and should_retry(self.method, status, connect_failed)
+              and retry_budget.withdraw()):
+            delay = parse_retry_after(retry_after, API_RETRY_MAX_DELAY)
+            if delay is None:
+                delay = backoff_delay(self.attempt, API_RETRY_BASE_DELAY, API_RETRY_MAX_DELAY)
+            logger.warning(f"API call to {self.endpoint} failed ({str(error)}), retrying in {delay:.2f}s")
+            self.attempt += 1
+            record_retry()
+            return delay
+        else:
+            self.breaker.record_failure()
+        logger.error(f"API call failed: {str(error)}")
+        if content is not None:
+            logger.error(f"Response content: {content}")
         return None
 
+def call_api(endpoint, method="GET", params=None, json=None, headers=None, raise_rejected=False):
+    # Returns the decoded response, or None if the call failed. With raise_rejected, a 4xx
+    # answer raises ApiRejectedError instead, so callers can tell it apart from an outage.
+    with tracing.span("livepm", endpoint=endpoint, method=method) as span:
+        result = _call_api(endpoint, method, params, json, headers, raise_rejected)
+        if span is not None and result is None:
+            span.error = "no response"
+        return result
+
+def _call_api(endpoint, method, params, json, headers, raise_rejected):
+    session = get_session()
+    timeout = (API_CONNECT_TIMEOUT, API_READ_TIMEOUT)
+    policy = CallPolicy(endpoint, method, raise_rejected)
+    policy.begin()
+    try:
+        while True:
+            try:
+                # Waits for a slot if the current customer organization is at its cap
+                with backend_slot():
+                    result = _send(session, endpoint, method, params, json, timeout, headers)
+                policy.succeeded()
+                return result
+            except requests.exceptions.RequestException as e:
+                response = e.response
+                delay = policy.failed(
+                    e, _status_code(e), isinstance(e, requests.exceptions.ConnectTimeout),
+                    retry_after=response.headers.get("Retry-After") if response is not None else None,
+                    content=response.content if response is not None else None,
+                )
+                if delay is None:
+                    return None
+                time.sleep(delay)
+    except ApiRejectedError:
+        raise
+    except Exception:
+        policy.crashed()
+        raise
+
+def get_resilience_stats():
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {
+        "breakers": {family: breaker.stats() for family, breaker in breakers.items()},
+        "retry_budget": retry_budget.stats(),
+    }
+
 def get_customer_org_id(team_id):
-    response = call_api("/customerorganization/slack", method="GET", params={"slack_id": str(team_id)})
-    if response and "customer_organization_id" in response:
-        return response["customer_organization_id"]
-    return None
\ No newline at end of file
+    # The workspace's customer organization, or None if it isn't registered. Raises
+    # ApiUnavailableError when the lookup failed, so an outage isn't taken for "unregistered".
+    cached = customer_org_cache.get(str(team_id))
+    if cached is not MISSING:
+        return cached
+    try:
+        response = call_api("/customerorganization/slack", method="GET", params={"slack_id": str(team_id)},
+                            raise_rejected=True)
+    except ApiRejectedError as e:
+        if e.status != 404:
+            raise
+        response = {}
+    if response is None:
+        raise ApiUnavailableError()
+    if "customer_organization_id" in response:
+        customer_org_id = response["customer_organization_id"]
+        customer_org_cache.set(str(team_id), customer_org_id)
+        return customer_org_id
+    # Unregistered workspaces are remembered briefly so they can register soon after
+    customer_org_cache.set(str(team_id), None, ttl=CUSTOMER_ORG_NEGATIVE_TTL)
+    return None
+
+def invalidate_customer_org_id(team_id):
+    customer_org_cache.invalidate(str(team_id))
+    cache_sync.publish("customer_org", str(team_id))
+
+def get_livepm_user_id(slack_id):
+    # The LivePM user linked to a Slack user, None if they aren't registered, or MISSING if the lookup failed
+    cached = livepm_user_cache.get(str(slack_id))
+    if cached is not MISSING:
+        return cached
+    try:
+        response = call_api("/user/slack", method="GET", params={"slack_id": str(slack_id)})
+    except CircuitOpenError:
+        return MISSING
+    if response is None:
+        return MISSING
+    user_id = response.get('user_id')
+    # Unregistered users are remembered briefly so they can register soon after
+    livepm_user_cache.set(str(slack_id), user_id, ttl=None if user_id is not None else USER_CACHE_NEGATIVE_TTL)
+    return user_id
+
+def remember_livepm_user(slack_id, user_id):
+    # Called after a successful /user/register, replacing any cached miss
+    livepm_user_cache.set(str(slack_id), user_id)
+    cache_sync.publish("livepm_user", str(slack_id))
+
+def start_user_cache_snapshots(path=USER_CACHE_SNAPSHOT, interval=USER_CACHE_SNAPSHOT_INTERVAL):
+    # Restores the Slack -> LivePM user mapping from path, then saves it every interval seconds and at exit
+    if not path:
+        return None
+    try:
+        logger.info(f"Restored {load_snapshot(livepm_user_cache, path)} Slack user mappings from {path}")
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not restore Slack user mappings from {path}: {str(e)}")
+
+    def save():
+        try:
+            save_snapshot(livepm_user_cache, path)
+        except OSError as e:
+            logger.warning(f"Could not save Slack user mappings to {path}: {str(e)}")
+
+    def run():
+        while True:
+            time.sleep(interval)
+            save()
+
+    atexit.register(save)
+    thread = threading.Thread(target=run, name="user-cache-snapshot", daemon=True)
+    thread.start()
+    return thread
+
+def index_listing(key, rows):
+    # Builds the search indexes as the listing loads, so the first picker search or
+    # typed name doesn't pay for it
+    if rows:
+        listing_indexes.get(key, rows).build()
+    return rows
+
+def _load_listing(key, load):
+    return listing_cache.get_or_load(key, lambda: index_listing(key, load()))
+
+def get_organizations(customer_org_id):
+    return _load_listing(("organizations", customer_org_id), lambda: call_api(
+        "/organization/list", params={"customer_organization_id": customer_org_id}
+    ))
+
+def get_users(customer_org_id):
+    return _load_listing(("users", customer_org_id), lambda: call_api(
+        "/user/list", params={"customer_organization_id": customer_org_id}
+    ))
+
+def get_customer_organizations():
+    return _load_listing(("customer_organizations",), lambda: call_api("/customerorganization/list"))
+
+def load_listing(key):
+    # The listing for a key of listing_cache, from the cache or from LivePM
+    if key[0] == "organizations":
+        return get_organizations(key[1])
+    if key[0] == "users":
+        return get_users(key[1])
+    if key[0] == "customer_organizations":
+        return get_customer_organizations()
+    raise ValueError(f"Unknown listing {key!r}")
+
+def search_listing(key, query, limit=100):
+    # Answered from memory only: the cached listing, or the last one indexed under key.
+    # None when neither is there yet, so the caller can load it.
+    rows = listing_cache.get(key)
+    index = listing_indexes.get(key, None if rows is MISSING or rows is None else rows)
+    return index.search(query, limit) if index is not None else None
+
+def resolve_name(key, rows, name, limit=5):
+    # Matches a typed name against a listing; returns (row, []) or (None, shortlist)
+    if not rows:
+        return None, []
+    return listing_indexes.get(key, rows).resolve(name, limit)
+
+def _record_created(key, response, id_field, name):
+    # Append the new row to a cached listing and its index, or drop the listing if we can't.
+    # Other workers reload the listing either way.
+    cache_sync.publish("listing", key)
+    if response and id_field in response:
+        row = {"id": response[id_field], "name": name}
+        updated = []
+
+        def append(rows):
+            updated.append(rows + [row])
+            return updated[0]
+
+        if listing_cache.update(key, append):
+            listing_indexes.add(key, row, updated[0])
+            return
+        listing_indexes.add(key, row)
+    listing_cache.invalidate(key)
+
+def create_organization(name, customer_org_id):
+    new_org = call_api("/organization/create", method="POST", json={
+        "name": name,
+        "Customer_Organization_id": customer_org_id
+    })
+    _record_created(("organizations", customer_org_id), new_org, "organization_id", name)
+    return new_org
+
+def create_user(name, customer_org_id):
+    new_user = call_api("/user/create", method="POST", json={
+        "name": name,
+        "Customer_Organization_id": customer_org_id
+    })
+    _record_created(("users", customer_org_id), new_user, "user_id", name)
+    return new_user
+
+def create_customer_organization(name):
+    new_org = call_api("/customerorganization/create", method="POST", json={
+        "name": name
+    })
+    _record_created(("customer_organizations",), new_org, "customerorganization_id", name)
+    return new_org
+
+def _reload_listing(key):
+    # Another worker changed this listing. Reload it if it's in use here, so pickers and name
+    # matching see the new rows without waiting for the TTL.
+    listing_cache.invalidate(key)
+    if listing_indexes.get(key) is None:
+        return
+    if key[0] == "organizations":
+        get_organizations(key[1])
+    elif key[0] == "users":
+        get_users(key[1])
+    elif key[0] == "customer_organizations":
+        get_customer_organizations()
+
+cache_sync.on("customer_org", customer_org_cache.invalidate)
+cache_sync.on("livepm_user", livepm_user_cache.invalidate)
+cache_sync.on("listing", _reload_listing)
+
+def _collect_metrics():
+    api_stats = get_api_stats()
+    resilience_stats = get_resilience_stats()
+    caches = {
+        "customer_org": customer_org_cache.stats(),
+        "listing": listing_cache.stats(),
+        "livepm_user": livepm_user_cache.stats(),
+    }
+    return [
+        ("signalbot_livepm_in_flight", "LivePM API requests in flight", (), api_stats["in_flight"]),
+        ("signalbot_livepm_pool_size", "Keep-alive connections in the LivePM API pool", (), api_stats["pool_size"]),
+        ("signalbot_livepm_saturated_requests", "LivePM API requests started with the pool exhausted", (),
+         api_stats["saturated_calls"]),
+        ("signalbot_livepm_retries", "LivePM API retries", (), api_stats["retries"]),
+        ("signalbot_circuit_open", "1 if the endpoint family's circuit is open or half-open", ("family",),
+         {(family,): int(stats["state"] != "closed") for family, stats in resilience_stats["breakers"].items()}),
+        ("signalbot_retry_budget_tokens", "Retries currently allowed by the retry budget", (),
+         resilience_stats["retry_budget"]["tokens"]),
+        ("signalbot_cache_entries", "Entries in an in-process cache", ("cache",),
+         {(name,): stats["size"] for name, stats in caches.items()}),
+        ("signalbot_cache_hits", "Cache hits", ("cache",), {(name,): stats["hits"] for name, stats in caches.items()}),
+        ("signalbot_cache_misses", "Cache misses", ("cache",), {(name,): stats["misses"] for name, stats in caches.items()}),
+    ]
+
+REGISTRY.register_collector(_collect_metrics)
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import time
+import tracing
+from api_client import (
+    API_HEADERS, ApiRejectedError, CallPolicy, customer_org_cache, listing_cache, record_call_start,
+    record_call_end, index_listing
+)
+from bulkheads import async_backend_slot
+from cache import MISSING
+from config import API_BASE_URL, API_POOL_SIZE, API_CONNECT_TIMEOUT, API_READ_TIMEOUT, CUSTOMER_ORG_NEGATIVE_TTL
+
+logger = logging.getLogger(__name__)
+
+_session = None
+# Loads in progress, so concurrent misses for one key share a single request
+_inflight = {}
+
+class APIStatusError(Exception):
+    # A failed attempt; status is None when no response came back
+    def __init__(self, status, retry_after=None, content=None, connect_failed=False, message=None):
+        self.status = status
+        self.retry_after = retry_after
+        self.content = content
+        self.connect_failed = connect_failed
+        super().__init__(message or f"{status} error from LivePM API")
+
+async def get_async_session():
+    global _session
+    if _session is None or _session.closed:
+        # aiohttp is only needed for the async runtime
+        import aiohttp
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=API_POOL_SIZE, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(connect=API_CONNECT_TIMEOUT, sock_read=API_READ_TIMEOUT),
+            headers=API_HEADERS
+        )
+    return _session
+
+async def close_async_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+async def _send(session, endpoint, method, params, json, headers):
+    import aiohttp
+    url = f"{API_BASE_URL}{endpoint}"
+    started = time.perf_counter()
+    failed = True
+    status = "error"
+    record_call_start()
+    try:
+        async with session.request(method, url, params=params, json=json, headers=headers) as response:
+            status = response.status
+            if response.status >= 400:
+                raise APIStatusError(response.status, response.headers.get("Retry-After"), await response.read())
+            result = await response.json(content_type=None)
+        failed = False
+        return result
+    except aiohttp.ClientConnectorError as e:
+        raise APIStatusError(None, connect_failed=True, message=str(e)) from e
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise APIStatusError(None, message=str(e) or type(e).__name__) from e
+    finally:
+        record_call_end(started, failed, endpoint, method, status)
+
+async def call_api_async(endpoint, method="GET", params=None, json=None, headers=None, raise_rejected=False):
+    # As call_api, on the event loop
+    with tracing.span("livepm", endpoint=endpoint, method=method) as span:
+        result = await _call_api_async(endpoint, method, params, json, headers, raise_rejected)
+        if span is not None and result is None:
+            span.error = "no response"
+        return result
+
+async def _call_api_async(endpoint, method, params, json, headers, raise_rejected):
+    session = await get_async_session()
+    policy = CallPolicy(endpoint, method, raise_rejected)
+    policy.begin()
+    try:
+        while True:
+            try:
+                async with async_backend_slot():
+                    result = await _send(session, endpoint, method, params, json, headers)
+                policy.succeeded()
+                return result
+            except APIStatusError as e:
+                delay = policy.failed(e, e.status, e.connect_failed, e.retry_after, e.content)
+                if delay is None:
+                    return None
+                await asyncio.sleep(delay)
+    except ApiRejectedError:
+        raise
+    except Exception:
+        policy.crashed()
+        raise
+
+async def _get_or_load(cache, key, loader, ttl=None):
+    value = cache.get(key)
+    if value is not MISSING:
+        return value
+    flight_key = (id(cache), key)
+    future = _inflight.get(flight_key)
+    if future is not None:
+        return await asyncio.shield(future)
+    future = _inflight[flight_key] = asyncio.get_running_loop().create_future()
+    invalidations = cache.invalidations
+    try:
+        value = await loader()
+        # As in TTLCache.get_or_load: after an invalidate() during the load, the result may predate a write
+        if value is not None and cache.invalidations == invalidations:
+            cache.set(key, value, ttl)
+        future.set_result(value)
+        return value
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Mark the exception retrieved in case nobody else was waiting
+        future.exception()
+        raise
+    finally:
+        del _inflight[flight_key]
+
+async def get_customer_org_id_async(team_id):
+    async def load():
+        try:
+            response = await call_api_async("/customerorganization/slack", params={"slack_id": str(team_id)},
+                                            raise_rejected=True)
+        except ApiRejectedError as e:
+            if e.status != 404:
+                raise
+            response = {}
+        if response is None:
+            # A failed lookup isn't cached; the handler repeats it and reports the error
+            return None
+        if "customer_organization_id" in response:
+            return response["customer_organization_id"]
+        customer_org_cache.set(str(team_id), None, ttl=CUSTOMER_ORG_NEGATIVE_TTL)
+        return None
+    return await _get_or_load(customer_org_cache, str(team_id), load)
+
+async def _load_listing_async(key, load):
+    async def load_and_index():
+        rows = await load()
+        # Indexing a large listing is CPU work, so it runs off the event loop
+        return await asyncio.to_thread(index_listing, key, rows)
+    return await _get_or_load(listing_cache, key, load_and_index)
+
+async def get_organizations_async(customer_org_id):
+    return await _load_listing_async(("organizations", customer_org_id), lambda: call_api_async(
+        "/organization/list", params={"customer_organization_id": customer_org_id}
+    ))
+
+async def get_users_async(customer_org_id):
+    return await _load_listing_async(("users", customer_org_id), lambda: call_api_async(
+        "/user/list", params={"customer_organization_id": customer_org_id}
+    ))
+
+async def get_customer_organizations_async():
+    return await _load_listing_async(("customer_organizations",), lambda: call_api_async(
+        "/customerorganization/list"
+    ))
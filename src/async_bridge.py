@@ -0,0 +1,118 @@
+import asyncio
+import functools
+import logging
+from bulkheads import customer_org
+from commands import register_commands
+from message_handler import register_message_handler
+from pickers import register_pickers
+from async_api_client import (
+    get_customer_org_id_async, get_organizations_async, get_users_async, get_customer_organizations_async
+)
+
+logger = logging.getLogger(__name__)
+
+class ListenerCollector:
+    # Stands in for an App so the register_* functions can be reused as-is
+    def __init__(self):
+        self.commands = {}
+        self.events = {}
+        self.option_handlers = {}
+        self.actions = {}
+
+    def command(self, name):
+        def decorator(func):
+            self.commands[name] = func
+            return func
+        return decorator
+
+    def event(self, name):
+        def decorator(func):
+            self.events[name] = func
+            return func
+        return decorator
+
+    def options(self, name):
+        def decorator(func):
+            self.option_handlers[name] = func
+            return func
+        return decorator
+
+    def action(self, name):
+        def decorator(func):
+            self.actions[name] = func
+            return func
+        return decorator
+
+def _noop_ack(*args, **kwargs):
+    pass
+
+def _sync_say(client, channel_id):
+    def say(text="", **kwargs):
+        return client.chat_postMessage(channel=channel_id, text=text, **kwargs)
+    return say
+
+async def prefetch_for_command(name, command):
+    # Fills the shared caches without blocking, so the handler only hits memory
+    if name == "/help":
+        return
+    customer_org_id = await get_customer_org_id_async(command['team_id'])
+    with customer_org(customer_org_id):
+        if name == "/add_signal" and customer_org_id:
+            await get_organizations_async(customer_org_id)
+        elif name == "/register_user" and customer_org_id:
+            await get_users_async(customer_org_id)
+    if name == "/register_organization" and customer_org_id is None:
+        await get_customer_organizations_async()
+
+def _command_listener(name, handler, client, executor):
+    async def listener(ack, command):
+        await ack()
+        try:
+            await prefetch_for_command(name, command)
+        except Exception as e:
+            # The handler repeats the lookup and reports the failure to the user
+            logger.warning(f"Prefetch for {name} failed: {str(e)}")
+        await asyncio.get_running_loop().run_in_executor(executor, functools.partial(
+            handler, ack=_noop_ack, say=_sync_say(client, command['channel_id']), command=command, client=client
+        ))
+    return listener
+
+def _event_listener(handler, client, executor):
+    async def listener(event, body):
+        await asyncio.get_running_loop().run_in_executor(executor, functools.partial(
+            handler, event=event, say=_sync_say(client, event.get('channel')), client=client, body=body
+        ))
+    return listener
+
+def _options_listener(handler, executor):
+    async def listener(ack, body):
+        # Usually answered from the in-memory index, but a listing that isn't loaded is
+        # waited for (up to pickers.OPTIONS_DEADLINE), so it runs off the event loop
+        responses = []
+        await asyncio.get_running_loop().run_in_executor(executor, functools.partial(
+            handler, ack=lambda **kwargs: responses.append(kwargs), body=body
+        ))
+        await ack(**(responses[0] if responses else {}))
+    return listener
+
+def _action_listener(handler, client, executor):
+    async def listener(ack, body, action):
+        await ack()
+        await asyncio.get_running_loop().run_in_executor(executor, functools.partial(
+            handler, ack=_noop_ack, body=body, action=action, client=client
+        ))
+    return listener
+
+def register_async_handlers(app, client, executor):
+    collector = ListenerCollector()
+    register_commands(collector)
+    register_message_handler(collector)
+    register_pickers(collector)
+    for name, handler in collector.commands.items():
+        app.command(name)(_command_listener(name, handler, client, executor))
+    for name, handler in collector.events.items():
+        app.event(name)(_event_listener(handler, client, executor))
+    for name, handler in collector.option_handlers.items():
+        app.options(name)(_options_listener(handler, executor))
+    for name, handler in collector.actions.items():
+        app.action(name)(_action_listener(handler, client, executor))
@@ -0,0 +1,49 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import startup
+from cache_sync import cache_sync
+from slack_bolt.async_app import AsyncApp
+from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+from config import (
+    SLACK_BOT_TOKEN, SLACK_APP_TOKEN, ASYNC_HANDLER_WORKERS, METRICS_PORT, METRICS_HOST,
+    WARMUP_TIMEOUT
+)
+from async_api_client import close_async_session
+from async_bridge import register_async_handlers
+from outbox import start_outbox_flusher
+from slack_outbound import start_message_scheduler
+from metrics import start_metrics_server
+from slack_client import InstrumentedWebClient
+
+logger = logging.getLogger(__name__)
+
+# Create the Slack app
+app = AsyncApp(token=SLACK_BOT_TOKEN)
+
+# The shared handlers post through a synchronous client from the handler pool
+client = InstrumentedWebClient(token=SLACK_BOT_TOKEN)
+executor = ThreadPoolExecutor(max_workers=ASYNC_HANDLER_WORKERS, thread_name_prefix="handler")
+
+# Register commands and message handler
+register_async_handlers(app, client, executor)
+
+async def main():
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT, METRICS_HOST, ready=startup.is_ready)
+    # Picks up registrations and new orgs/users made by other processes
+    cache_sync.start()
+    startup.start_warm_up(client)
+    start_message_scheduler(client)
+    start_outbox_flusher(client)
+    # Connecting makes Slack route events here, so give warm-up a chance to finish first
+    if not await asyncio.to_thread(startup.wait_until_ready, WARMUP_TIMEOUT):
+        logger.warning(f"Warm-up still running after {WARMUP_TIMEOUT}s, connecting anyway")
+    handler = AsyncSocketModeHandler(app, SLACK_APP_TOKEN)
+    try:
+        await handler.start_async()
+    finally:
+        await close_async_session()
+
+if __name__ == "__main__":
+    asyncio.run(main())
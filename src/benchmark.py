@@ -0,0 +1,286 @@
+import argparse
+import itertools
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from stand_ins import FakeLivePMServer, FakeSlackClient
+
+FLOWS = ("add_signal", "add_signal_inline", "register_user", "register_organization")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Drive whole bot flows against local Slack and LivePM stand-ins.")
+    parser.add_argument("--users", type=int, default=20, help="concurrent simulated users")
+    parser.add_argument("--iterations", type=int, default=5, help="flows per user for each flow type")
+    parser.add_argument("--flows", default=",".join(FLOWS), help="comma-separated flow types to run")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="seconds added to each LivePM response")
+    parser.add_argument("--api-error-rate", type=float, default=0.0, help="fraction of LivePM requests answered 503")
+    parser.add_argument("--slack-latency", type=float, default=0.01, help="seconds added to each Slack Web API call")
+    parser.add_argument("--flow-timeout", type=float, default=30.0, help="seconds before an unfinished flow counts as failed")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON report to compare p95 latency against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="allowed fractional p95 increase over the baseline before exiting non-zero")
+    return parser.parse_args(argv)
+
+def percentile(values, quantile):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * quantile))]
+
+def peak_rss_kb():
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+class BotUnderTest:
+    def __init__(self, client):
+        # The bot reads its configuration at import time, so import only once the environment is set
+        from async_bridge import ListenerCollector
+        from commands import register_commands
+        from message_handler import register_message_handler
+        self.client = client
+        self.listeners = ListenerCollector()
+        register_commands(self.listeners)
+        register_message_handler(self.listeners)
+        self._ids = itertools.count(1)
+
+    def _say(self, channel_id):
+        def say(text="", **kwargs):
+            return self.client.chat_postMessage(channel=channel_id, text=text, **kwargs)
+        return say
+
+    def command(self, name, user_id, team_id, text=""):
+        delivery = next(self._ids)
+        self.deliver_command({
+            "command": name,
+            "text": text,
+            "user_id": user_id,
+            "team_id": team_id,
+            "channel_id": f"C{team_id}",
+            "trigger_id": f"benchmark-trigger-{delivery}",
+        })
+
+    def message(self, user_id, text):
+        delivery = next(self._ids)
+        self.deliver_message({
+            "type": "message",
+            "user": user_id,
+            "channel": f"D{user_id}",
+            "channel_type": "im",
+            "text": text,
+            "ts": f"{delivery}.000000",
+            "client_msg_id": f"benchmark-message-{delivery}",
+        }, {"event_id": f"Ev{delivery}"})
+
+    def deliver_command(self, command):
+        self._wait(self.listeners.commands[command["command"]](
+            ack=lambda *args, **kwargs: None, say=self._say(command["channel_id"]), command=command, client=self.client
+        ))
+
+    def deliver_message(self, event, body):
+        self._wait(self.listeners.events["message"](
+            event=event, say=self._say(event["channel"]), client=self.client, body=body
+        ))
+
+    def _wait(self, result):
+        # Listeners hand their work to the per-workspace scheduler; wait for it like Bolt's thread used to
+        if isinstance(result, Future):
+            result.result()
+
+class Benchmark:
+    def __init__(self, args, server, client, bot):
+        self.args = args
+        self.server = server
+        self.client = client
+        self.bot = bot
+        self._sequence = itertools.count(1)
+
+    def setup_user(self, index):
+        user_id = f"UBENCH{index}"
+        team_id = f"TBENCH{index}"
+        # Registered workspace and Slack user for the add_signal and register_user flows
+        self.server.state.teams[team_id] = 1
+        self.server.state.slack_users[user_id] = 1
+        return user_id, team_id
+
+    def add_signal(self, user_id, team_id):
+        channel_id = f"D{user_id}"
+        done = self.client.expect_message(channel_id, lambda text: text.startswith(("Signal added", "Failed to add signal")))
+        try:
+            self.bot.command("/add_signal", user_id, team_id)
+            self.bot.message(user_id, "1,2")
+            self.bot.message(user_id, f"Benchmark signal {next(self._sequence)}")
+            return done.wait(self.args.flow_timeout)
+        finally:
+            self.client.forget_expectations(channel_id)
+
+    def add_signal_inline(self, user_id, team_id):
+        channel_id = f"D{user_id}"
+        done = self.client.expect_message(channel_id, lambda text: text.startswith(("Signal added", "Failed to add signal")))
+        try:
+            self.bot.command("/add_signal", user_id, team_id, f"1,2 | Benchmark signal {next(self._sequence)}")
+            return done.wait(self.args.flow_timeout)
+        finally:
+            self.client.forget_expectations(channel_id)
+
+    def register_user(self, user_id, team_id):
+        channel_id = f"D{user_id}"
+        done = self.client.expect_message(channel_id, lambda text: "registration successful" in text)
+        try:
+            self.bot.command("/register_user", user_id, team_id)
+            self.bot.message(user_id, "new")
+            self.bot.message(user_id, f"Benchmark user {next(self._sequence)}")
+            return done.wait(self.args.flow_timeout)
+        finally:
+            self.client.forget_expectations(channel_id)
+
+    def register_organization(self, user_id, team_id):
+        channel_id = f"D{user_id}"
+        # A fresh, unregistered workspace each time
+        team_id = f"TNEW{next(self._sequence)}"
+        done = self.client.expect_message(channel_id, lambda text: "registered with your Slack workspace" in text)
+        try:
+            self.bot.command("/register_organization", user_id, team_id)
+            self.bot.message(user_id, "new")
+            self.bot.message(user_id, f"Benchmark customer {next(self._sequence)}")
+            return done.wait(self.args.flow_timeout)
+        finally:
+            self.client.forget_expectations(channel_id)
+
+    def run_flow(self, flow, users):
+        run_one = getattr(self, flow)
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def simulate(user):
+            for _ in range(self.args.iterations):
+                started = time.perf_counter()
+                try:
+                    error = None if run_one(*user) else "timed out"
+                except Exception as e:
+                    error = str(e)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    if error is None:
+                        latencies.append(elapsed)
+                    else:
+                        errors.append(error)
+
+        backend_before = self.server.call_counts()
+        slack_before = self.client.call_counts()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(users)) as pool:
+            list(pool.map(simulate, users))
+        duration = time.perf_counter() - started
+
+        flows_run = len(users) * self.args.iterations
+        backend_calls = {path: count - backend_before.get(path, 0) for path, count in self.server.call_counts().items()
+                         if count - backend_before.get(path, 0)}
+        slack_calls = {method: count - slack_before.get(method, 0) for method, count in self.client.call_counts().items()
+                       if count - slack_before.get(method, 0)}
+        return {
+            "flows": flows_run,
+            "completed": len(latencies),
+            "errors": len(errors),
+            "error_samples": sorted(set(errors))[:5],
+            "duration_seconds": duration,
+            "throughput_per_second": len(latencies) / duration if duration else 0.0,
+            "latency_seconds": {
+                "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+                "p50": percentile(latencies, 0.5),
+                "p95": percentile(latencies, 0.95),
+                "p99": percentile(latencies, 0.99),
+                "max": max(latencies) if latencies else 0.0,
+            },
+            "backend_calls_per_flow": sum(backend_calls.values()) / flows_run,
+            "slack_calls_per_flow": sum(slack_calls.values()) / flows_run,
+            "backend_calls": backend_calls,
+            "slack_calls": slack_calls,
+        }
+
+def compare(report, baseline, max_regression):
+    regressions = []
+    for flow, result in report["flows"].items():
+        previous = baseline.get("flows", {}).get(flow)
+        if not previous or not previous["latency_seconds"]["p95"]:
+            continue
+        change = result["latency_seconds"]["p95"] / previous["latency_seconds"]["p95"] - 1
+        if change > max_regression:
+            regressions.append(f"{flow}: p95 {previous['latency_seconds']['p95']:.3f}s -> "
+                               f"{result['latency_seconds']['p95']:.3f}s (+{change:.0%})")
+    return regressions
+
+def main(argv=None):
+    args = parse_args(argv)
+    flows = [flow.strip() for flow in args.flows.split(",") if flow.strip()]
+    unknown = set(flows) - set(FLOWS)
+    if unknown:
+        raise SystemExit(f"Unknown flow(s): {', '.join(sorted(unknown))}")
+
+    server = FakeLivePMServer(latency=args.api_latency, error_rate=args.api_error_rate).start()
+    workdir = tempfile.TemporaryDirectory(prefix="signalbot-benchmark-")
+    os.environ.update({
+        "API_BASE_URL": server.base_url,
+        "API_KEY": "benchmark",
+        "SLACK_BOT_TOKEN": "xoxb-benchmark",
+        "SLACK_APP_TOKEN": "xapp-benchmark",
+        "OUTBOX_DB_PATH": os.path.join(workdir.name, "signal_outbox.db"),
+    })
+    os.environ.setdefault("STATE_DB_PATH", os.path.join(workdir.name, "conversation_states.db"))
+    os.environ.setdefault("OUTBOX_POLL_INTERVAL", "0.05")
+
+    flusher = None
+    try:
+        client = FakeSlackClient(latency=args.slack_latency)
+        bot = BotUnderTest(client)
+        from outbox import start_outbox_flusher
+        flusher = start_outbox_flusher(client)
+
+        benchmark = Benchmark(args, server, client, bot)
+        users = [benchmark.setup_user(index) for index in range(args.users)]
+        report = {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "config": {
+                "users": args.users,
+                "iterations": args.iterations,
+                "api_latency": args.api_latency,
+                "api_error_rate": args.api_error_rate,
+                "slack_latency": args.slack_latency,
+                "state_backend": os.environ.get("STATE_BACKEND", "memory"),
+            },
+            "flows": {},
+        }
+        for flow in flows:
+            report["flows"][flow] = benchmark.run_flow(flow, users)
+    finally:
+        if flusher is not None:
+            flusher.stop(timeout=5)
+        server.stop()
+        workdir.cleanup()
+    report["peak_rss_kb"] = peak_rss_kb()
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+import csv
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from api_client import get_customer_org_id, get_livepm_user_id, get_organizations, get_users, resolve_name, ApiRejectedError
+from cache import MISSING
+from outbox import OutboxEntry, signal_payload, get_outbox, create_signal, call_worst_case
+from tracing import bind
+from bulkheads import customer_org
+from config import (
+    IMPORT_CONCURRENCY, IMPORT_PROGRESS_EVERY, IMPORT_MAX_JOBS, API_CONNECT_TIMEOUT, API_READ_TIMEOUT, OUTBOX_RETRY_DELAY
+)
+
+logger = logging.getLogger(__name__)
+
+IMPORT_EXTENSIONS = (".csv", ".jsonl", ".ndjson")
+ERROR_COLUMNS = ("line", "error", "row")
+
+class RowError(Exception):
+    pass
+
+def detect_format(name):
+    return "jsonl" if name.lower().endswith((".jsonl", ".ndjson")) else "csv"
+
+def read_rows(lines, fmt):
+    # Yields (line number, row) one at a time from any iterable of text lines.
+    # A row that can't be parsed is yielded as a RowError.
+    if fmt == "jsonl":
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield number, RowError(f"invalid JSON: {str(e)}")
+                continue
+            yield number, row if isinstance(row, dict) else RowError("each line must be a JSON object")
+        return
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, {str(key).strip().lower(): value for key, value in row.items() if key is not None}
+
+def split_references(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        references = [str(item).strip() for item in value]
+    else:
+        references = [part.strip() for part in re.split(r"[;,]", str(value))]
+    references = [reference for reference in references if reference]
+    return [] if [reference.lower() for reference in references] == ["none"] else references
+
+class RowResolver:
+    # Turns an import row into a /signal/create payload using the cached listings
+    def __init__(self, customer_org_id, default_user_id=None):
+        self.customer_org_id = customer_org_id
+        self.default_user_id = default_user_id
+
+    def resolve(self, row):
+        text = str(row.get("signal") or row.get("text") or "").strip()
+        if not text:
+            raise RowError("missing signal text")
+        organizations = row.get("organizations", row.get("organization_ids"))
+        org_ids = [
+            self._resolve_reference("organizations", "organization", reference, get_organizations)
+            for reference in split_references(organizations)
+        ]
+        return signal_payload(text, org_ids, self._resolve_user(row))
+
+    def _resolve_reference(self, kind, noun, reference, load_rows):
+        if reference.isdigit():
+            return int(reference)
+        rows = load_rows(self.customer_org_id)
+        if rows is None:
+            raise RowError(f"could not load {kind} to match '{reference}'")
+        match, shortlist = resolve_name((kind, self.customer_org_id), rows, reference)
+        if match is not None:
+            return match['id']
+        if shortlist:
+            candidates = ", ".join(f"{row['name']} ({row['id']})" for row in shortlist)
+            raise RowError(f"'{reference}' matches more than one {noun}: {candidates}")
+        raise RowError(f"no {noun} matches '{reference}'")
+
+    def _resolve_user(self, row):
+        user = str(row.get("user_id") or row.get("user") or "").strip()
+        if user:
+            return self._resolve_reference("users", "user", user, get_users)
+        slack_id = str(row.get("slack_id") or "").strip()
+        if slack_id:
+            user_id = get_livepm_user_id(slack_id)
+            if user_id is MISSING:
+                raise RowError(f"could not look up Slack user {slack_id}")
+            if user_id is None:
+                raise RowError(f"Slack user {slack_id} is not registered")
+            return user_id
+        if self.default_user_id is None:
+            raise RowError("no user_id, user or slack_id given")
+        return self.default_user_id
+
+def submit_signal(payload):
+    # Journals the signal in the outbox and sends it straight away. Returns the response, or None
+    # when LivePM couldn't take it now and it was left for the outbox flusher to retry.
+    # The entry is held back from flushers while this call sends it.
+    outbox = get_outbox()
+    entry = OutboxEntry(outbox.enqueue(payload, None, None, delay=call_worst_case()), payload, None, None, 0)
+    try:
+        response = create_signal(entry)
+    except ApiRejectedError as e:
+        outbox.complete(entry)
+        raise RowError(f"the LivePM API rejected the signal: {e.reason}")
+    if response is None:
+        entry.attempts += 1
+        outbox.retry_later(entry, OUTBOX_RETRY_DELAY)
+        return None
+    outbox.complete(entry)
+    return response
+
+class BulkImporter:
+    # Resolves and submits rows with bounded concurrency. At most 2 * concurrency
+    # rows are held at once, so memory doesn't grow with the size of the input.
+    def __init__(self, resolver, concurrency=IMPORT_CONCURRENCY, error_file=None, progress=None,
+                 progress_every=IMPORT_PROGRESS_EVERY):
+        self.resolver = resolver
+        self.concurrency = concurrency
+        self.progress = progress
+        self.progress_every = progress_every
+        self._errors = None
+        if error_file is not None:
+            self._errors = csv.writer(error_file)
+            self._errors.writerow(ERROR_COLUMNS)
+        self._lock = threading.Lock()
+        self.rows = 0
+        self.submitted = 0
+        self.queued = 0
+        self.failed = 0
+        self.started_at = None
+
+    def run(self, rows):
+        self.started_at = time.monotonic()
+        slots = threading.BoundedSemaphore(self.concurrency * 2)
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="import") as executor:
+            for number, row in rows:
+                slots.acquire()
+                # Rows run in the caller's context, and so count against its customer organization's cap
+                future = executor.submit(bind(self._import_row), number, row)
+                future.add_done_callback(lambda _: slots.release())
+        return self.stats()
+
+    def _import_row(self, number, row):
+        error = None
+        queued = False
+        try:
+            if isinstance(row, RowError):
+                raise row
+            queued = submit_signal(self.resolver.resolve(row)) is None
+        except RowError as e:
+            error = str(e)
+        except Exception as e:
+            logger.error(f"Unexpected error importing line {number}: {str(e)}")
+            error = f"unexpected error: {str(e)}"
+        with self._lock:
+            self.rows += 1
+            if error is None and queued:
+                self.queued += 1
+            elif error is None:
+                self.submitted += 1
+            else:
+                self.failed += 1
+                if self._errors is not None:
+                    self._errors.writerow((number, error, "" if isinstance(row, RowError) else json.dumps(row)))
+            report = self.progress is not None and self.rows % self.progress_every == 0
+        if report:
+            self.progress(self.stats())
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started_at if self.started_at is not None else 0.0
+        with self._lock:
+            return {
+                "rows": self.rows,
+                "submitted": self.submitted,
+                "queued": self.queued,
+                "failed": self.failed,
+                "elapsed_seconds": elapsed,
+                "rows_per_second": self.rows / elapsed if elapsed else 0.0,
+            }
+
+def describe(stats):
+    queued = f", {stats['queued']} queued for retry" if stats.get('queued') else ""
+    return (f"{stats['rows']} rows, {stats['submitted']} added{queued}, {stats['failed']} failed "
+            f"in {stats['elapsed_seconds']:.1f}s")
+
+def is_import_file(file_info):
+    return str(file_info.get('name', '')).lower().endswith(IMPORT_EXTENSIONS)
+
+_jobs = None
+_jobs_lock = threading.Lock()
+
+def _get_jobs():
+    global _jobs
+    if _jobs is None:
+        with _jobs_lock:
+            if _jobs is None:
+                _jobs = ThreadPoolExecutor(max_workers=IMPORT_MAX_JOBS, thread_name_prefix="import-job")
+    return _jobs
+
+def start_file_import(client, file_info, user_id, team_id, channel_id):
+    # Runs a file shared with the bot in the background and reports back to channel_id
+    name = file_info.get('name', 'file')
+    client.chat_postMessage(channel=channel_id, text=f"Importing signals from {name}. I'll post progress here.")
+    return _get_jobs().submit(_run_file_import, client, file_info, user_id, team_id, channel_id)
+
+def _run_file_import(client, file_info, user_id, team_id, channel_id):
+    name = file_info.get('name', 'file')
+    errors_path = None
+    try:
+        customer_org_id = get_customer_org_id(team_id)
+        if not customer_org_id:
+            client.chat_postMessage(
+                channel=channel_id,
+                text="Your Slack workspace is not registered. Please use the /register_organization command first."
+            )
+            return
+        # Rows without a user are added as the person who shared the file
+        default_user_id = get_livepm_user_id(user_id)
+        if default_user_id is MISSING:
+            default_user_id = None
+
+        url = file_info.get('url_private_download') or file_info['url_private']
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", prefix="import-errors-", newline="", delete=False) as errors, \
+                requests.get(url, headers={"Authorization": f"Bearer {client.token}"}, stream=True,
+                             timeout=(API_CONNECT_TIMEOUT, API_READ_TIMEOUT)) as response:
+            errors_path = errors.name
+            response.raise_for_status()
+            response.raw.decode_content = True
+            # Leave the stream open at EOF so the text wrapper can see the end of the file
+            response.raw.auto_close = False
+            lines = io.TextIOWrapper(response.raw, encoding="utf-8-sig", newline="")
+            importer = BulkImporter(
+                RowResolver(customer_org_id, default_user_id), error_file=errors,
+                progress=lambda stats: client.chat_postMessage(
+                    channel=channel_id, text=f"Import of {name} in progress: {describe(stats)}."
+                )
+            )
+            # A large backfill shares its organization's LivePM cap instead of taking the whole pool
+            with customer_org(customer_org_id):
+                stats = importer.run(read_rows(lines, detect_format(name)))
+        client.chat_postMessage(channel=channel_id, text=f"Import of {name} finished: {describe(stats)}.")
+        if stats['failed']:
+            client.files_upload_v2(
+                channel=channel_id, file=errors_path, filename=f"{os.path.splitext(name)[0]}-errors.csv",
+                initial_comment="Rows that could not be imported, with the reason for each."
+            )
+    except Exception as e:
+        logger.error(f"Import of {name} failed: {str(e)}")
+        client.chat_postMessage(channel=channel_id, text=f"Import of {name} failed: {str(e)}")
+    finally:
+        if errors_path is not None:
+            os.unlink(errors_path)
@@ -0,0 +1,248 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
+from metrics import REGISTRY
+from config import HANDLER_WORKERS, TENANT_CONCURRENCY, TENANT_MAX_QUEUE, TENANT_WEIGHTS, API_ORG_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+_customer_org = contextvars.ContextVar("signalbot_customer_org", default=None)
+
+class TenantBusyError(Exception):
+    pass
+
+tenant_wait = REGISTRY.histogram(
+    "signalbot_tenant_wait_seconds", "Time handler work waited in its workspace's queue", ("team_id",))
+tenant_rejected = REGISTRY.counter(
+    "signalbot_tenant_rejected_total", "Handler work turned away because the workspace's queue was full", ("team_id",))
+org_wait = REGISTRY.histogram(
+    "signalbot_livepm_org_wait_seconds", "Time LivePM calls waited for a slot of their customer organization",
+    ("customer_org_id",))
+
+class _Tenant:
+    __slots__ = ("team_id", "weight", "queue", "running", "deficit")
+
+    def __init__(self, team_id, weight):
+        self.team_id = team_id
+        self.weight = weight
+        self.queue = deque()
+        self.running = 0
+        self.deficit = 0
+
+class FairScheduler:
+    # Each workspace gets its own queue and at most tenant_concurrency of the worker
+    # threads. Workers take the next job by deficit round-robin over the workspaces
+    # with work waiting, so a workspace with weight 3 gets three turns for every one
+    # of a weight 1 workspace, and nobody waits behind another workspace's backlog.
+    def __init__(self, workers=16, tenant_concurrency=4, max_queue=100, weights=None):
+        self.workers = workers
+        self.tenant_concurrency = tenant_concurrency
+        self.max_queue = max_queue
+        self.weights = weights or {}
+        self._tenants = {}
+        self._active = deque()
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def submit(self, team_id, func, *args, **kwargs):
+        # Queues func for team_id's workspace and returns a Future; raises TenantBusyError when its queue is full
+        team_id = str(team_id or "unknown")
+        future = Future()
+        job = (func, args, kwargs, future, contextvars.copy_context(), time.perf_counter())
+        with self._cond:
+            tenant = self._tenants.get(team_id)
+            if tenant is None:
+                tenant = self._tenants[team_id] = _Tenant(team_id, self.weights.get(team_id, 1))
+            if len(tenant.queue) >= self.max_queue:
+                tenant_rejected.labels(team_id).inc()
+                raise TenantBusyError(f"Workspace {team_id} already has {len(tenant.queue)} requests waiting")
+            if not tenant.queue:
+                self._active.append(tenant)
+            tenant.queue.append(job)
+            if len(self._threads) < self.workers:
+                self._start_worker()
+            self._cond.notify()
+        return future
+
+    def _start_worker(self):
+        thread = threading.Thread(target=self._run, name=f"handler-{len(self._threads)}", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _next(self):
+        # Called with the condition held; returns (tenant, job) or None if nothing can run yet
+        for _ in range(len(self._active)):
+            tenant = self._active[0]
+            if tenant.running >= self.tenant_concurrency:
+                self._active.rotate(-1)
+                continue
+            if tenant.deficit < 1:
+                tenant.deficit += tenant.weight
+            job = tenant.queue.popleft()
+            tenant.deficit -= 1
+            tenant.running += 1
+            if not tenant.queue:
+                self._active.popleft()
+                tenant.deficit = 0
+            elif tenant.deficit < 1:
+                self._active.rotate(-1)
+            return tenant, job
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                selected = self._next()
+                while selected is None:
+                    self._cond.wait()
+                    selected = self._next()
+            tenant, (func, args, kwargs, future, context, queued_at) = selected
+            tenant_wait.labels(tenant.team_id).observe(time.perf_counter() - queued_at)
+            try:
+                if future.set_running_or_notify_cancel():
+                    future.set_result(context.run(func, *args, **kwargs))
+            except Exception as e:
+                logger.error(f"Handler for workspace {tenant.team_id} failed: {str(e)}")
+                future.set_exception(e)
+            finally:
+                with self._cond:
+                    tenant.running -= 1
+                    if not tenant.running and not tenant.queue:
+                        del self._tenants[tenant.team_id]
+                    # A worker may be waiting on this workspace's concurrency limit
+                    self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                team_id: {"queued": len(tenant.queue), "running": tenant.running}
+                for team_id, tenant in self._tenants.items()
+            }
+
+handler_scheduler = FairScheduler(HANDLER_WORKERS, TENANT_CONCURRENCY, TENANT_MAX_QUEUE, TENANT_WEIGHTS)
+
+def run_for_tenant(team_id, func, *args, **kwargs):
+    # Runs func through the fair scheduler, or right here when HANDLER_WORKERS is 0
+    if handler_scheduler.workers <= 0:
+        future = Future()
+        # In a copy of the context, so use_customer_org() doesn't outlive the handler
+        future.set_result(contextvars.copy_context().run(func, *args, **kwargs))
+        return future
+    return handler_scheduler.submit(team_id, func, *args, **kwargs)
+
+def _acked(*args, **kwargs):
+    pass
+
+def fair_scheduled(func):
+    # For slash command listeners: acks straight away, then queues the handler under the command's workspace
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        kwargs["ack"]()
+        kwargs["ack"] = _acked
+        try:
+            return run_for_tenant(kwargs["command"].get("team_id"), func, *args, **kwargs)
+        except TenantBusyError:
+            kwargs["say"]("Your workspace has a lot of requests in progress. Please try again in a moment.")
+    return wrapper
+
+class OrgBulkheads:
+    # Caps LivePM calls in flight per customer organization, so one organization's
+    # backfill can't take every pooled connection
+    def __init__(self, limit=4):
+        self.limit = limit
+        self._semaphores = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, key):
+        with self._lock:
+            semaphore = self._semaphores.get(key)
+            if semaphore is None:
+                semaphore = self._semaphores[key] = threading.BoundedSemaphore(self.limit)
+        return semaphore
+
+    def _enter(self, key, started):
+        org_wait.labels(key).observe(time.perf_counter() - started)
+        with self._lock:
+            self._in_flight[key] = self._in_flight.get(key, 0) + 1
+
+    def _leave(self, key, semaphore):
+        with self._lock:
+            self._in_flight[key] -= 1
+        semaphore.release()
+
+    @contextmanager
+    def slot(self, customer_org_id):
+        if not self.limit or customer_org_id is None:
+            yield
+            return
+        key = str(customer_org_id)
+        semaphore = self._semaphore(key)
+        started = time.perf_counter()
+        semaphore.acquire()
+        self._enter(key, started)
+        try:
+            yield
+        finally:
+            self._leave(key, semaphore)
+
+    @asynccontextmanager
+    async def async_slot(self, customer_org_id, poll_interval=0.01):
+        # The same cap for the async runtime; polls the semaphore so the event loop never blocks on it
+        if not self.limit or customer_org_id is None:
+            yield
+            return
+        key = str(customer_org_id)
+        semaphore = self._semaphore(key)
+        started = time.perf_counter()
+        while not semaphore.acquire(blocking=False):
+            await asyncio.sleep(poll_interval)
+        self._enter(key, started)
+        try:
+            yield
+        finally:
+            self._leave(key, semaphore)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._in_flight)
+
+org_bulkheads = OrgBulkheads(API_ORG_CONCURRENCY)
+
+def use_customer_org(customer_org_id):
+    # LivePM calls made for the rest of the current handler (and work it hands off
+    # through bind()) count against this customer organization's cap
+    _customer_org.set(customer_org_id)
+
+@contextmanager
+def customer_org(customer_org_id):
+    token = _customer_org.set(customer_org_id)
+    try:
+        yield
+    finally:
+        _customer_org.reset(token)
+
+def backend_slot():
+    return org_bulkheads.slot(_customer_org.get())
+
+def async_backend_slot():
+    return org_bulkheads.async_slot(_customer_org.get())
+
+def _collect_metrics():
+    tenants = handler_scheduler.stats()
+    return [
+        ("signalbot_tenant_queue_depth", "Handler work waiting per workspace", ("team_id",),
+         {(team_id,): stats["queued"] for team_id, stats in tenants.items()}),
+        ("signalbot_tenant_running", "Handler work running per workspace", ("team_id",),
+         {(team_id,): stats["running"] for team_id, stats in tenants.items()}),
+        ("signalbot_livepm_org_in_flight", "LivePM calls in flight per customer organization", ("customer_org_id",),
+         {(key,): value for key, value in org_bulkheads.stats().items()}),
+    ]
+
+REGISTRY.register_collector(_collect_metrics)
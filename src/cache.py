@@ -0,0 +1,177 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by TTLCache.get() on a miss, so a cached None can be told apart
+MISSING = object()
+
+class _Flight:
+    __slots__ = ("event", "value", "error", "stale")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        self.stale = False
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.loads = 0
+        self.coalesced = 0
+        # Bumped by every invalidate(), so loads that can't use a flight can still tell one happened
+        self.invalidations = 0
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def add(self, key, value=True, ttl=None):
+        # Stores value only if key has no live entry; returns whether it was stored
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > now:
+                return False
+            self._data[key] = (value, now + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def update(self, key, func):
+        # Applies func to a live cached value, keeping its expiry; returns False on a miss
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                return False
+            self._data[key] = (func(entry[0]), entry[1])
+            return True
+
+    def get_or_load(self, key, loader, ttl=None):
+        # Concurrent misses for the same key wait on a single loader call.
+        # A None result is returned but not cached.
+        value = self.get(key)
+        if value is not MISSING:
+            return value
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.loads += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            value = loader()
+            # An invalidate() during the load means the result may predate a write
+            if value is not None and not flight.stale:
+                self.set(key, value, ttl)
+            flight.value = value
+            return value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+
+    def invalidate(self, key):
+        with self._lock:
+            self.invalidations += 1
+            self._data.pop(key, None)
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.stale = True
+
+    def items(self):
+        # Live (key, value, seconds left) entries
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value, expires_at - now) for key, (value, expires_at) in self._data.items() if expires_at > now]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "loads": self.loads,
+                "coalesced": self.coalesced,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+def save_snapshot(cache, path):
+    # Expiry is stored as wall-clock time so entries keep their remaining TTL across a restart.
+    # The file is replaced atomically, so a crash never leaves half a snapshot.
+    now = time.time()
+    entries = [[key, value, now + ttl] for key, value, ttl in cache.items()]
+    fd, temporary = tempfile.mkstemp(prefix=os.path.basename(path), dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "w") as snapshot:
+            json.dump(entries, snapshot)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    return len(entries)
+
+def load_snapshot(cache, path):
+    # Returns the number of unexpired entries restored; a missing file restores nothing
+    try:
+        with open(path) as snapshot:
+            entries = json.load(snapshot)
+    except FileNotFoundError:
+        return 0
+    now = time.time()
+    loaded = 0
+    for key, value, expires_at in entries:
+        if expires_at > now:
+            cache.set(key, value, ttl=expires_at - now)
+            loaded += 1
+    return loaded
@@ -0,0 +1,118 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from metrics import REGISTRY
+from config import CACHE_SYNC, CACHE_SYNC_INTERVAL, CACHE_SYNC_RETENTION, STATE_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+def _encode_key(key):
+    return json.dumps(list(key) if isinstance(key, tuple) else key)
+
+def _decode_key(value):
+    key = json.loads(value)
+    return tuple(key) if isinstance(key, list) else key
+
+class CacheSync:
+    # Worker processes keep their own caches; a change made by one is published to a
+    # table in the shared SQLite file and applied by the others when they next poll it.
+    def __init__(self, path, interval=1.0, retention=600):
+        self.interval = interval
+        self.retention = retention
+        self.origin = uuid.uuid4().hex
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.published = 0
+        self.applied = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_events (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "origin TEXT NOT NULL, cache TEXT NOT NULL, key TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        # Only changes made from now on matter; this process's caches start empty
+        self._last_seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM cache_events").fetchone()[0]
+
+    def on(self, cache, handler):
+        # handler(key) runs in this process for each change another process publishes to cache
+        self._handlers[cache] = handler
+
+    def publish(self, cache, key):
+        # Never fails the change itself; other workers then catch up when their entry expires
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT INTO cache_events (origin, cache, key, created_at) VALUES (?, ?, ?, ?)",
+                    (self.origin, cache, _encode_key(key), time.time())
+                )
+                self.published += 1
+        except sqlite3.Error as e:
+            logger.error(f"Publishing a {cache} cache change failed: {str(e)}")
+
+    def poll(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, origin, cache, key FROM cache_events WHERE seq > ? ORDER BY seq", (self._last_seq,)
+            ).fetchall()
+            if rows:
+                self._last_seq = rows[-1][0]
+        for seq, origin, cache, key in rows:
+            handler = self._handlers.get(cache)
+            if origin == self.origin or handler is None:
+                continue
+            try:
+                handler(_decode_key(key))
+                self.applied += 1
+            except Exception as e:
+                logger.error(f"Applying a {cache} cache change failed: {str(e)}")
+        return len(rows)
+
+    def prune(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache_events WHERE created_at < ?", (time.time() - self.retention,))
+
+    def _run(self):
+        polls = 0
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.poll()
+                polls += 1
+                if polls % 100 == 0:
+                    self.prune()
+            except Exception as e:
+                logger.error(f"Cache sync poll failed: {str(e)}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="cache-sync", daemon=True)
+            self._thread.start()
+        return self
+
+class _NoSync:
+    # Single-process default: there is nobody to tell
+    def on(self, cache, handler):
+        pass
+
+    def publish(self, cache, key):
+        pass
+
+    def start(self):
+        return self
+
+cache_sync = CacheSync(STATE_DB_PATH, CACHE_SYNC_INTERVAL, CACHE_SYNC_RETENTION) if CACHE_SYNC else _NoSync()
+
+def _collect_metrics():
+    if not isinstance(cache_sync, CacheSync):
+        return []
+    return [
+        ("signalbot_cache_sync_published", "Cache changes published to other workers", (), cache_sync.published),
+        ("signalbot_cache_sync_applied", "Cache changes from other workers applied here", (), cache_sync.applied),
+    ]
+
+REGISTRY.register_collector(_collect_metrics)
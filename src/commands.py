@@ -1,81 +1,184 @@
-from api_client import get_customer_org_id
-from utils import show_organizations, show_users, show_customer_organizations
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cache import MISSING
+from api_client import get_customer_org_id, get_organizations, get_customer_organizations, get_livepm_user_id
+from utils import show_organizations, show_users, show_customer_organizations, open_dm
 from config import conversation_states
+from state_store import ConversationState
+from dedupe import first_delivery, user_lock
+from slack_outbound import hold_messages
+from metrics import instrumented_command
+from tracing import traced, annotate, current_trace_id, bind
+from bulkheads import fair_scheduled, use_customer_org
+from conversation_handlers import conversation_machine, resolve_selection
+from config import FAN_OUT_WORKERS, PREFETCH_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+_fan_out = None
+_fan_out_lock = threading.Lock()
+
+def submit(func, *args):
+    # Runs an independent lookup at the start of a flow alongside the others
+    global _fan_out
+    if _fan_out is None:
+        with _fan_out_lock:
+            if _fan_out is None:
+                _fan_out = ThreadPoolExecutor(max_workers=FAN_OUT_WORKERS, thread_name_prefix="fan-out")
+    return _fan_out.submit(bind(func), *args)
+
+def prefetched_user_id(future, timeout=PREFETCH_TIMEOUT):
+    # The prefetched LivePM user ID, or None to have the signal step look it up itself
+    try:
+        user_id = future.result(timeout)
+    except Exception:
+        return None
+    return None if user_id is MISSING else user_id
+
+def parse_inline_signal(text):
+    # "/add_signal <org IDs or names, or none> | <signal text>" -> (orgs, signal text)
+    orgs, separator, signal_text = (text or '').partition('|')
+    if not separator or not orgs.strip() or not signal_text.strip():
+        return None
+    return orgs.strip(), signal_text.strip()
 
 def register_commands(app):
     @app.command("/add_signal")
+    @fair_scheduled
+    @instrumented_command("/add_signal")
+    @traced("command", command="/add_signal")
     def handle_add_signal_command(ack, say, command, client):
         ack()
+        if not first_delivery(command.get('trigger_id')):
+            return
+        annotate(user_id=command['user_id'], team_id=command['team_id'])
         try:
-            team_id = command['team_id']
-            customer_org_id = get_customer_org_id(team_id)
-            if not customer_org_id:
-                say("Your Slack workspace is not registered. Please use the /register_organization command first.")
-                return
+            with user_lock(command['user_id']):
+                # Opening the DM doesn't depend on the workspace lookup
+                dm_future = submit(open_dm, client, command['user_id'])
+                with hold_messages():
+                    customer_org_id = get_customer_org_id(command['team_id'])
+                    if not customer_org_id:
+                        say("Your Slack workspace is not registered. Please use the /register_organization command first.")
+                        return
+                    use_customer_org(customer_org_id)
+                    # LivePM lookups start only now, so they count against the customer organization's cap
+                    user_future = submit(get_livepm_user_id, command['user_id'])
+                    # Load the organization listing while the DM opens
+                    organizations_future = submit(get_organizations, customer_org_id)
+                    dm_channel_id = dm_future.result()
 
-            dm = client.conversations_open(users=[command['user_id']])
-            dm_channel_id = dm['channel']['id']
-            
-            show_organizations(client, dm_channel_id, customer_org_id)
-            
-            conversation_states[command['user_id']] = {
-                'state': 'awaiting_org_selection',
-                'dm_channel_id': dm_channel_id,
-                'selected_org_ids': [],
-                'customer_org_id': customer_org_id
-            }
+                    inline = parse_inline_signal(command.get('text'))
+                    pending_signal = None
+                    if inline is not None:
+                        org_text, signal_text = inline
+                        org_ids = [] if org_text.lower() == 'none' else resolve_selection(
+                            client, dm_channel_id, ('organizations', customer_org_id),
+                            organizations_future.result, org_text,
+                            f"I couldn't find organization(s) '{org_text}'. Please pick them below instead.",
+                            multiple=True
+                        )
+                        if org_ids is not None:
+                            # Straight to the signal step, as if the orgs had been picked interactively
+                            conversation_machine.dispatch(ConversationState(
+                                'awaiting_signal',
+                                dm_channel_id,
+                                customer_org_id=customer_org_id,
+                                selected_org_ids=org_ids,
+                                livepm_user_id=prefetched_user_id(user_future),
+                                trace_id=current_trace_id()
+                            ), command['user_id'], dm_channel_id, signal_text, client)
+                            return
+                        # Kept until the organizations are picked, then queued without asking for it again
+                        pending_signal = {'text': signal_text, 'org_ids': []}
+
+                    organizations_future.result()
+                    show_organizations(client, dm_channel_id, customer_org_id)
+
+                # The organization list goes out without waiting for the user lookup. The lock is
+                # held until the state is saved, so a reply to the list still finds the conversation.
+                conversation_states.save(command['user_id'], ConversationState(
+                    'awaiting_org_selection',
+                    dm_channel_id,
+                    customer_org_id=customer_org_id,
+                    selected_org_ids=[],
+                    pending_signal=pending_signal,
+                    livepm_user_id=prefetched_user_id(user_future),
+                    trace_id=current_trace_id()
+                ))
         except Exception as e:
             say(f"Error starting signal addition process: {str(e)}", ephemeral=True)
 
     @app.command("/register_user")
+    @fair_scheduled
+    @instrumented_command("/register_user")
+    @traced("command", command="/register_user")
     def handle_register_user_command(ack, say, command, client):
         ack()
+        if not first_delivery(command.get('trigger_id')):
+            return
+        annotate(user_id=command['user_id'], team_id=command['team_id'])
         try:
-            team_id = command['team_id']
-            customer_org_id = get_customer_org_id(team_id)
-            if not customer_org_id:
-                say("Your Slack workspace is not registered. Please use the /register_organization command first.")
-                return
+            with user_lock(command['user_id']), hold_messages():
+                dm_future = submit(open_dm, client, command['user_id'])
+                team_id = command['team_id']
+                customer_org_id = get_customer_org_id(team_id)
+                if not customer_org_id:
+                    say("Your Slack workspace is not registered. Please use the /register_organization command first.")
+                    return
+                use_customer_org(customer_org_id)
 
-            dm = client.conversations_open(users=[command['user_id']])
-            dm_channel_id = dm['channel']['id']
+                dm_channel_id = dm_future.result()
             
-            show_users(client, dm_channel_id, customer_org_id)
+                show_users(client, dm_channel_id, customer_org_id)
             
-            conversation_states[command['user_id']] = {
-                'state': 'awaiting_user_selection',
-                'dm_channel_id': dm_channel_id,
-                'slack_id': command['user_id'],
-                'customer_org_id': customer_org_id
-            }
+                conversation_states.save(command['user_id'], ConversationState(
+                    'awaiting_user_selection',
+                    dm_channel_id,
+                    customer_org_id=customer_org_id,
+                    slack_id=command['user_id'],
+                    trace_id=current_trace_id()
+                ))
         except Exception as e:
             say(f"Error starting user registration process: {str(e)}", ephemeral=True)
 
     @app.command("/register_organization")
+    @fair_scheduled
+    @instrumented_command("/register_organization")
+    @traced("command", command="/register_organization")
     def handle_register_organization_command(ack, say, command, client):
         ack()
+        if not first_delivery(command.get('trigger_id')):
+            return
+        annotate(user_id=command['user_id'], team_id=command['team_id'])
         try:
-            team_id = command['team_id']
-            customer_org_id = get_customer_org_id(team_id)
+            with user_lock(command['user_id']), hold_messages():
+                dm_future = submit(open_dm, client, command['user_id'])
+                listing_future = submit(get_customer_organizations)
+                team_id = command['team_id']
+                customer_org_id = get_customer_org_id(team_id)
             
-            if customer_org_id is not None:
-                say(f"Your Slack workspace is already registered with customer organization ID: {customer_org_id}")
-                return
+                if customer_org_id is not None:
+                    say(f"Your Slack workspace is already registered with customer organization ID: {customer_org_id}")
+                    return
 
-            dm = client.conversations_open(users=[command['user_id']])
-            dm_channel_id = dm['channel']['id']
+                dm_channel_id = dm_future.result()
+                listing_future.result()
             
-            show_customer_organizations(client, dm_channel_id)
+                show_customer_organizations(client, dm_channel_id)
             
-            conversation_states[command['user_id']] = {
-                'state': 'awaiting_customer_org_selection',
-                'dm_channel_id': dm_channel_id,
-                'team_id': team_id
-            }
+                conversation_states.save(command['user_id'], ConversationState(
+                    'awaiting_customer_org_selection',
+                    dm_channel_id,
+                    team_id=team_id,
+                    trace_id=current_trace_id()
+                ))
         except Exception as e:
             say(f"Error starting organization registration process: {str(e)}", ephemeral=True)
     
     @app.command("/help")
+    @instrumented_command("/help")
     def handle_help_command(ack, say, command, client):
         ack()
         try:
@@ -83,6 +186,7 @@ def register_commands(app):
                 channel=command['channel_id'],
                 text="I can respond to the following commands:\n"
                      "- /add_signal: Start adding a signal to a customer organization\n"
+                     "- /add_signal <org IDs or names, or none> | <signal text>: Add a signal in one step\n"
                      "- /register_user: Register your Slack ID with your user account\n"
                      "- /register_organization: Register your Slack workspace with a customer organization\n"
                      "- /help: Show this help message"
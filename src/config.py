@@ -1,9 +1,24 @@
 import os
 import logging
-from dotenv import load_dotenv
+from state_store import create_state_store
 
-# Load environment variables
-load_dotenv()
+def _find_env_file():
+    # The nearest .env in this directory or above it, where load_dotenv() would look
+    directory = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        path = os.path.join(directory, ".env")
+        if os.path.isfile(path):
+            return path
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+# python-dotenv is only imported when there is a .env file to load
+_env_file = _find_env_file()
+if _env_file:
+    from dotenv import load_dotenv
+    load_dotenv(_env_file)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -11,12 +26,144 @@ logging.basicConfig(level=logging.INFO)
 # Environment variables
 SLACK_BOT_TOKEN = os.environ.get("SLACK_BOT_TOKEN")
 SLACK_APP_TOKEN = os.environ.get("SLACK_APP_TOKEN")
+# Only used in HTTP mode (http_main.py), where Slack signs each request
+SLACK_SIGNING_SECRET = os.environ.get("SLACK_SIGNING_SECRET")
 API_KEY = os.environ.get("API_KEY")
-API_BASE_URL = "https://live-db-kohl.vercel.app"
+API_BASE_URL = os.environ.get("API_BASE_URL", "https://live-db-kohl.vercel.app")
+
+# HTTP connection pool for the LivePM API
+API_POOL_SIZE = int(os.environ.get("API_POOL_SIZE", "10"))
+API_CONNECT_TIMEOUT = float(os.environ.get("API_CONNECT_TIMEOUT", "3.05"))
+API_READ_TIMEOUT = float(os.environ.get("API_READ_TIMEOUT", "10"))
+
+# Events API over HTTP (http_main.py); each worker is a separate process
+HTTP_HOST = os.environ.get("HTTP_HOST", "0.0.0.0")
+HTTP_PORT = int(os.environ.get("HTTP_PORT", "3000"))
+HTTP_WORKERS = int(os.environ.get("HTTP_WORKERS", "4"))
+
+# Lookups run in parallel when a command starts a flow
+FAN_OUT_WORKERS = int(os.environ.get("FAN_OUT_WORKERS", "16"))
+# Longest /add_signal waits for the prefetched LivePM user before leaving it to the signal step
+PREFETCH_TIMEOUT = float(os.environ.get("PREFETCH_TIMEOUT", "2"))
+
+# Per-workspace bulkheads: command and message work is queued per team ID and taken
+# round-robin by HANDLER_WORKERS threads; 0 runs handlers directly on Bolt's threads
+HANDLER_WORKERS = int(os.environ.get("HANDLER_WORKERS", "16"))
+TENANT_CONCURRENCY = int(os.environ.get("TENANT_CONCURRENCY", "4"))
+TENANT_MAX_QUEUE = int(os.environ.get("TENANT_MAX_QUEUE", "100"))
+# Extra round-robin turns for some workspaces, e.g. "T0123=3,T0456=2"
+TENANT_WEIGHTS = {
+    team_id.strip(): max(1, int(weight))
+    for team_id, _, weight in (item.partition("=") for item in os.environ.get("TENANT_WEIGHTS", "").split(","))
+    if team_id.strip() and weight.strip()
+}
+# LivePM calls in flight per customer organization; 0 for no limit
+API_ORG_CONCURRENCY = int(os.environ.get("API_ORG_CONCURRENCY", "4"))
+
+# Handler threads used by the asyncio runtime (async_main.py)
+ASYNC_HANDLER_WORKERS = int(os.environ.get("ASYNC_HANDLER_WORKERS", "32"))
+
+# Retries and circuit breaking for LivePM API calls
+API_MAX_RETRIES = int(os.environ.get("API_MAX_RETRIES", "3"))
+API_RETRY_BASE_DELAY = float(os.environ.get("API_RETRY_BASE_DELAY", "0.2"))
+API_RETRY_MAX_DELAY = float(os.environ.get("API_RETRY_MAX_DELAY", "2"))
+API_RETRY_BUDGET_RATIO = float(os.environ.get("API_RETRY_BUDGET_RATIO", "0.2"))
+API_RETRY_BUDGET_RESERVE = int(os.environ.get("API_RETRY_BUDGET_RESERVE", "10"))
+API_BREAKER_FAILURE_THRESHOLD = int(os.environ.get("API_BREAKER_FAILURE_THRESHOLD", "5"))
+API_BREAKER_RESET_TIMEOUT = float(os.environ.get("API_BREAKER_RESET_TIMEOUT", "30"))
+
+# Slack team ID -> customer organization ID lookups
+CUSTOMER_ORG_CACHE_SIZE = int(os.environ.get("CUSTOMER_ORG_CACHE_SIZE", "1024"))
+CUSTOMER_ORG_CACHE_TTL = float(os.environ.get("CUSTOMER_ORG_CACHE_TTL", "3600"))
+CUSTOMER_ORG_NEGATIVE_TTL = float(os.environ.get("CUSTOMER_ORG_NEGATIVE_TTL", "60"))
+
+# Slack user ID -> LivePM user ID lookups
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "3600"))
+USER_CACHE_NEGATIVE_TTL = float(os.environ.get("USER_CACHE_NEGATIVE_TTL", "60"))
+# Optional JSON file the mapping is saved to, so it survives a restart
+USER_CACHE_SNAPSHOT = os.environ.get("USER_CACHE_SNAPSHOT")
+USER_CACHE_SNAPSHOT_INTERVAL = float(os.environ.get("USER_CACHE_SNAPSHOT_INTERVAL", "60"))
+
+# Slack channel metadata (is the channel a DM?)
+CHANNEL_CACHE_SIZE = int(os.environ.get("CHANNEL_CACHE_SIZE", "10000"))
+CHANNEL_CACHE_TTL = float(os.environ.get("CHANNEL_CACHE_TTL", "86400"))
+
+# Organization, user and customer organization listings
+LISTING_CACHE_SIZE = int(os.environ.get("LISTING_CACHE_SIZE", "512"))
+LISTING_CACHE_TTL = float(os.environ.get("LISTING_CACHE_TTL", "300"))
+
+# Conversation state storage ("memory" or "sqlite")
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "memory")
+STATE_DB_PATH = os.environ.get("STATE_DB_PATH", "conversation_states.db")
+STATE_TTL = float(os.environ.get("STATE_TTL", "86400"))
+STATE_MAX_ENTRIES = int(os.environ.get("STATE_MAX_ENTRIES", "10000"))
+
+# Duplicate delivery detection and per-user serialization
+DEDUPE_TTL = float(os.environ.get("DEDUPE_TTL", "600"))
+DEDUPE_MAX_ENTRIES = int(os.environ.get("DEDUPE_MAX_ENTRIES", "50000"))
+USER_LOCK_TIMEOUT = float(os.environ.get("USER_LOCK_TIMEOUT", "30"))
+# How long a user lock taken through the sqlite backend survives a crashed holder; a live holder renews it
+USER_LOCK_LEASE = float(os.environ.get("USER_LOCK_LEASE", "60"))
+
+# Cache changes (registrations, new orgs and users) shared between processes through STATE_DB_PATH;
+# on by default with the sqlite backend, where several workers serve the same workspaces
+CACHE_SYNC = os.environ.get("CACHE_SYNC", "1" if STATE_BACKEND == "sqlite" else "0") == "1"
+CACHE_SYNC_INTERVAL = float(os.environ.get("CACHE_SYNC_INTERVAL", "1"))
+CACHE_SYNC_RETENTION = float(os.environ.get("CACHE_SYNC_RETENTION", "600"))
+
+# Cache warm-up at startup: the bot's own workspace plus these (comma-separated) team IDs
+WARMUP_TEAM_IDS = [team_id.strip() for team_id in os.environ.get("WARMUP_TEAM_IDS", "").split(",") if team_id.strip()]
+WARMUP_WORKERS = int(os.environ.get("WARMUP_WORKERS", "8"))
+# Socket Mode waits this long for warm-up before connecting
+WARMUP_TIMEOUT = float(os.environ.get("WARMUP_TIMEOUT", "30"))
+
+# Per-flow tracing; disabled unless TRACE_FILE is set
+TRACE_FILE = os.environ.get("TRACE_FILE")
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.1"))
+# Segments with a span at least this slow (seconds) are always kept
+TRACE_SLOW_THRESHOLD = float(os.environ.get("TRACE_SLOW_THRESHOLD", "1"))
+TRACE_EXPORT_BATCH_SIZE = int(os.environ.get("TRACE_EXPORT_BATCH_SIZE", "100"))
+TRACE_EXPORT_INTERVAL = float(os.environ.get("TRACE_EXPORT_INTERVAL", "5"))
+TRACE_MAX_QUEUE = int(os.environ.get("TRACE_MAX_QUEUE", "10000"))
+
+# Recording of incoming commands and DM messages for replay.py; disabled unless RECORD_FILE is set
+RECORD_FILE = os.environ.get("RECORD_FILE")
+# Key for pseudonymizing Slack IDs; random per process when unset
+RECORD_SALT = os.environ.get("RECORD_SALT")
+# "mask" replaces letters in message text with x, "keep" records text as is
+RECORD_TEXT = os.environ.get("RECORD_TEXT", "mask")
+
+# Prometheus-style metrics endpoint; disabled when METRICS_PORT is unset
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+# Durable outbox for signal submissions
+OUTBOX_DB_PATH = os.environ.get("OUTBOX_DB_PATH", "signal_outbox.db")
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_RETRY_DELAY = float(os.environ.get("OUTBOX_RETRY_DELAY", "2"))
+OUTBOX_MAX_RETRY_DELAY = float(os.environ.get("OUTBOX_MAX_RETRY_DELAY", "300"))
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", "5"))
+# Longest lease on claimed signals; the flusher renews it while their batch is in flight
+OUTBOX_LEASE = float(os.environ.get("OUTBOX_LEASE", "60"))
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_BATCH_WINDOW = float(os.environ.get("OUTBOX_BATCH_WINDOW", "0.2"))
+OUTBOX_CONCURRENCY = int(os.environ.get("OUTBOX_CONCURRENCY", "4"))
+# Optional endpoint accepting {"signals": [...]} and returning one result per signal
+SIGNAL_BULK_ENDPOINT = os.environ.get("SIGNAL_BULK_ENDPOINT")
+
+# Bulk signal imports (import_signals.py and CSV/JSONL files shared with the bot)
+IMPORT_CONCURRENCY = int(os.environ.get("IMPORT_CONCURRENCY", "8"))
+IMPORT_PROGRESS_EVERY = int(os.environ.get("IMPORT_PROGRESS_EVERY", "500"))
+IMPORT_MAX_JOBS = int(os.environ.get("IMPORT_MAX_JOBS", "2"))
 
-# Print environment variables for debugging
-print(f"SLACK_BOT_TOKEN: {SLACK_BOT_TOKEN[:10]}...")
-print(f"SLACK_APP_TOKEN: {SLACK_APP_TOKEN[:10]}...")
+# Outbound Slack messages: per-channel token buckets and sender threads
+SLACK_CHANNEL_RATE = float(os.environ.get("SLACK_CHANNEL_RATE", "1"))
+SLACK_CHANNEL_BURST = float(os.environ.get("SLACK_CHANNEL_BURST", "3"))
+SLACK_SENDER_WORKERS = int(os.environ.get("SLACK_SENDER_WORKERS", "4"))
+SLACK_MAX_RETRY_AFTER = float(os.environ.get("SLACK_MAX_RETRY_AFTER", "120"))
 
 # Store conversation states
-conversation_states = {}
\ No newline at end of file
+conversation_states = create_state_store(
+    STATE_BACKEND, path=STATE_DB_PATH, ttl=STATE_TTL, max_entries=STATE_MAX_ENTRIES
+)
\ No newline at end of file
@@ -1,170 +1,198 @@
 from config import conversation_states
-from api_client import call_api, get_customer_org_id
+from api_client import (
+    call_api, get_customer_org_id, get_livepm_user_id, remember_livepm_user, invalidate_customer_org_id, resolve_name,
+    get_organizations, get_users, get_customer_organizations,
+    create_organization, create_user, create_customer_organization
+)
 from utils import show_organizations, show_users
+from outbox import enqueue_signal
+from cache import MISSING
+from state_machine import StateMachine, END
 
-def handle_org_selection(user_id, channel_id, text, client):
+conversation_machine = StateMachine(conversation_states)
+
+def queue_signal(signal, livepm_user_id, user_id, channel_id, client, pending=False):
+    enqueue_signal(signal['text'], signal['org_ids'], livepm_user_id, user_id, channel_id)
+    client.chat_postMessage(
+        channel=channel_id,
+        text=f"{'Pending signal' if pending else 'Signal'} queued. I'll confirm here once it has been added."
+    )
+
+def resolve_selection(client, channel_id, key, load_rows, text, invalid_text, multiple=False):
+    # Turns each ID or (partial) name in text into an ID. Returns None once the user
+    # has been sent a shortlist or invalid_text.
+    parts = [part.strip() for part in text.split(',')] if multiple else [text.strip()]
+    rows = None
+    selected_ids = []
+    for part in parts:
+        if part.isdigit():
+            selected_ids.append(int(part))
+            continue
+        if rows is None and part:
+            rows = load_rows()
+        match, shortlist = resolve_name(key, rows, part) if part else (None, [])
+        if match is not None:
+            selected_ids.append(match['id'])
+        elif shortlist:
+            options = "\n".join(f"{row['id']}: {row['name']}" for row in shortlist)
+            client.chat_postMessage(
+                channel=channel_id,
+                text=f"'{part}' matches more than one entry:\n{options}\n\nPlease reply with the ID or a more specific name."
+            )
+            return None
+        else:
+            client.chat_postMessage(channel=channel_id, text=invalid_text)
+            return None
+    return selected_ids
+
+@conversation_machine.state('awaiting_org_selection',
+                            transitions=('awaiting_new_org_name', 'awaiting_signal', 'awaiting_user_selection', END))
+def handle_org_selection(conversation, user_id, channel_id, text, client):
     if text.lower() == 'new':
         client.chat_postMessage(
             channel=channel_id,
             text="Please enter the name for the new organization:"
         )
-        conversation_states[user_id]['state'] = 'awaiting_new_org_name'
+        return 'awaiting_new_org_name'
     elif text.lower() == 'none':
+        if conversation.pending_signal:
+            # An inline /add_signal already gave the signal text
+            return handle_signal(conversation, user_id, channel_id, conversation.pending_signal['text'], client)
         client.chat_postMessage(
             channel=channel_id,
             text="Proceeding without selecting any organizations. Please enter the signal text:"
         )
-        conversation_states[user_id]['state'] = 'awaiting_signal'
-    elif all(org_id.strip().isdigit() for org_id in text.split(',')):
-        org_ids = [int(org_id.strip()) for org_id in text.split(',')]
-        conversation_states[user_id]['selected_org_ids'].extend(org_ids)
-        client.chat_postMessage(
-            channel=channel_id,
-            text=f"You've selected organization ID(s): {', '.join(map(str, org_ids))}. Please enter the signal text:"
+        return 'awaiting_signal'
+    customer_org_id = conversation.customer_org_id
+    try:
+        org_ids = resolve_selection(
+            client, channel_id, ('organizations', customer_org_id), lambda: get_organizations(customer_org_id), text,
+            "Invalid input. Please enter valid organization ID(s) or names (comma-separated), 'new', or 'none'.",
+            multiple=True
         )
-        conversation_states[user_id]['state'] = 'awaiting_signal'
-    else:
+    except Exception as e:
         client.chat_postMessage(
             channel=channel_id,
-            text="Invalid input. Please enter valid organization ID(s) (comma-separated), 'new', or 'none'."
+            text=f"Error selecting organizations: {str(e)}"
         )
+        return
+    if org_ids is None:
+        return
+    conversation.selected_org_ids.extend(org_ids)
+    if conversation.pending_signal:
+        return handle_signal(conversation, user_id, channel_id, conversation.pending_signal['text'], client)
+    client.chat_postMessage(
+        channel=channel_id,
+        text=f"You've selected organization ID(s): {', '.join(map(str, org_ids))}. Please enter the signal text:"
+    )
+    return 'awaiting_signal'
 
-def handle_new_org_name(user_id, channel_id, text, client):
+@conversation_machine.state('awaiting_new_org_name', transitions=('awaiting_org_selection',))
+def handle_new_org_name(conversation, user_id, channel_id, text, client):
     try:
-        new_org = call_api("/organization/create", method="POST", json={
-            "name": text, 
-            "Customer_Organization_id": conversation_states[user_id]['customer_org_id']
-        })
+        new_org = create_organization(text, conversation.customer_org_id)
         org_id = new_org['organization_id']
         client.chat_postMessage(
             channel=channel_id,
             text=f"New organization '{text}' created with ID: {org_id}."
         )
-        show_organizations(client, channel_id, conversation_states[user_id]['customer_org_id'])
-        conversation_states[user_id]['state'] = 'awaiting_org_selection'
+        show_organizations(client, channel_id, conversation.customer_org_id)
+        return 'awaiting_org_selection'
     except Exception as e:
         client.chat_postMessage(
             channel=channel_id,
             text=f"Error creating new organization: {str(e)}"
         )
 
-def handle_signal(user_id, channel_id, text, client):
+@conversation_machine.state('awaiting_signal', transitions=('awaiting_user_selection', END))
+def handle_signal(conversation, user_id, channel_id, text, client):
     try:
-        org_ids = conversation_states[user_id]['selected_org_ids']
-        user_response = call_api("/user/slack", method="GET", params={"slack_id": str(user_id)})
-        if 'user_id' not in user_response:
+        org_ids = conversation.selected_org_ids
+        livepm_user_id = conversation.livepm_user_id
+        if livepm_user_id is None:
+            livepm_user_id = get_livepm_user_id(user_id)
+        if livepm_user_id is None:
             client.chat_postMessage(
                 channel=channel_id,
                 text="It looks like your Slack ID is not registered. Let's get you registered first."
             )
-            show_users(client, channel_id, conversation_states[user_id]['customer_org_id'])
-            conversation_states[user_id]['state'] = 'awaiting_user_selection'
-            conversation_states[user_id]['pending_signal'] = {
+            show_users(client, channel_id, conversation.customer_org_id)
+            conversation.slack_id = user_id
+            conversation.pending_signal = {
                 'text': text,
                 'org_ids': org_ids
             }
+            return 'awaiting_user_selection'
         else:
-            signal_response = call_api("/signal/create", method="POST", json={
-                "signal": text,
-                "organization_ids": org_ids,
-                "user_id": user_response['user_id'],
-                "source": "Slack",
-                "type": "manual"
-            })
-            client.chat_postMessage(
-                channel=channel_id,
-                text=f"Signal added successfully: {signal_response}"
-            )
-            del conversation_states[user_id]  # Clear the conversation state
+            # If the lookup failed the flusher resolves the user when it delivers
+            queue_signal({'text': text, 'org_ids': org_ids}, None if livepm_user_id is MISSING else livepm_user_id,
+                         user_id, channel_id, client)
+            return END
     except Exception as e:
         client.chat_postMessage(
             channel=channel_id,
             text=f"Error adding signal: {str(e)}"
         )
 
-def handle_user_selection(user_id, channel_id, text, client):
+@conversation_machine.state('awaiting_user_selection', transitions=('awaiting_new_user_name', END))
+def handle_user_selection(conversation, user_id, channel_id, text, client):
     if text.lower() == 'new':
         client.chat_postMessage(
             channel=channel_id,
             text="Please enter the name for the new user:"
         )
-        conversation_states[user_id]['state'] = 'awaiting_new_user_name'
-    elif text.isdigit():
-        try:
-            register_response = call_api("/user/register", method="POST", json={
-                "slack_id": str(conversation_states[user_id]['slack_id']),
-                "user_id": int(text)
-            })
-            client.chat_postMessage(
-                channel=channel_id,
-                text=f"User registration successful. Your Slack ID {conversation_states[user_id]['slack_id']} has been linked to user ID {text}."
-            )
-            
-            if 'pending_signal' in conversation_states[user_id]:
-                pending_signal = conversation_states[user_id]['pending_signal']
-                signal_response = call_api("/signal/create", method="POST", json={
-                    "signal": pending_signal['text'],
-                    "organization_ids": pending_signal['org_ids'],
-                    "user_id": int(text),
-                    "source": "Slack",
-                    "type": "manual"
-                })
-                client.chat_postMessage(
-                    channel=channel_id,
-                    text=f"Pending signal added successfully: {signal_response}"
-                )
-            
-            del conversation_states[user_id]  # Clear the conversation state
-        except Exception as e:
-            client.chat_postMessage(
-                channel=channel_id,
-                text=f"Error registering user: {str(e)}"
-            )
-    else:
+        return 'awaiting_new_user_name'
+    customer_org_id = conversation.customer_org_id
+    try:
+        selected = resolve_selection(
+            client, channel_id, ('users', customer_org_id), lambda: get_users(customer_org_id), text,
+            "Invalid input. Please enter a valid user ID or name, or 'new' to create a new user."
+        )
+        if selected is None:
+            return
+        selected_user_id = selected[0]
+        register_response = call_api("/user/register", method="POST", json={
+            "slack_id": str(conversation.slack_id),
+            "user_id": selected_user_id
+        })
+        if register_response is not None:
+            remember_livepm_user(conversation.slack_id, selected_user_id)
+        client.chat_postMessage(
+            channel=channel_id,
+            text=f"User registration successful. Your Slack ID {conversation.slack_id} has been linked to user ID {selected_user_id}."
+        )
+
+        if conversation.pending_signal:
+            queue_signal(conversation.pending_signal, selected_user_id, user_id, channel_id, client, pending=True)
+
+        return END
+    except Exception as e:
         client.chat_postMessage(
             channel=channel_id,
-            text="Invalid input. Please enter a valid user ID or 'new' to create a new user."
+            text=f"Error registering user: {str(e)}"
         )
 
-def handle_new_user_name(user_id, channel_id, text, client):
+@conversation_machine.state('awaiting_new_user_name', transitions=(END,))
+def handle_new_user_name(conversation, user_id, channel_id, text, client):
     try:
-        new_user = call_api("/user/create", method="POST", json={
-            "name": text,
-            "Customer_Organization_id": conversation_states[user_id]['customer_org_id']
-        })
+        new_user = create_user(text, conversation.customer_org_id)
         if new_user and 'user_id' in new_user:
             created_user_id = new_user['user_id']
             register_response = call_api("/user/register", method="POST", params={
-                "slack_id": str(conversation_states[user_id]['slack_id']),
+                "slack_id": str(conversation.slack_id),
                 "user_id": created_user_id
             })
             if register_response is not None:
+                remember_livepm_user(conversation.slack_id, created_user_id)
                 client.chat_postMessage(
                     channel=channel_id,
                     text=f"New user '{text}' created with ID: {created_user_id} and user registration successful."
                 )
                 
-                if 'pending_signal' in conversation_states[user_id]:
-                    pending_signal = conversation_states[user_id]['pending_signal']
-                    signal_response = call_api("/signal/create", method="POST", json={
-                        "signal": pending_signal['text'],
-                        "organization_ids": pending_signal['org_ids'],
-                        "user_id": created_user_id,
-                        "source": "Slack",
-                        "type": "manual"
-                    })
-                    if signal_response is not None:
-                        client.chat_postMessage(
-                            channel=channel_id,
-                            text=f"Pending signal added successfully: {signal_response}"
-                        )
-                    else:
-                        client.chat_postMessage(
-                            channel=channel_id,
-                            text="Failed to add pending signal. Please try adding the signal again."
-                        )
+                if conversation.pending_signal:
+                    queue_signal(conversation.pending_signal, created_user_id, user_id, channel_id, client, pending=True)
                 
-                del conversation_states[user_id]  # Clear the conversation state
+                return END
             else:
                 client.chat_postMessage(
                     channel=channel_id,
@@ -181,58 +209,61 @@ def handle_new_user_name(user_id, channel_id, text, client):
             text=f"Error creating new user and registering: {str(e)}"
         )
 
-def handle_customer_org_selection(user_id, channel_id, text, client):
+@conversation_machine.state('awaiting_customer_org_selection', transitions=('awaiting_new_customer_org_name', END))
+def handle_customer_org_selection(conversation, user_id, channel_id, text, client):
     if text.lower() == 'new':
         client.chat_postMessage(
             channel=channel_id,
             text="Please enter the name for the new customer organization:"
         )
-        conversation_states[user_id]['state'] = 'awaiting_new_customer_org_name'
-    elif text.isdigit():
-        try:
-            register_response = call_api("/customerorganization/register", method="POST", params={
-                "slack_id": str(conversation_states[user_id]['team_id']),
-                "customer_organization_id": int(text)
-            })
-            if register_response is not None:
-                client.chat_postMessage(
-                    channel=channel_id,
-                    text=f"Customer organization registration successful. Your Slack workspace has been linked to customer organization ID {text}."
-                )
-                del conversation_states[user_id]  # Clear the conversation state
-            else:
-                client.chat_postMessage(
-                    channel=channel_id,
-                    text="Failed to register customer organization. Please try again or contact support."
-                )
-        except Exception as e:
+        return 'awaiting_new_customer_org_name'
+    try:
+        selected = resolve_selection(
+            client, channel_id, ('customer_organizations',), get_customer_organizations, text,
+            "Invalid input. Please enter a valid customer organization ID or name, or 'new' to create a new customer organization."
+        )
+        if selected is None:
+            return
+        selected_org_id = selected[0]
+        register_response = call_api("/customerorganization/register", method="POST", params={
+            "slack_id": str(conversation.team_id),
+            "customer_organization_id": selected_org_id
+        })
+        invalidate_customer_org_id(conversation.team_id)
+        if register_response is not None:
             client.chat_postMessage(
                 channel=channel_id,
-                text=f"Error registering customer organization: {str(e)}"
+                text=f"Customer organization registration successful. Your Slack workspace has been linked to customer organization ID {selected_org_id}."
             )
-    else:
+            return END
+        else:
+            client.chat_postMessage(
+                channel=channel_id,
+                text="Failed to register customer organization. Please try again or contact support."
+            )
+    except Exception as e:
         client.chat_postMessage(
             channel=channel_id,
-            text="Invalid input. Please enter a valid customer organization ID or 'new' to create a new customer organization."
+            text=f"Error registering customer organization: {str(e)}"
         )
 
-def handle_new_customer_org_name(user_id, channel_id, text, client):
+@conversation_machine.state('awaiting_new_customer_org_name', transitions=(END,))
+def handle_new_customer_org_name(conversation, user_id, channel_id, text, client):
     try:
-        new_org = call_api("/customerorganization/create", method="POST", json={
-            "name": text
-        })
+        new_org = create_customer_organization(text)
         if new_org and 'customerorganization_id' in new_org:
             org_id = new_org['customerorganization_id']
             register_response = call_api("/customerorganization/register", method="POST", params={
-                "slack_id": str(conversation_states[user_id]['team_id']),
+                "slack_id": str(conversation.team_id),
                 "customer_organization_id": org_id
             })
+            invalidate_customer_org_id(conversation.team_id)
             if register_response is not None:
                 client.chat_postMessage(
                     channel=channel_id,
                     text=f"New customer organization '{text}' created with ID: {org_id} and registered with your Slack workspace."
                 )
-                del conversation_states[user_id]  # Clear the conversation state
+                return END
             else:
                 client.chat_postMessage(
                     channel=channel_id,
@@ -247,4 +278,5 @@ def handle_new_customer_org_name(user_id, channel_id, text, client):
         client.chat_postMessage(
             channel=channel_id,
             text=f"Error creating and registering new customer organization: {str(e)}"
-        )
\ No newline at end of file
+        )
+conversation_machine.validate()
@@ -0,0 +1,221 @@
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from contextlib import contextmanager
+from cache import TTLCache
+from metrics import REGISTRY
+from config import (
+    DEDUPE_TTL, DEDUPE_MAX_ENTRIES, USER_LOCK_TIMEOUT, USER_LOCK_LEASE, STATE_BACKEND, STATE_DB_PATH
+)
+
+logger = logging.getLogger(__name__)
+
+class UserBusyError(Exception):
+    pass
+
+class _UserLock:
+    # threading.Lock can't be weakly referenced, so wrap it
+    __slots__ = ("lock", "__weakref__")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+class InMemoryCoordinator:
+    # Delivery dedupe and per-user locks for a single process
+    def __init__(self, dedupe_ttl=600, dedupe_max_entries=50000):
+        # Delivery keys (event ID, client message ID, trigger ID) already handled
+        self._seen = TTLCache(maxsize=dedupe_max_entries, ttl=dedupe_ttl)
+        # Locks disappear once no thread holds or waits on them
+        self._user_locks = weakref.WeakValueDictionary()
+        self._user_locks_lock = threading.Lock()
+
+    def first_delivery(self, key):
+        return self._seen.add(key)
+
+    def tracked_deliveries(self):
+        return len(self._seen)
+
+    def acquire(self, user_id, timeout):
+        # Returns a token for release(), or None if the lock wasn't free within timeout
+        with self._user_locks_lock:
+            user_lock = self._user_locks.get(user_id)
+            if user_lock is None:
+                user_lock = self._user_locks[user_id] = _UserLock()
+        acquired = user_lock.lock.acquire(timeout=timeout) if timeout else user_lock.lock.acquire(blocking=False)
+        return user_lock if acquired else None
+
+    def release(self, user_id, token):
+        token.lock.release()
+
+class SQLiteCoordinator(InMemoryCoordinator):
+    # Shares deliveries and user locks between every process using the same database file.
+    # Threads in one process still queue on the in-process lock first.
+    def __init__(self, path, dedupe_ttl=600, dedupe_max_entries=50000, lease=60, sweep_every=100):
+        super().__init__(dedupe_ttl, dedupe_max_entries)
+        self.dedupe_ttl = dedupe_ttl
+        self.lease = lease
+        self.sweep_every = sweep_every
+        self._inserts = 0
+        self._lock = threading.Lock()
+        # owner -> user ID of the locks this process holds, renewed until they are released
+        self._held = {}
+        self._renewer = None
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS deliveries (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS user_locks (user_id TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def first_delivery(self, key):
+        # Cheap in-process check first, then the shared table
+        if not super().first_delivery(key):
+            return False
+        now = time.time()
+        with self._lock:
+            inserted = self._conn.execute(
+                "INSERT INTO deliveries (key, expires_at) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET expires_at = excluded.expires_at WHERE deliveries.expires_at <= ?",
+                (key, now + self.dedupe_ttl, now)
+            ).rowcount
+            self._inserts += 1
+            if self._inserts % self.sweep_every == 0:
+                self._conn.execute("DELETE FROM deliveries WHERE expires_at <= ?", (now,))
+        return inserted == 1
+
+    def tracked_deliveries(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM deliveries WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+
+    def _claim(self, user_id, owner):
+        # A lease left by a crashed process expires after self.lease seconds
+        now = time.time()
+        with self._lock:
+            return self._conn.execute(
+                "INSERT INTO user_locks (user_id, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE user_locks.expires_at <= ?",
+                (user_id, owner, now + self.lease, now)
+            ).rowcount == 1
+
+    def _renew_held(self):
+        # A handler may run longer than the lease; its lock only lapses once this process is gone
+        while True:
+            time.sleep(self.lease / 3)
+            try:
+                with self._lock:
+                    expires_at = time.time() + self.lease
+                    self._conn.executemany(
+                        "UPDATE user_locks SET expires_at = ? WHERE user_id = ? AND owner = ?",
+                        [(expires_at, user_id, owner) for owner, user_id in self._held.items()]
+                    )
+            except Exception as e:
+                logger.error(f"Renewing user lock leases failed: {str(e)}")
+
+    def acquire(self, user_id, timeout):
+        deadline = time.monotonic() + timeout
+        local = super().acquire(user_id, timeout)
+        if local is None:
+            return None
+        owner = uuid.uuid4().hex
+        delay = 0.005
+        while not self._claim(user_id, owner):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                super().release(user_id, local)
+                return None
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.1)
+        with self._lock:
+            self._held[owner] = user_id
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._renew_held, name="user-lock-renewer", daemon=True)
+                self._renewer.start()
+        return local, owner
+
+    def release(self, user_id, token):
+        local, owner = token
+        try:
+            with self._lock:
+                self._held.pop(owner, None)
+                self._conn.execute("DELETE FROM user_locks WHERE user_id = ? AND owner = ?", (user_id, owner))
+        finally:
+            super().release(user_id, local)
+
+def create_coordinator(backend="memory", path="conversation_states.db", dedupe_ttl=600, dedupe_max_entries=50000,
+                       lease=60):
+    if backend == "memory":
+        return InMemoryCoordinator(dedupe_ttl, dedupe_max_entries)
+    if backend == "sqlite":
+        return SQLiteCoordinator(path, dedupe_ttl, dedupe_max_entries, lease)
+    raise ValueError(f"Unknown coordination backend: {backend}")
+
+# Uses the same backend as the conversation states, so every process sharing them also
+# shares delivery dedupe and user locks
+coordinator = create_coordinator(
+    STATE_BACKEND, path=STATE_DB_PATH, dedupe_ttl=DEDUPE_TTL, dedupe_max_entries=DEDUPE_MAX_ENTRIES,
+    lease=USER_LOCK_LEASE
+)
+
+_stats_lock = threading.Lock()
+_stats = {"duplicates": 0, "conflicts": 0, "lock_timeouts": 0}
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+def first_delivery(key):
+    if not key:
+        return True
+    if coordinator.first_delivery(key):
+        return True
+    _count("duplicates")
+    logger.info(f"Ignoring duplicate delivery {key}")
+    return False
+
+def message_delivery_key(event, body=None):
+    if body and body.get('event_id'):
+        return body['event_id']
+    if event.get('client_msg_id'):
+        return event['client_msg_id']
+    if event.get('ts'):
+        return f"{event.get('channel')}:{event['ts']}"
+    return None
+
+@contextmanager
+def user_lock(user_id):
+    token = coordinator.acquire(user_id, 0)
+    if token is None:
+        # Another message or command from this user is mid-transition
+        _count("conflicts")
+        token = coordinator.acquire(user_id, USER_LOCK_TIMEOUT)
+        if token is None:
+            _count("lock_timeouts")
+            raise UserBusyError(f"Timed out waiting for the previous request from {user_id}")
+    try:
+        yield
+    finally:
+        coordinator.release(user_id, token)
+
+def get_dedupe_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["tracked_deliveries"] = coordinator.tracked_deliveries()
+    return stats
+
+def _collect_metrics():
+    stats = get_dedupe_stats()
+    return [
+        ("signalbot_duplicate_deliveries", "Slack deliveries dropped as duplicates", (), stats["duplicates"]),
+        ("signalbot_user_lock_conflicts", "Requests that waited on the same user's previous request", (),
+         stats["conflicts"]),
+        ("signalbot_user_lock_timeouts", "Requests rejected after waiting on a user lock", (), stats["lock_timeouts"]),
+    ]
+
+REGISTRY.register_collector(_collect_metrics)
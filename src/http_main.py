@@ -0,0 +1,102 @@
+import logging
+import multiprocessing
+import signal
+import socket
+from multiprocessing.connection import wait
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+import startup
+from cache_sync import cache_sync
+from config import (
+    SLACK_BOT_TOKEN, SLACK_SIGNING_SECRET, HTTP_HOST, HTTP_PORT, HTTP_WORKERS, STATE_BACKEND,
+    METRICS_PORT, METRICS_HOST
+)
+from main import create_app
+from metrics import start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+def serve_socket(sock, application):
+    # wsgiref binds its own socket, so hand it the shared listening one instead
+    server = ThreadingWSGIServer(sock.getsockname()[:2], QuietRequestHandler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = sock
+    server.server_address = sock.getsockname()[:2]
+    server.server_name = socket.getfqdn(server.server_address[0])
+    server.server_port = server.server_address[1]
+    server.setup_environ()
+    server.set_app(application)
+    server.serve_forever()
+
+def run_worker(sock, index):
+    from slack_bolt.adapter.wsgi import SlackRequestHandler
+    from outbox import start_outbox_flusher
+    from slack_outbound import start_message_scheduler
+    from slack_client import InstrumentedWebClient
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    client = InstrumentedWebClient(token=SLACK_BOT_TOKEN)
+    if METRICS_PORT:
+        # One metrics endpoint per worker
+        start_metrics_server(METRICS_PORT + index, METRICS_HOST, ready=startup.is_ready)
+    # Requests are served straight away; /readyz tells the load balancer when this worker is warm
+    # Picks up registrations and new orgs/users made by other processes
+    cache_sync.start()
+    startup.start_warm_up(client)
+    app = create_app(client, signing_secret=SLACK_SIGNING_SECRET)
+    start_message_scheduler(client)
+    # Every worker runs a flusher; outbox leases keep them from sending the same signal
+    start_outbox_flusher(client)
+    logger.info(f"HTTP worker {index} serving on {sock.getsockname()[:2]}")
+    serve_socket(sock, SlackRequestHandler(app))
+
+def serve(host=HTTP_HOST, port=HTTP_PORT, workers=HTTP_WORKERS, worker=run_worker):
+    # The parent only owns the listening socket and restarts workers that exit;
+    # the kernel spreads incoming connections across the workers accepting on it.
+    # Workers are spawned rather than forked so none inherits the parent's
+    # threads or database connections.
+    sock = socket.create_server((host, port), backlog=1024)
+    if workers <= 1:
+        worker(sock, 0)
+        return
+    context = multiprocessing.get_context("spawn")
+    processes = {}
+    stopping = False
+
+    def start(index):
+        process = context.Process(target=worker, args=(sock, index), name=f"http-worker-{index}")
+        process.start()
+        processes[index] = process
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in processes.values():
+            process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(workers):
+        start(index)
+    logger.info(f"Serving Slack requests on {host}:{port} with {workers} workers")
+    while not stopping:
+        wait([process.sentinel for process in processes.values()], timeout=1.0)
+        for index, process in list(processes.items()):
+            if process.exitcode is not None and not stopping:
+                logger.error(f"HTTP worker {index} exited with code {process.exitcode}, restarting it")
+                start(index)
+    for process in processes.values():
+        process.join()
+    sock.close()
+
+if __name__ == "__main__":
+    if HTTP_WORKERS > 1 and STATE_BACKEND != "sqlite":
+        raise SystemExit("HTTP_WORKERS > 1 needs STATE_BACKEND=sqlite so every worker sees the same conversations")
+    serve()
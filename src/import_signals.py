@@ -0,0 +1,71 @@
+import argparse
+import sys
+from contextlib import nullcontext
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Stream signals from a CSV or JSONL file into LivePM.",
+        epilog="Each row needs a signal (or text) column, and may have organizations (IDs or names separated by "
+               "; or ,) and a user_id, user or slack_id column. Rows without a user use --user-id or --slack-id."
+    )
+    parser.add_argument("path", help="CSV or JSONL file, or - for stdin")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="input format; guessed from the file name by default")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--customer-org-id", type=int, help="customer organization to import into")
+    target.add_argument("--team-id", help="Slack workspace whose customer organization to import into")
+    parser.add_argument("--user-id", type=int, help="LivePM user for rows that don't name one")
+    parser.add_argument("--slack-id", help="Slack user whose LivePM user is used for rows that don't name one")
+    parser.add_argument("--errors", help="where to write rows that failed (default: <path>.errors.csv)")
+    parser.add_argument("--concurrency", type=int, help="signals submitted in parallel")
+    parser.add_argument("--progress-every", type=int, help="print progress after this many rows")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Imported here so --help works without any configuration
+    from api_client import get_customer_org_id, get_livepm_user_id, ApiUnavailableError
+    from cache import MISSING
+    from bulk_import import BulkImporter, RowResolver, read_rows, detect_format, describe
+    from config import IMPORT_CONCURRENCY, IMPORT_PROGRESS_EVERY, OUTBOX_DB_PATH
+
+    try:
+        customer_org_id = args.customer_org_id or get_customer_org_id(args.team_id)
+    except ApiUnavailableError as e:
+        print(str(e), file=sys.stderr)
+        return 1
+    if not customer_org_id:
+        print(f"Slack workspace {args.team_id} is not registered with a customer organization.", file=sys.stderr)
+        return 2
+    default_user_id = args.user_id
+    if default_user_id is None and args.slack_id:
+        default_user_id = get_livepm_user_id(args.slack_id)
+        if default_user_id is MISSING:
+            print(f"Could not look up Slack user {args.slack_id}. Please try again in a moment.", file=sys.stderr)
+            return 1
+        if default_user_id is None:
+            print(f"Slack user {args.slack_id} is not registered.", file=sys.stderr)
+            return 2
+
+    fmt = args.format or detect_format(args.path)
+    errors_path = args.errors or ("import-errors.csv" if args.path == "-" else f"{args.path}.errors.csv")
+    # stdin is left open; only a file we opened is closed
+    source = nullcontext(sys.stdin) if args.path == "-" else open(args.path, newline="", encoding="utf-8-sig")
+    with source as lines, open(errors_path, "w", newline="") as errors:
+        importer = BulkImporter(
+            RowResolver(customer_org_id, default_user_id),
+            concurrency=args.concurrency or IMPORT_CONCURRENCY,
+            error_file=errors,
+            progress=lambda stats: print(f"{describe(stats)} ({stats['rows_per_second']:.0f} rows/s)", file=sys.stderr),
+            progress_every=args.progress_every or IMPORT_PROGRESS_EVERY,
+        )
+        stats = importer.run(read_rows(lines, fmt))
+    print(f"Done: {describe(stats)}", file=sys.stderr)
+    if stats['queued']:
+        print(f"{stats['queued']} signals are waiting in {OUTBOX_DB_PATH} for the bot's outbox flusher", file=sys.stderr)
+    if stats['failed']:
+        print(f"Failed rows written to {errors_path}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
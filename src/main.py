@@ -1,17 +1,49 @@
-import os
-from slack_bolt import App
-from slack_bolt.adapter.socket_mode import SocketModeHandler
-from config import SLACK_BOT_TOKEN, SLACK_APP_TOKEN
-from commands import register_commands
-from message_handler import register_message_handler
+import logging
+import startup
+from cache_sync import cache_sync
+from config import SLACK_BOT_TOKEN, SLACK_APP_TOKEN, METRICS_PORT, METRICS_HOST, WARMUP_TIMEOUT
+from metrics import start_metrics_server
 
-# Create the Slack app
-app = App(token=SLACK_BOT_TOKEN)
+logger = logging.getLogger(__name__)
 
-# Register commands and message handler
-register_commands(app)
-register_message_handler(app)
+def create_app(client, **kwargs):
+    # Bolt and the handlers are imported here so warm-up can start before they load
+    with startup.phase("imports"):
+        from slack_bolt import App
+        from commands import register_commands
+        from message_handler import register_message_handler
+        from pickers import register_pickers
+        from recorder import install_recorder
+
+    with startup.phase("app"):
+        app = App(client=client, **kwargs)
+        # Records commands and messages for replay.py when RECORD_FILE is set
+        install_recorder(app)
+        # Register commands, message handler and pickers
+        register_commands(app)
+        register_message_handler(app)
+        register_pickers(app)
+    return app
+
+def main():
+    from slack_bolt.adapter.socket_mode import SocketModeHandler
+    from outbox import start_outbox_flusher
+    from slack_outbound import start_message_scheduler
+    from slack_client import InstrumentedWebClient
+
+    client = InstrumentedWebClient(token=SLACK_BOT_TOKEN)
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT, METRICS_HOST, ready=startup.is_ready)
+    # Picks up registrations and new orgs/users made by other processes
+    cache_sync.start()
+    startup.start_warm_up(client)
+    app = create_app(client)
+    start_message_scheduler(client)
+    start_outbox_flusher(client)
+    # Connecting makes Slack route events here, so give warm-up a chance to finish first
+    if not startup.wait_until_ready(WARMUP_TIMEOUT):
+        logger.warning(f"Warm-up still running after {WARMUP_TIMEOUT}s, connecting anyway")
+    SocketModeHandler(app, SLACK_APP_TOKEN).start()
 
 if __name__ == "__main__":
-    handler = SocketModeHandler(app, SLACK_APP_TOKEN)
-    handler.start()
\ No newline at end of file
+    main()
@@ -1,50 +1,73 @@
 from config import conversation_states
-from conversation_handlers import (
-    handle_org_selection,
-    handle_new_org_name,
-    handle_signal,
-    handle_user_selection,
-    handle_new_user_name,
-    handle_customer_org_selection,
-    handle_new_customer_org_name
-)
+from conversation_handlers import conversation_machine
+from utils import is_dm_channel
+from dedupe import first_delivery, message_delivery_key, user_lock, UserBusyError
+from slack_outbound import hold_messages
+from bulk_import import is_import_file, start_file_import
+from metrics import REGISTRY
+from tracing import trace
+from bulkheads import run_for_tenant, customer_org, TenantBusyError
+
+def dispatch_message(user_id, channel_id, text, client):
+    conversation = conversation_states.get(user_id)
+    if conversation is None:
+        client.chat_postMessage(
+            channel=channel_id,
+            text="To start adding a signal, use the /add_signal command. "
+                 "To register a user, use the /register_user command. "
+                 "To register your organization, use the /register_organization command."
+        )
+        return
+
+    with trace("message", trace_id=conversation.trace_id, user_id=user_id, state=conversation.state), \
+            customer_org(conversation.customer_org_id):
+        conversation_machine.dispatch(conversation, user_id, channel_id, text.strip(), client)
 
 def register_message_handler(app):
     @app.event("message")
-    def handle_message(event, say, client):
+    def handle_message(event, say, client, body=None):
         user_id = event.get('user')
         channel_id = event.get('channel')
         
         if not user_id or not channel_id:
             return
 
-        channel_info = client.conversations_info(channel=channel_id)
-        if not channel_info['channel']['is_im']:
+        if not is_dm_channel(client, event):
+            return
+
+        # Slack redelivers events it thinks we were too slow to ack
+        if not first_delivery(message_delivery_key(event, body)):
+            return
+
+        team_id = event.get('team') or (body or {}).get('team_id')
+
+        # CSV/JSONL files shared with the bot are bulk imports
+        import_files = [file_info for file_info in event.get('files', ()) if is_import_file(file_info)]
+        if import_files:
+            for file_info in import_files:
+                start_file_import(client, file_info, user_id, team_id, channel_id)
             return
 
-        if user_id not in conversation_states:
+        def handle():
+            try:
+                with user_lock(user_id), hold_messages():
+                    dispatch_message(user_id, channel_id, event['text'], client)
+            except UserBusyError:
+                client.chat_postMessage(
+                    channel=channel_id,
+                    text="I'm still working on your previous message. Please send this one again in a moment."
+                )
+
+        # Queued behind other messages from the same workspace, not everyone's
+        try:
+            return run_for_tenant(team_id, handle)
+        except TenantBusyError:
             client.chat_postMessage(
                 channel=channel_id,
-                text="To start adding a signal, use the /add_signal command. "
-                     "To register a user, use the /register_user command. "
-                     "To register your organization, use the /register_organization command."
+                text="Your workspace has a lot of requests in progress. Please send this again in a moment."
             )
-            return
 
-        state = conversation_states[user_id]['state']
-        text = event['text'].strip()
-
-        if state == 'awaiting_org_selection':
-            handle_org_selection(user_id, channel_id, text, client)
-        elif state == 'awaiting_new_org_name':
-            handle_new_org_name(user_id, channel_id, text, client)
-        elif state == 'awaiting_signal':
-            handle_signal(user_id, channel_id, text, client)
-        elif state == 'awaiting_user_selection':
-            handle_user_selection(user_id, channel_id, text, client)
-        elif state == 'awaiting_new_user_name':
-            handle_new_user_name(user_id, channel_id, text, client)
-        elif state == 'awaiting_customer_org_selection':
-            handle_customer_org_selection(user_id, channel_id, text, client)
-        elif state == 'awaiting_new_customer_org_name':
-            handle_new_customer_org_name(user_id, channel_id, text, client)
\ No newline at end of file
+
+REGISTRY.register_collector(lambda: [
+    ("signalbot_conversations", "Conversations in progress", (), len(conversation_states))
+])
\ No newline at end of file
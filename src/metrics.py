@@ -0,0 +1,258 @@
+import bisect
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = ",".join(
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in zip(labelnames, values)
+    )
+    return "{" + pairs + "}"
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        else:
+            values = tuple(values)
+        # Children are created once per label set; lookups after that don't lock
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        with self._lock:
+            return list(self._children.items())
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def render(self):
+        lines = []
+        for values, child in self._samples():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {child.value}")
+        return lines
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def render(self):
+        lines = []
+        labelnames = self.labelnames + ("le",)
+        for values, child in self._samples():
+            with child._lock:
+                counts = list(child.counts)
+                total, count = child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(labelnames, values + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, values)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, values)} {count}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector):
+        # collector() returns [(name, documentation, {label tuple: value} or value), ...] rendered as gauges
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                gauges = collector()
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {str(e)}")
+                continue
+            for name, documentation, labelnames, samples in gauges:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} gauge")
+                if not isinstance(samples, dict):
+                    samples = {(): samples}
+                for values, value in samples.items():
+                    lines.append(f"{name}{_format_labels(labelnames, values)} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+slash_commands = REGISTRY.counter(
+    "signalbot_slash_commands_total", "Slash commands handled", ("command", "outcome"))
+slash_command_latency = REGISTRY.histogram(
+    "signalbot_slash_command_seconds", "Time spent handling a slash command", ("command",))
+api_requests = REGISTRY.counter(
+    "signalbot_livepm_requests_total", "LivePM API requests", ("endpoint", "method", "status"))
+api_request_latency = REGISTRY.histogram(
+    "signalbot_livepm_request_seconds", "LivePM API request latency", ("endpoint", "method"))
+slack_requests = REGISTRY.counter(
+    "signalbot_slack_requests_total", "Slack Web API requests", ("method", "status"))
+slack_request_latency = REGISTRY.histogram(
+    "signalbot_slack_request_seconds", "Slack Web API request latency", ("method",))
+
+def _instrument(func, counter, histogram, label):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = func(*args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            histogram.labels(label).observe(time.perf_counter() - started)
+            counter.labels(label, outcome).inc()
+    return wrapper
+
+def instrumented_command(name):
+    def decorator(func):
+        return _instrument(func, slash_commands, slash_command_latency, name)
+    return decorator
+
+def observe_api_request(endpoint, method, status, elapsed):
+    api_requests.labels(endpoint, method, status).inc()
+    api_request_latency.labels(endpoint, method).observe(elapsed)
+
+def observe_slack_request(method, status, elapsed):
+    slack_requests.labels(method, status).inc()
+    slack_request_latency.labels(method).observe(elapsed)
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/metrics":
+            self._respond(200, REGISTRY.render(), "text/plain; version=0.0.4; charset=utf-8")
+        elif path == "/readyz":
+            if self.server.ready():
+                self._respond(200, "ready\n", "text/plain; charset=utf-8")
+            else:
+                self._respond(503, "warming up\n", "text/plain; charset=utf-8")
+        else:
+            self.send_error(404)
+
+    def _respond(self, status, body, content_type):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def start_metrics_server(port, host="127.0.0.1", ready=None):
+    # ready() decides what /readyz reports; without it the process is always ready
+    server = ThreadingHTTPServer((host, port), _MetricsRequestHandler)
+    server.daemon_threads = True
+    server.ready = ready or (lambda: True)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
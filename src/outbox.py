@@ -0,0 +1,370 @@
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from api_client import call_api, get_livepm_user_id, ApiRejectedError
+from cache import MISSING
+from resilience import CircuitOpenError
+from metrics import REGISTRY
+from config import (
+    OUTBOX_DB_PATH, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_DELAY, OUTBOX_MAX_RETRY_DELAY,
+    OUTBOX_POLL_INTERVAL, OUTBOX_LEASE, OUTBOX_BATCH_SIZE, OUTBOX_BATCH_WINDOW,
+    OUTBOX_CONCURRENCY, SIGNAL_BULK_ENDPOINT, API_CONNECT_TIMEOUT, API_READ_TIMEOUT, API_MAX_RETRIES,
+    API_RETRY_MAX_DELAY
+)
+
+logger = logging.getLogger(__name__)
+
+outbox_batch_size = REGISTRY.histogram(
+    "signalbot_outbox_batch_size", "Signals claimed per outbox flush", buckets=(1, 2, 5, 10, 25, 50, 100))
+outbox_flush_latency = REGISTRY.histogram(
+    "signalbot_outbox_flush_seconds", "Time to resolve and deliver one batch of outbox signals")
+
+def call_worst_case():
+    # Longest a single call_api can take: every attempt timing out, with the longest backoff between them
+    return (API_MAX_RETRIES + 1) * (API_CONNECT_TIMEOUT + API_READ_TIMEOUT) + API_MAX_RETRIES * API_RETRY_MAX_DELAY
+
+# The lease on a claimed batch, in multiples of the time the batch takes when no call is retried
+LEASE_BATCHES = 2
+
+def delivery_lease(batch_size, concurrency, bulk, batch_window=0.0):
+    # The flusher renews the lease while a batch is in flight, so it only has to outlast the
+    # time between renewals; keeping it short lets entries of a crashed flusher go out again soon
+    waves = -(-batch_size // max(1, concurrency))
+    calls = waves + (1 if bulk else waves)
+    return min(OUTBOX_LEASE, LEASE_BATCHES * (batch_window + calls * (API_CONNECT_TIMEOUT + API_READ_TIMEOUT)))
+
+def bulk_item_outcome(item):
+    # (added, retryable, reason) for one element of a bulk response. Failed items carry an
+    # "error" (or "detail") and/or an HTTP-style "status"; 5xx and 429 are worth retrying.
+    if not isinstance(item, dict):
+        return False, True, f"unexpected response {item!r}"
+    status = item.get("status")
+    error = item.get("error") or item.get("detail")
+    failed = bool(error) or (isinstance(status, int) and status >= 400) or status in ("error", "failed", "rejected")
+    if not failed:
+        return True, False, None
+    code = status if isinstance(status, int) else None
+    retryable = item.get("retryable", code is not None and (code >= 500 or code == 429))
+    return False, bool(retryable), str(error or status)
+
+def idempotency_key(entry):
+    # Stable across retries and flushers, so the backend can drop a repeat of a signal it already stored
+    return f"signalbot-outbox-{entry.id}"
+
+def create_signal(entry):
+    # Sends one entry to /signal/create. Returns the response, or None if it is worth retrying;
+    # raises ApiRejectedError for a 4xx.
+    try:
+        return call_api(
+            "/signal/create", method="POST", json=entry.payload,
+            headers={"Idempotency-Key": idempotency_key(entry)}, raise_rejected=True
+        )
+    except CircuitOpenError:
+        return None
+
+class OutboxEntry:
+    __slots__ = ("id", "payload", "slack_id", "channel_id", "attempts", "leased_until")
+
+    def __init__(self, id, payload, slack_id, channel_id, attempts, leased_until=None):
+        self.id = id
+        self.payload = payload
+        self.slack_id = slack_id
+        self.channel_id = channel_id
+        self.attempts = attempts
+        # When the claim on this entry runs out, as written by claim_due() or extend_lease()
+        self.leased_until = leased_until
+
+class SignalOutbox:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS signal_outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, slack_id TEXT, "
+            "channel_id TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+            "next_attempt_at REAL NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS signal_outbox_next_attempt_at ON signal_outbox (next_attempt_at)"
+        )
+
+    def enqueue(self, payload, slack_id, channel_id, delay=0):
+        # delay keeps the entry from flushers for that many seconds, e.g. while the caller sends it itself
+        now = time.time()
+        with self._lock:
+            entry_id = self._conn.execute(
+                "INSERT INTO signal_outbox (payload, slack_id, channel_id, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (json.dumps(payload, separators=(",", ":")), slack_id, channel_id, now + delay, now)
+            ).lastrowid
+        self._wakeup.set()
+        return entry_id
+
+    def claim_due(self, limit, lease=OUTBOX_LEASE):
+        # Due entries are leased so a crashed or parallel flusher can't deliver them twice
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, payload, slack_id, channel_id, attempts FROM signal_outbox "
+                    "WHERE next_attempt_at <= ? ORDER BY id LIMIT ?", (now, limit)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE signal_outbox SET next_attempt_at = ? WHERE id = ?",
+                    [(now + lease, row[0]) for row in rows]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [OutboxEntry(row[0], json.loads(row[1]), row[2], row[3], row[4], now + lease) for row in rows]
+
+    def extend_lease(self, entries, lease):
+        # Pushes the lease of entries that are still claimed out to lease seconds from now.
+        # Entries completed or rescheduled since no longer carry their lease and are left alone.
+        leased_until = time.time() + lease
+        with self._lock:
+            for entry in entries:
+                if entry.leased_until is None:
+                    continue
+                extended = self._conn.execute(
+                    "UPDATE signal_outbox SET next_attempt_at = ? WHERE id = ? AND next_attempt_at = ?",
+                    (leased_until, entry.id, entry.leased_until)
+                ).rowcount
+                entry.leased_until = leased_until if extended else None
+
+    def complete(self, entry):
+        with self._lock:
+            self._conn.execute("DELETE FROM signal_outbox WHERE id = ?", (entry.id,))
+
+    def retry_later(self, entry, delay):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE signal_outbox SET attempts = ?, payload = ?, next_attempt_at = ? WHERE id = ?",
+                (entry.attempts, json.dumps(entry.payload, separators=(",", ":")), time.time() + delay, entry.id)
+            )
+
+    def pending_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM signal_outbox").fetchone()[0]
+
+    def wait(self, timeout):
+        self._wakeup.wait(timeout)
+        self._wakeup.clear()
+
+class OutboxFlusher:
+    def __init__(self, outbox, client, batch_size=OUTBOX_BATCH_SIZE, batch_window=OUTBOX_BATCH_WINDOW,
+                 concurrency=OUTBOX_CONCURRENCY, bulk_endpoint=SIGNAL_BULK_ENDPOINT):
+        self.outbox = outbox
+        self.client = client
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.bulk_endpoint = bulk_endpoint
+        self.lease = delivery_lease(batch_size, concurrency, bool(bulk_endpoint), batch_window)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="signal-outbox")
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="signal-outbox-flusher", daemon=True)
+        self._counts_lock = threading.Lock()
+        self.delivered = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self.outbox._wakeup.set()
+        self._thread.join(timeout)
+        self._executor.shutdown(wait=False)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            entries = []
+            try:
+                entries = self.outbox.claim_due(self.batch_size, self.lease)
+                if entries and len(entries) < self.batch_size and self.batch_window > 0:
+                    # Give signals filed at the same moment a chance to join this batch
+                    time.sleep(self.batch_window)
+                    entries += self.outbox.claim_due(self.batch_size - len(entries), self.lease)
+                if entries:
+                    self.flush(entries)
+            except Exception as e:
+                logger.error(f"Signal outbox flush failed: {str(e)}")
+            if len(entries) < self.batch_size:
+                self.outbox.wait(OUTBOX_POLL_INTERVAL)
+
+    @contextmanager
+    def _renewing(self, entries):
+        # Keeps the batch leased while it is in flight, however long its calls take
+        done = threading.Event()
+
+        def renew():
+            while not done.wait(self.lease / 3):
+                try:
+                    self.outbox.extend_lease(entries, self.lease)
+                except Exception as e:
+                    logger.error(f"Renewing the outbox lease failed: {str(e)}")
+
+        thread = threading.Thread(target=renew, name="signal-outbox-lease", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            done.set()
+            thread.join()
+
+    def flush(self, entries):
+        started = time.perf_counter()
+        with self._renewing(entries):
+            ready = [entry for entry in self._executor.map(self._resolve_user, entries) if entry is not None]
+            if ready:
+                if self.bulk_endpoint:
+                    self._deliver_bulk(ready)
+                else:
+                    list(self._executor.map(self._deliver_one, ready))
+        outbox_batch_size.observe(len(entries))
+        outbox_flush_latency.observe(time.perf_counter() - started)
+
+    def _resolve_user(self, entry):
+        # Returns the entry if it can be sent, or None once it has been rescheduled or dropped
+        if entry.payload.get("user_id") is not None:
+            return entry
+        # The Slack user couldn't be resolved when the signal was queued
+        user_id = get_livepm_user_id(entry.slack_id)
+        if user_id is MISSING:
+            self._retry(entry)
+            return None
+        if user_id is None:
+            self._fail(entry, "your Slack ID is not registered. Please use the /register_user command and add the signal again.")
+            return None
+        entry.payload["user_id"] = user_id
+        return entry
+
+    def _deliver_one(self, entry):
+        try:
+            signal_response = create_signal(entry)
+        except ApiRejectedError as e:
+            # A 4xx won't go away on retry
+            return self._fail(entry, f"the LivePM API rejected it: {e.reason}")
+        if signal_response is None:
+            self._retry(entry)
+        else:
+            self._complete(entry, signal_response)
+
+    def _deliver_bulk(self, entries):
+        try:
+            bulk_response = call_api(self.bulk_endpoint, method="POST", json={
+                "signals": [dict(entry.payload, idempotency_key=idempotency_key(entry)) for entry in entries]
+            }, raise_rejected=True)
+        except ApiRejectedError as e:
+            # The whole batch was refused; one at a time, only the bad signals fail
+            logger.warning(f"Bulk signal delivery rejected ({e.reason}), sending {len(entries)} signals one by one")
+            list(self._executor.map(self._deliver_one, entries))
+            return
+        except CircuitOpenError:
+            bulk_response = None
+        if isinstance(bulk_response, dict):
+            bulk_response = bulk_response.get("signals")
+        if not isinstance(bulk_response, list) or len(bulk_response) != len(entries):
+            for entry in entries:
+                self._retry(entry)
+            return
+        for entry, signal_response in zip(entries, bulk_response):
+            added, retryable, reason = bulk_item_outcome(signal_response)
+            if added:
+                self._complete(entry, signal_response)
+            elif retryable:
+                self._retry(entry)
+            else:
+                self._fail(entry, f"the LivePM API rejected it: {reason}")
+
+    def _complete(self, entry, signal_response):
+        self.outbox.complete(entry)
+        with self._counts_lock:
+            self.delivered += 1
+        self._notify(entry, f"Signal added successfully: {signal_response}")
+
+    def _retry(self, entry):
+        entry.attempts += 1
+        if entry.attempts >= OUTBOX_MAX_ATTEMPTS:
+            return self._fail(entry, f"the LivePM API could not be reached after {entry.attempts} attempts.")
+        delay = min(OUTBOX_MAX_RETRY_DELAY, OUTBOX_RETRY_DELAY * 2 ** (entry.attempts - 1))
+        self.outbox.retry_later(entry, random.uniform(delay / 2, delay))
+        with self._counts_lock:
+            self.retried += 1
+
+    def _fail(self, entry, reason):
+        self.outbox.complete(entry)
+        with self._counts_lock:
+            self.failed += 1
+        logger.error(f"Dropping queued signal {entry.id}: {reason}")
+        self._notify(entry, f"Failed to add signal \"{entry.payload['signal']}\": {reason}")
+
+    def _notify(self, entry, text):
+        if not entry.channel_id:
+            return
+        try:
+            self.client.chat_postMessage(channel=entry.channel_id, text=text)
+        except Exception as e:
+            logger.error(f"Error reporting signal outcome: {str(e)}")
+
+    def stats(self):
+        with self._counts_lock:
+            stats = {
+                "pending": self.outbox.pending_count(),
+                "delivered": self.delivered,
+                "retried": self.retried,
+                "failed": self.failed,
+            }
+        return stats
+
+_outbox = None
+_outbox_lock = threading.Lock()
+_flusher = None
+
+def get_outbox():
+    global _outbox
+    if _outbox is None:
+        with _outbox_lock:
+            if _outbox is None:
+                _outbox = SignalOutbox(OUTBOX_DB_PATH)
+    return _outbox
+
+def signal_payload(text, org_ids, user_id):
+    return {
+        "signal": text,
+        "organization_ids": org_ids,
+        "user_id": user_id,
+        "source": "Slack",
+        "type": "manual"
+    }
+
+def enqueue_signal(text, org_ids, user_id, slack_id, channel_id):
+    return get_outbox().enqueue(signal_payload(text, org_ids, user_id), slack_id, channel_id)
+
+def start_outbox_flusher(client):
+    global _flusher
+    if _flusher is None:
+        _flusher = OutboxFlusher(get_outbox(), client)
+        _flusher.start()
+    return _flusher
+
+def _collect_metrics():
+    stats = _flusher.stats() if _flusher is not None else {"pending": get_outbox().pending_count()}
+    gauges = [("signalbot_outbox_pending", "Signals waiting in the outbox", (), stats["pending"])]
+    for name in ("delivered", "retried", "failed"):
+        if name in stats:
+            gauges.append((f"signalbot_outbox_{name}", f"Outbox signals {name}", (), stats[name]))
+    return gauges
+
+REGISTRY.register_collector(_collect_metrics)
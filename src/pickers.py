@@ -0,0 +1,121 @@
+import logging
+from concurrent.futures import TimeoutError
+from api_client import load_listing, search_listing
+from commands import submit
+from config import conversation_states
+from dedupe import user_lock, UserBusyError
+from slack_outbound import hold_messages
+from message_handler import dispatch_message
+from utils import ORGANIZATION_PICKER, USER_PICKER, CUSTOMER_ORGANIZATION_PICKER, CONFIRM_PICKER
+
+logger = logging.getLogger(__name__)
+
+# Slack shows at most 100 options, each with at most 75 characters of text
+MAX_OPTIONS = 100
+MAX_OPTION_TEXT = 75
+# Slack gives up on an options request after 3 seconds
+OPTIONS_DEADLINE = 2.0
+
+# Offered while a listing that wasn't in memory loads in the background; selecting it does nothing
+LOADING_VALUE = "loading"
+LOADING_OPTION = {"text": {"type": "plain_text", "text": "Loading… type again in a moment"}, "value": LOADING_VALUE}
+
+# Picker -> the conversation state its selection answers
+PICKER_STATES = {
+    ORGANIZATION_PICKER: 'awaiting_org_selection',
+    USER_PICKER: 'awaiting_user_selection',
+    CUSTOMER_ORGANIZATION_PICKER: 'awaiting_customer_org_selection',
+}
+
+def listing_key(block_id):
+    # Block IDs are "organizations:<customer org ID>", "users:<customer org ID>" or "customer_organizations"
+    kind, _, customer_org_id = block_id.partition(":")
+    if not customer_org_id:
+        return (kind,)
+    return (kind, int(customer_org_id) if customer_org_id.isdigit() else customer_org_id)
+
+def option_text(row):
+    suffix = f" ({row['id']})"
+    name = str(row['name'])
+    if len(name) + len(suffix) > MAX_OPTION_TEXT:
+        name = name[:MAX_OPTION_TEXT - len(suffix) - 1] + "…"
+    return name + suffix
+
+def picker_options(block_id, query, deadline=OPTIONS_DEADLINE):
+    key = listing_key(block_id)
+    rows = search_listing(key, query, MAX_OPTIONS)
+    if rows is None:
+        # Evicted or never loaded: load it, but answer in time even if LivePM is slow.
+        # The load carries on after a timeout, so a later keystroke finds it in memory.
+        try:
+            submit(load_listing, key).result(deadline)
+        except TimeoutError:
+            return [LOADING_OPTION]
+        except Exception as e:
+            logger.warning(f"Loading {key[0]} for a picker failed: {str(e)}")
+            return []
+        rows = search_listing(key, query, MAX_OPTIONS) or []
+    return [{"text": {"type": "plain_text", "text": option_text(row)}, "value": str(row['id'])} for row in rows]
+
+def confirmed_selection(body, block_id):
+    # (picker action ID, picked values) of the multi-select in block_id, from the message
+    # state Slack sends along with the Done button
+    block = ((body.get('state') or {}).get('values') or {}).get(block_id) or {}
+    for action_id, picker in block.items():
+        if action_id in PICKER_STATES:
+            return action_id, [option['value'] for option in picker.get('selected_options') or []]
+    return None, []
+
+def register_pickers(app):
+    def handle_options(ack, body):
+        # Answered from the in-memory listing index; LivePM is only called if the listing isn't there
+        ack(options=picker_options(body.get('block_id', ''), body.get('value', '')))
+
+    def handle_selection(ack, body, action, client):
+        ack()
+        if 'selected_options' in action:
+            # Picks in a multi-select stay in the message until Done is pressed
+            return
+        submit_selection(body, client, action['action_id'], [action['selected_option']['value']])
+
+    def handle_confirm(ack, body, action, client):
+        ack()
+        picker, values = confirmed_selection(body, action['value'])
+        if not values:
+            channel_id = (body.get('channel') or {}).get('id')
+            if channel_id:
+                client.chat_postMessage(channel=channel_id, text="Pick at least one entry first, or reply 'none'.")
+            return
+        submit_selection(body, client, picker, values)
+
+    def submit_selection(body, client, action_id, values):
+        user_id = body['user']['id']
+        values = [value for value in values if value != LOADING_VALUE]
+        if not values:
+            return
+
+        conversation = conversation_states.get(user_id)
+        channel_id = (body.get('channel') or {}).get('id') or (conversation and conversation.dm_channel_id)
+        if not channel_id:
+            return
+        try:
+            with user_lock(user_id), hold_messages():
+                conversation = conversation_states.get(user_id)
+                if conversation is None or conversation.state != PICKER_STATES[action_id]:
+                    client.chat_postMessage(
+                        channel=channel_id,
+                        text="That list is no longer active. Use the command again to start over."
+                    )
+                    return
+                # A selection is handled exactly like typing the IDs as a reply
+                dispatch_message(user_id, channel_id, ",".join(values), client)
+        except UserBusyError:
+            client.chat_postMessage(
+                channel=channel_id,
+                text="I'm still working on your previous message. Please try again in a moment."
+            )
+
+    for action_id in PICKER_STATES:
+        app.options(action_id)(handle_options)
+        app.action(action_id)(handle_selection)
+    app.action(CONFIRM_PICKER)(handle_confirm)
@@ -0,0 +1,139 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import threading
+import time
+from config import RECORD_FILE, RECORD_SALT, RECORD_TEXT, conversation_states
+
+logger = logging.getLogger(__name__)
+
+# Replies the handlers treat specially are kept as they are when text is masked
+KEYWORDS = {"new", "none"}
+_WORD = re.compile(r"[^\W\d_]+")
+# Conversation states whose replies pick existing rows by name, and the listing they are matched against
+REFERENCE_STATES = {
+    "awaiting_org_selection": "organizations",
+    "awaiting_user_selection": "users",
+    "awaiting_customer_org_selection": "customer_organizations",
+}
+
+def pseudonymize(value, salt):
+    # Slack IDs become stable stand-ins with the same type prefix (U, T, D, C...), so a
+    # user's command and replies still line up in the log without revealing who they were
+    if not value:
+        return value
+    digest = hmac.new(salt, str(value).encode(), hashlib.sha256).hexdigest()[:10].upper()
+    return f"{str(value)[0]}{digest}"
+
+def mask_text(text):
+    # Letters become 'x' and everything else (IDs, separators, spacing) is kept, so
+    # "12, 14 | Wants SSO" records as "12, 14 | xxxxx xxx"
+    if not text:
+        return text
+    return _WORD.sub(lambda word: word.group(0) if word.group(0).lower() in KEYWORDS else "x" * len(word.group(0)), text)
+
+def pseudonymize_words(text, salt):
+    # Like mask_text, but each word becomes the same stand-in word wherever it appears,
+    # so a name picked in one reply still matches when it's picked again
+    if not text:
+        return text
+    def replace(word):
+        word = word.group(0)
+        if word.lower() in KEYWORDS:
+            return word
+        digest = hmac.new(salt, word.lower().encode(), hashlib.sha256).digest()
+        return "".join(chr(ord("a") + byte % 26) for byte in digest[:len(word)])
+    return _WORD.sub(replace, text)
+
+class Recorder:
+    # Appends redacted slash commands and DM messages to a JSONL log for replay.py
+    def __init__(self, path, salt=None, text_mode="mask", states=None):
+        self.path = path
+        # Where the bot keeps conversations, to tell which replies name existing rows
+        self.states = states
+        self.salt = (salt or os.urandom(16).hex()).encode()
+        self.text_mode = text_mode
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=1)
+        self.recorded = 0
+
+    def _id(self, value):
+        return pseudonymize(value, self.salt)
+
+    def _text(self, text, references=False):
+        if self.text_mode == "keep":
+            return text
+        return pseudonymize_words(text, self.salt) if references else mask_text(text)
+
+    def _reference_listing(self, user_id):
+        conversation = self.states.get(user_id) if self.states is not None else None
+        return REFERENCE_STATES.get(conversation.state) if conversation is not None else None
+
+    def record_body(self, body):
+        if body.get("command"):
+            text = body.get("text", "")
+            orgs, separator, signal_text = text.partition("|")
+            refs = None
+            if body["command"] == "/add_signal" and separator:
+                # The organizations of an inline /add_signal are names to match, the rest is signal text
+                refs = "organizations"
+                text = self._text(orgs, references=True) + separator + self._text(signal_text)
+            else:
+                text = self._text(text)
+            entry = {
+                "kind": "command",
+                "command": body["command"],
+                "text": text,
+                "user_id": self._id(body.get("user_id")),
+                "team_id": self._id(body.get("team_id")),
+                "channel_id": self._id(body.get("channel_id")),
+                "trigger_id": self._id(body.get("trigger_id")),
+            }
+        elif (body.get("event") or {}).get("type") == "message":
+            event = body["event"]
+            if not event.get("user") or event.get("bot_id"):
+                return
+            # Read before the handler runs, so it's the state the reply is answering
+            refs = self._reference_listing(event.get("user"))
+            entry = {
+                "kind": "message",
+                "user": self._id(event.get("user")),
+                "team": self._id(event.get("team") or body.get("team_id")),
+                "channel": self._id(event.get("channel")),
+                "channel_type": event.get("channel_type"),
+                "text": self._text(event.get("text", ""), references=refs is not None),
+                "event_id": self._id(body.get("event_id")),
+            }
+        else:
+            return
+        if refs:
+            entry["refs"] = refs
+        # Wall-clock time, so logs from several worker processes interleave correctly
+        entry["t"] = round(time.time(), 3)
+        line = json.dumps(entry, separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self.recorded += 1
+
+    def middleware(self, body, next):
+        # Bolt global middleware; recording never gets in the way of handling
+        try:
+            self.record_body(body)
+        except Exception as e:
+            logger.error(f"Recording a Slack payload failed: {str(e)}")
+        return next()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def install_recorder(app, path=RECORD_FILE, salt=RECORD_SALT, text_mode=RECORD_TEXT):
+    if not path:
+        return None
+    recorder = Recorder(path, salt, text_mode, conversation_states)
+    app.use(recorder.middleware)
+    logger.info(f"Recording Slack commands and messages to {path}")
+    return recorder
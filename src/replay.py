@@ -0,0 +1,323 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from benchmark import BotUnderTest, percentile, peak_rss_kb
+from stand_ins import FakeLivePMServer, FakeSlackClient
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay a recorded command/message log (RECORD_FILE) against local Slack and LivePM stand-ins.")
+    parser.add_argument("log", help="JSONL log written by the recorder")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed relative to the recording, e.g. 1, 10, 100")
+    parser.add_argument("--workers", type=int, default=32, help="handler threads, like Bolt's listener pool")
+    parser.add_argument("--max-gap", type=float, default=60.0,
+                        help="recorded idle gaps longer than this many seconds are shortened to it")
+    parser.add_argument("--loops", type=int, default=1, help="times to replay the log")
+    parser.add_argument("--soak", type=float, help="keep replaying the log for this many hours, sampling resource use")
+    parser.add_argument("--sample-interval", type=float, default=60.0, help="seconds between soak samples")
+    parser.add_argument("--samples", help="append soak samples to this JSONL file")
+    parser.add_argument("--max-rss-growth", type=float,
+                        help="exit non-zero if RSS grows more than this many MB between the first and last sample")
+    parser.add_argument("--register", action=argparse.BooleanOptionalAction, default=True,
+                        help="register every recorded workspace and Slack user with the LivePM stand-in")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="seconds added to each LivePM response")
+    parser.add_argument("--slack-latency", type=float, default=0.01, help="seconds added to each Slack Web API call")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+def load_log(path, max_gap):
+    # Returns entries with "offset" in seconds from the first one, idle gaps capped at max_gap
+    with open(path) as f:
+        entries = sorted((json.loads(line) for line in f if line.strip()), key=lambda entry: entry["t"])
+    offset = 0.0
+    for previous, entry in zip([None] + entries, entries):
+        if previous is not None:
+            offset += min(max_gap, entry["t"] - previous["t"])
+        entry["offset"] = offset
+    return entries
+
+def reference_names(entry):
+    # Names an entry's text uses to pick existing rows: the organizations of an inline
+    # /add_signal, or a reply to an organization, user or customer organization list
+    text = entry.get("text") or ""
+    if entry["kind"] == "command":
+        text = text.partition("|")[0]
+    parts = text.split(",") if entry["refs"] == "organizations" else [text]
+    return [part.strip() for part in parts if part.strip() and not part.strip().isdigit()
+            and part.strip().lower() not in ("new", "none")]
+
+def seed_references(state, entries):
+    # Adds a stand-in row for every recorded name, so flows that picked rows by name
+    # still resolve. A name that was a partial or ambiguous match now matches exactly.
+    seeded = 0
+    for entry in entries:
+        if entry.get("refs"):
+            for name in reference_names(entry):
+                seeded += state.add_named(entry["refs"], name)
+    return seeded
+
+def current_rss_kb():
+    # Resident set size now, where /proc is available; peak RSS elsewhere
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError):
+        return peak_rss_kb()
+
+class Replayer:
+    def __init__(self, bot, speed, workers):
+        self.bot = bot
+        self.speed = speed
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._deliveries = itertools.count(1)
+        self.events = 0
+        self.errors = 0
+        self.error_samples = set()
+        self.latencies = deque(maxlen=100000)
+        self.lags = deque(maxlen=100000)
+
+    def _payload(self, entry, loop):
+        # Delivery IDs get the loop number so dedupe doesn't drop later loops
+        delivery = next(self._deliveries)
+        if entry["kind"] == "command":
+            command = {key: entry.get(key) for key in ("command", "text", "user_id", "team_id", "channel_id")}
+            command["trigger_id"] = f"{entry.get('trigger_id') or 'replay'}-{loop}-{delivery}"
+            return command, None
+        event = {
+            "type": "message",
+            "user": entry["user"],
+            "team": entry.get("team"),
+            "channel": entry.get("channel") or f"D{entry['user']}",
+            "channel_type": entry.get("channel_type") or "im",
+            "text": entry.get("text", ""),
+            "ts": f"{delivery}.000000",
+        }
+        return event, {"event_id": f"{entry.get('event_id') or 'Ev'}-{loop}-{delivery}"}
+
+    def _deliver(self, entry, loop, previous):
+        # A user's events are handled in recorded order, as they were typed
+        if previous is not None:
+            try:
+                previous.result()
+            except Exception:
+                pass
+        payload, body = self._payload(entry, loop)
+        started = time.perf_counter()
+        error = None
+        try:
+            if entry["kind"] == "command":
+                self.bot.deliver_command(payload)
+            else:
+                self.bot.deliver_message(payload, body)
+        except Exception as e:
+            error = str(e)
+        with self._lock:
+            self.events += 1
+            self.latencies.append(time.perf_counter() - started)
+            if error is not None:
+                self.errors += 1
+                if len(self.error_samples) < 5:
+                    self.error_samples.add(error)
+
+    def run(self, entries, loop, executor):
+        last_by_user = {}
+        started = time.perf_counter()
+        for entry in entries:
+            target = started + entry["offset"] / self.speed
+            delay = target - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            with self._lock:
+                # How far behind the recorded pace dispatch has fallen
+                self.lags.append(max(0.0, time.perf_counter() - target))
+            user = entry.get("user_id") or entry.get("user")
+            last_by_user[user] = executor.submit(self._deliver, entry, loop, last_by_user.get(user))
+        for future in last_by_user.values():
+            future.exception()
+
+    def stats(self):
+        with self._lock:
+            latencies = list(self.latencies)
+            lags = list(self.lags)
+            return {
+                "events": self.events,
+                "errors": self.errors,
+                "error_samples": sorted(self.error_samples),
+                "handler_latency_seconds": {
+                    "p50": percentile(latencies, 0.5),
+                    "p95": percentile(latencies, 0.95),
+                    "p99": percentile(latencies, 0.99),
+                    "max": max(latencies) if latencies else 0.0,
+                },
+                "dispatch_lag_seconds": {
+                    "p95": percentile(lags, 0.95),
+                    "max": max(lags) if lags else 0.0,
+                },
+            }
+
+class SoakSampler:
+    # Samples state size, threads and RSS while the replay runs
+    def __init__(self, replayer, conversation_states, interval, path=None):
+        self.replayer = replayer
+        self.conversation_states = conversation_states
+        self.interval = interval
+        self.path = path
+        self.samples = []
+        self._stop = threading.Event()
+        self._started = time.perf_counter()
+        self._last = (self._started, 0)
+
+    def sample(self):
+        now = time.perf_counter()
+        events = self.replayer.events
+        sample = {
+            "elapsed_seconds": round(now - self._started, 1),
+            "events": events,
+            "events_per_second": (events - self._last[1]) / (now - self._last[0]) if now > self._last[0] else 0.0,
+            "conversations": len(self.conversation_states),
+            "threads": threading.active_count(),
+            "rss_kb": current_rss_kb(),
+        }
+        self._last = (now, events)
+        self.samples.append(sample)
+        if self.path:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(sample) + "\n")
+        return sample
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.sample()
+        threading.Thread(target=self._run, name="soak-sampler", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.sample()
+
+    def summary(self):
+        # Growth is measured from the second sample, once pools and caches have filled
+        first = self.samples[1] if len(self.samples) > 2 else self.samples[0]
+        last = self.samples[-1]
+        hours = (last["elapsed_seconds"] - first["elapsed_seconds"]) / 3600
+        return {
+            "samples": len(self.samples),
+            "rss_kb": {"first": first["rss_kb"], "last": last["rss_kb"], "max": max(s["rss_kb"] for s in self.samples)},
+            "rss_growth_kb_per_hour": (last["rss_kb"] - first["rss_kb"]) / hours if hours else 0.0,
+            "threads": {"first": first["threads"], "last": last["threads"], "max": max(s["threads"] for s in self.samples)},
+            "conversations": {"last": last["conversations"], "max": max(s["conversations"] for s in self.samples)},
+            "events_per_second": {
+                "min": min(s["events_per_second"] for s in self.samples[1:]) if len(self.samples) > 1 else 0.0,
+                "max": max(s["events_per_second"] for s in self.samples[1:]) if len(self.samples) > 1 else 0.0,
+            },
+        }
+
+def main(argv=None):
+    args = parse_args(argv)
+    entries = load_log(args.log, args.max_gap)
+    if not entries:
+        raise SystemExit(f"No commands or messages in {args.log}")
+
+    server = FakeLivePMServer(latency=args.api_latency).start()
+    if args.register:
+        for entry in entries:
+            team_id = entry.get("team_id") or entry.get("team")
+            if team_id:
+                server.state.teams[team_id] = 1
+            server.state.slack_users[entry.get("user_id") or entry["user"]] = 1
+    seeded = seed_references(server.state, entries)
+    workdir = tempfile.TemporaryDirectory(prefix="signalbot-replay-")
+    os.environ.update({
+        "API_BASE_URL": server.base_url,
+        "API_KEY": "replay",
+        "SLACK_BOT_TOKEN": "xoxb-replay",
+        "SLACK_APP_TOKEN": "xapp-replay",
+        "OUTBOX_DB_PATH": os.path.join(workdir.name, "signal_outbox.db"),
+    })
+    os.environ.setdefault("STATE_DB_PATH", os.path.join(workdir.name, "conversation_states.db"))
+    os.environ.setdefault("OUTBOX_POLL_INTERVAL", "0.05")
+
+    flusher = None
+    sampler = None
+    loops = 0
+    started = time.perf_counter()
+    try:
+        client = FakeSlackClient(latency=args.slack_latency)
+        bot = BotUnderTest(client)
+        from config import conversation_states
+        from outbox import start_outbox_flusher
+        flusher = start_outbox_flusher(client)
+
+        replayer = Replayer(bot, args.speed, args.workers)
+        if args.soak:
+            sampler = SoakSampler(replayer, conversation_states, args.sample_interval, args.samples).start()
+        deadline = time.perf_counter() + args.soak * 3600 if args.soak else None
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="replay") as executor:
+            while True:
+                replayer.run(entries, loops, executor)
+                loops += 1
+                if deadline is None and loops >= args.loops:
+                    break
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        if flusher is not None:
+            flusher.stop(timeout=5)
+        server.stop()
+        workdir.cleanup()
+    duration = time.perf_counter() - started
+
+    report = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "config": {
+            "log": args.log,
+            "recorded_events": len(entries),
+            "speed": args.speed,
+            "workers": args.workers,
+            "api_latency": args.api_latency,
+            "slack_latency": args.slack_latency,
+            "state_backend": os.environ.get("STATE_BACKEND", "memory"),
+            "reference_entries": sum(1 for entry in entries if entry.get("refs")),
+            "seeded_names": seeded,
+        },
+        "loops": loops,
+        "duration_seconds": duration,
+        "events_per_second": replayer.events / duration if duration else 0.0,
+        "backend_calls": server.total_calls(),
+        "slack_calls": client.total_calls(),
+        "peak_rss_kb": peak_rss_kb(),
+        **replayer.stats(),
+    }
+    if sampler is not None:
+        report["soak"] = sampler.summary()
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if sampler is not None and args.max_rss_growth is not None:
+        growth_mb = (report["soak"]["rss_kb"]["last"] - report["soak"]["rss_kb"]["first"]) / 1024
+        if growth_mb > args.max_rss_growth:
+            print(f"RSS grew {growth_mb:.1f}MB during the soak (limit {args.max_rss_growth}MB)", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
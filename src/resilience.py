@@ -0,0 +1,124 @@
+import random
+import threading
+import time
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class CircuitOpenError(Exception):
+    def __init__(self, family, retry_after):
+        self.family = family
+        self.retry_after = retry_after
+        super().__init__(
+            f"The LivePM API is temporarily unavailable for {family} requests. "
+            f"Please try again in {max(1, int(retry_after + 0.5))} seconds."
+        )
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, family, failure_threshold=5, reset_timeout=30):
+        self.family = family
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        # Raises CircuitOpenError instead of letting a request through to a failing backend
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.family, remaining)
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                # Only one probe request at a time while half-open
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    raise CircuitOpenError(self.family, self.reset_timeout)
+                self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
+
+class RetryBudget:
+    # Each request deposits `ratio` tokens and each retry spends one, so retries
+    # stay a bounded fraction of traffic when the backend is struggling.
+    def __init__(self, ratio=0.2, reserve=10):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.tokens = float(reserve)
+        self.retries = 0
+        self.exhausted = 0
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.reserve, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens < 1:
+                self.exhausted += 1
+                return False
+            self.tokens -= 1
+            self.retries += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {"tokens": self.tokens, "retries": self.retries, "exhausted": self.exhausted}
+
+def backoff_delay(attempt, base_delay, max_delay):
+    # Full jitter: uniform between 0 and the exponential cap
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+def endpoint_family(endpoint):
+    segment = endpoint.strip("/").split("/", 1)[0].split("?", 1)[0]
+    return f"/{segment}/*"
+
+def is_backend_failure(status):
+    # status is None when no response was received at all
+    return status is None or status == 429 or status >= 500
+
+def should_retry(method, status, connect_failed=False):
+    if method == "GET":
+        return status is None or status in RETRYABLE_STATUS_CODES
+    # Writes are only retried when the backend certainly didn't process them
+    return status in (429, 503) or connect_failed
+
+def parse_retry_after(value, max_delay):
+    try:
+        return min(max_delay, float(value))
+    except (TypeError, ValueError):
+        return None
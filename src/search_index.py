@@ -0,0 +1,237 @@
+import bisect
+import heapq
+import itertools
+import math
+import threading
+from collections import OrderedDict, defaultdict
+
+# A lone fuzzy match is only picked for the user when at least this much of the query matched
+AUTO_SELECT_SCORE = 0.8
+
+def normalize(text):
+    return " ".join(str(text).casefold().split())
+
+class PrefixIndex:
+    # Sorted (term, id) pairs over each row's full name, its words and its ID,
+    # so a prefix lookup is a bisect plus a short scan
+    def __init__(self, rows=()):
+        self._rows = {}
+        self._terms = []
+        for row in rows:
+            self._rows[str(row['id'])] = row
+            self._terms.extend((term, str(row['id'])) for term in self._row_terms(row))
+        self._terms.sort()
+
+    @staticmethod
+    def _row_terms(row):
+        name = normalize(row['name'])
+        return {name, str(row['id'])} | set(name.split())
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, row):
+        row_id = str(row['id'])
+        if row_id in self._rows:
+            return
+        self._rows[row_id] = row
+        for term in self._row_terms(row):
+            bisect.insort(self._terms, (term, row_id))
+
+    def search(self, query, limit=100):
+        query = normalize(query)
+        if not query:
+            return list(itertools.islice(self._rows.values(), limit))
+        matches = {}
+        terms = self._terms
+        position = bisect.bisect_left(terms, (query,))
+        while position < len(terms) and len(matches) < limit:
+            term, row_id = terms[position]
+            if not term.startswith(query):
+                break
+            matches.setdefault(row_id, self._rows[row_id])
+            position += 1
+        return list(matches.values())
+
+def trigrams(text):
+    padded = f"  {normalize(text)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TrigramIndex:
+    def __init__(self, rows=()):
+        self._rows = {}
+        self._grams = {}
+        # Trigram -> (size, position, ID) of the rows containing it, shortest name first,
+        # so a search can stop once longer names can't rank
+        self._postings = {}
+        indexed = []
+        for row in rows:
+            row_id = str(row['id'])
+            if row_id not in self._rows:
+                self._rows[row_id] = row
+                grams = self._grams[row_id] = trigrams(row['name'])
+                indexed.append((len(grams), len(indexed), row_id))
+        # Appending shortest first leaves every posting in order without sorting it
+        indexed.sort()
+        postings = self._postings
+        for entry in indexed:
+            for gram in self._grams[entry[2]]:
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = []
+                posting.append(entry)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, row):
+        row_id = str(row['id'])
+        if row_id in self._rows:
+            return
+        grams = self._grams[row_id] = trigrams(row['name'])
+        entry = (len(grams), len(self._rows), row_id)
+        self._rows[row_id] = row
+        for gram in grams:
+            bisect.insort(self._postings.setdefault(gram, []), entry)
+
+    def search(self, query, limit=5, min_score=0.7):
+        # Returns [(score, row)] best first, score being the share of the query's trigrams
+        # found in the name; ties go to shorter names (higher Jaccard similarity).
+        # Postings are visited rarest first. A row missing from the first j of them shares
+        # at most len - j trigrams, so the scan stops once no unseen row can reach min_score
+        # or beat the current top `limit`, and within a posting once the names get too long.
+        grams = trigrams(query)
+        if not grams:
+            return []
+        order = sorted(grams, key=lambda gram: len(self._postings.get(gram, ())))
+        needed = max(1, math.ceil(len(grams) * min_score))
+        top = []
+        seen = set()
+        for position, gram in enumerate(order):
+            bound = len(grams) - position
+            if bound < needed or (len(top) == limit and bound < top[0][0]):
+                break
+            rest = set(order[position + 1:])
+            for size, order_position, row_id in self._postings.get(gram, ()):
+                if len(top) == limit and bound == top[0][0] and size >= -top[0][1]:
+                    break
+                if row_id in seen:
+                    continue
+                seen.add(row_id)
+                count = 1 + len(self._grams[row_id] & rest)
+                if count < needed:
+                    continue
+                entry = (count, -size, -order_position, row_id)
+                if len(top) < limit:
+                    heapq.heappush(top, entry)
+                elif entry > top[0]:
+                    heapq.heapreplace(top, entry)
+        return [(count / len(grams), self._rows[row_id]) for count, _, _, row_id in sorted(top, reverse=True)]
+
+class ListingIndex:
+    # The prefix index answers picker searches, the trigram index resolves typed
+    # names. Each is built on first use and then kept up to date by add().
+    def __init__(self, rows=()):
+        self._rows = list(rows)
+        self._prefix = None
+        self._trigrams = None
+        self._lock = threading.Lock()
+        # Normalized name -> rows, so a name typed in full resolves without a search
+        self._exact = defaultdict(list)
+        for row in self._rows:
+            self._exact[normalize(row['name'])].append(row)
+
+    def build(self):
+        # Builds both indexes now rather than on first use; returns self
+        self.prefix
+        self.trigrams
+        return self
+
+    def add(self, row):
+        with self._lock:
+            self._rows.append(row)
+            self._exact[normalize(row['name'])].append(row)
+            if self._prefix is not None:
+                self._prefix.add(row)
+            if self._trigrams is not None:
+                self._trigrams.add(row)
+
+    @property
+    def prefix(self):
+        if self._prefix is None:
+            with self._lock:
+                if self._prefix is None:
+                    self._prefix = PrefixIndex(self._rows)
+        return self._prefix
+
+    @property
+    def trigrams(self):
+        if self._trigrams is None:
+            with self._lock:
+                if self._trigrams is None:
+                    self._trigrams = TrigramIndex(self._rows)
+        return self._trigrams
+
+    def search(self, query, limit=100):
+        return self.prefix.search(query, limit)
+
+    def resolve(self, name, limit=5):
+        # Returns (row, []) for an unambiguous match, otherwise (None, shortlist)
+        exact = self._exact.get(normalize(name), ())
+        if len(exact) == 1:
+            return exact[0], []
+        results = self.trigrams.search(name, limit=limit)
+        if not results:
+            return None, []
+        normalized = normalize(name)
+        exact = [row for _, row in results if normalize(row['name']) == normalized]
+        if len(exact) == 1:
+            return exact[0], []
+        complete = [row for score, row in results if score == 1.0]
+        if len(complete) == 1:
+            return complete[0], []
+        if len(results) == 1 and results[0][0] >= AUTO_SELECT_SCORE:
+            return results[0][1], []
+        return None, [row for _, row in results]
+
+class ListingIndexes:
+    # Listing key -> index over the last rows seen for it. An index outlives its
+    # listing's cache entry, so lookups never need to go back to the API.
+    def __init__(self, maxsize=512, factory=ListingIndex):
+        self.maxsize = maxsize
+        self.factory = factory
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, rows=None):
+        with self._lock:
+            entry = self._indexes.get(key)
+            if entry is not None and (rows is None or entry[0] is rows):
+                self._indexes.move_to_end(key)
+                return entry[1]
+        if rows is None:
+            return None
+        index = self.factory(rows)
+        with self._lock:
+            self._indexes[key] = (rows, index)
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.maxsize:
+                self._indexes.popitem(last=False)
+        return index
+
+    def add(self, key, row, rows=None):
+        # Keeps an existing index in step with a listing that gained a row
+        with self._lock:
+            entry = self._indexes.get(key)
+            if entry is None:
+                return
+            if rows is not None:
+                self._indexes[key] = (rows, entry[1])
+        entry[1].add(row)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._indexes.pop(key, None)
+
+    def __len__(self):
+        return len(self._indexes)
@@ -0,0 +1,35 @@
+import time
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+from metrics import observe_slack_request
+import tracing
+
+class InstrumentedWebClient(WebClient):
+    # Set by slack_outbound.start_message_scheduler to queue, pace and merge posts
+    message_scheduler = None
+
+    def chat_postMessage(self, **kwargs):
+        if self.message_scheduler is None:
+            return super().chat_postMessage(**kwargs)
+        # Sent later by a sender thread, so only the hand-off is part of the trace. Returns a
+        # Future for the Slack response, not the response itself.
+        with tracing.span("slack", method="chat.postMessage", queued=True):
+            return self.message_scheduler.post(kwargs)
+
+    def post_message_now(self, **kwargs):
+        return super().chat_postMessage(**kwargs)
+
+    # Every Web API method goes through api_call, so timing it covers them all
+    def api_call(self, api_method, **kwargs):
+        started = time.perf_counter()
+        status = "exception"
+        with tracing.span("slack", method=api_method):
+            try:
+                response = super().api_call(api_method, **kwargs)
+                status = "ok"
+                return response
+            except SlackApiError as e:
+                status = e.response.get("error", "error") if e.response is not None else "error"
+                raise
+            finally:
+                observe_slack_request(api_method, status, time.perf_counter() - started)
@@ -0,0 +1,264 @@
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from cache import TTLCache, MISSING
+from metrics import REGISTRY
+from resilience import parse_retry_after
+from config import (
+    SLACK_CHANNEL_RATE, SLACK_CHANNEL_BURST, SLACK_SENDER_WORKERS, SLACK_MAX_RETRY_AFTER, CHANNEL_CACHE_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+# Slack's limits for a single message
+MAX_BLOCKS = 50
+MAX_TEXT = 4000
+MAX_SECTION_TEXT = 3000
+
+_held = threading.local()
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated_at")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def delay(self, now):
+        # Seconds until a token is available
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+def _as_blocks(message):
+    if message.get("blocks"):
+        return list(message["blocks"])
+    return [{"type": "section", "text": {"type": "mrkdwn", "text": message.get("text") or " "}}]
+
+def _options(message):
+    return {key: value for key, value in message.items() if key not in ("text", "blocks")}
+
+def merge_messages(first, second):
+    # One message carrying both, or None when they can't be combined
+    if _options(first) != _options(second):
+        return None
+    text = "\n\n".join(part for part in (first.get("text"), second.get("text")) if part)
+    if len(text) > MAX_TEXT:
+        return None
+    merged = dict(first, text=text)
+    if first.get("blocks") or second.get("blocks"):
+        if any(not message.get("blocks") and len(message.get("text") or "") > MAX_SECTION_TEXT
+               for message in (first, second)):
+            return None
+        blocks = _as_blocks(first) + _as_blocks(second)
+        block_ids = [block["block_id"] for block in blocks if "block_id" in block]
+        if len(blocks) > MAX_BLOCKS or len(block_ids) != len(set(block_ids)):
+            return None
+        merged["blocks"] = blocks
+    return merged
+
+def _settle(futures, response=None, error=None):
+    for future in futures:
+        if future.done():
+            continue
+        if error is None:
+            future.set_result(response)
+        else:
+            future.set_exception(error)
+
+def retry_after(error):
+    # Seconds to back off for a 429 from Slack, or None for any other error
+    response = getattr(error, "response", None)
+    if response is None or getattr(response, "status_code", None) != 429:
+        return None
+    headers = getattr(response, "headers", None) or {}
+    value = next((value for key, value in headers.items() if key.lower() == "retry-after"), None)
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else None
+    delay = parse_retry_after(value, SLACK_MAX_RETRY_AFTER)
+    return 1.0 if delay is None else delay
+
+@contextmanager
+def hold_messages():
+    # Messages posted inside the block go out when it exits, so a handler's
+    # consecutive messages to one channel become a single post
+    if getattr(_held, "messages", None) is not None:
+        yield
+        return
+    _held.messages = []
+    try:
+        yield
+    finally:
+        held, _held.messages = _held.messages, None
+        merged = []
+        for scheduler, message, futures in held:
+            if merged and merged[-1][0] is scheduler and merged[-1][1]["channel"] == message["channel"]:
+                combined = merge_messages(merged[-1][1], message)
+                if combined is not None:
+                    merged[-1] = (scheduler, combined, merged[-1][2] + futures)
+                    scheduler.count("coalesced")
+                    continue
+            merged.append((scheduler, message, futures))
+        for scheduler, message, futures in merged:
+            scheduler._enqueue(message, futures)
+
+class MessageScheduler:
+    def __init__(self, send, rate=SLACK_CHANNEL_RATE, burst=SLACK_CHANNEL_BURST, workers=SLACK_SENDER_WORKERS):
+        self._send = send
+        self.rate = rate
+        self.burst = burst
+        self.workers = workers
+        self._pending = OrderedDict()
+        self._busy = set()
+        # An idle bucket refills within burst / rate seconds, so older ones can be dropped
+        self._buckets = TTLCache(maxsize=CHANNEL_CACHE_SIZE, ttl=max(1.0, burst / rate))
+        self._paused_until = 0.0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._threads = []
+        self._counts = Counter()
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"slack-sender-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def count(self, name, amount=1):
+        with self._cond:
+            self._counts[name] += amount
+
+    def post(self, message):
+        # Returns a Future for the Slack response of the post that carries message, which
+        # may be merged with others; it fails with the error if Slack refuses the post
+        self.count("posted")
+        future = Future()
+        held = getattr(_held, "messages", None)
+        if held is not None:
+            held.append((self, message, [future]))
+        else:
+            self._enqueue(message, [future])
+        return future
+
+    def _enqueue(self, message, futures):
+        channel = message["channel"]
+        with self._cond:
+            queue = self._pending.get(channel)
+            if queue:
+                merged = merge_messages(queue[-1][0], message)
+                if merged is not None:
+                    queue[-1] = (merged, queue[-1][1] + futures)
+                    self._counts["coalesced"] += 1
+                    return
+            self._pending.setdefault(channel, deque()).append((message, futures))
+            self._cond.notify()
+
+    def _bucket(self, channel):
+        bucket = self._buckets.get(channel)
+        if bucket is MISSING:
+            bucket = TokenBucket(self.rate, self.burst)
+            self._buckets.set(channel, bucket)
+        return bucket
+
+    def _next(self):
+        # Called with the lock held; returns ((channel, (message, futures)), None) or (None, seconds to wait)
+        now = time.monotonic()
+        if now < self._paused_until:
+            return None, self._paused_until - now
+        wait = None
+        for channel, queue in self._pending.items():
+            if channel in self._busy:
+                continue
+            bucket = self._bucket(channel)
+            delay = bucket.delay(now)
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            bucket.take()
+            self._buckets.set(channel, bucket)
+            item = queue.popleft()
+            if queue:
+                self._pending.move_to_end(channel)
+            else:
+                del self._pending[channel]
+            self._busy.add(channel)
+            return (channel, item), None
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped and not self._pending:
+                        return
+                    item, wait = self._next()
+                    if item is not None:
+                        break
+                    self._cond.wait(wait)
+            channel, (message, futures) = item
+            requeue = None
+            try:
+                response = self._send(**message)
+                self.count("sent")
+                _settle(futures, response)
+            except Exception as e:
+                requeue = retry_after(e)
+                if requeue is None:
+                    logger.error(f"Error posting Slack message to {channel}: {str(e)}")
+                    self.count("failed")
+                    _settle(futures, error=e)
+            with self._cond:
+                if requeue is not None:
+                    # A 429 pauses every channel, as Slack asks
+                    self._paused_until = max(self._paused_until, time.monotonic() + requeue)
+                    self._pending.setdefault(channel, deque()).appendleft((message, futures))
+                    self._counts["rate_limited"] += 1
+                self._busy.discard(channel)
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counts)
+            stats["pending"] = sum(len(queue) for queue in self._pending.values())
+            stats["paused_for"] = max(0.0, self._paused_until - time.monotonic())
+        return stats
+
+_scheduler = None
+
+def start_message_scheduler(client):
+    # Routes client.chat_postMessage through a scheduler that sends via client.post_message_now
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = MessageScheduler(client.post_message_now).start()
+        client.message_scheduler = _scheduler
+    return _scheduler
+
+def _collect_metrics():
+    if _scheduler is None:
+        return []
+    stats = _scheduler.stats()
+    gauges = [
+        ("signalbot_slack_outbound_pending", "Slack messages waiting to be sent", (), stats["pending"]),
+        ("signalbot_slack_outbound_paused_seconds", "Seconds left in a Slack Retry-After pause", (), stats["paused_for"]),
+    ]
+    for name in ("posted", "sent", "coalesced", "rate_limited", "failed"):
+        gauges.append((f"signalbot_slack_outbound_{name}", f"Slack messages {name.replace('_', ' ')}", (), stats.get(name, 0)))
+    return gauges
+
+REGISTRY.register_collector(_collect_metrics)
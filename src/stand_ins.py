@@ -0,0 +1,205 @@
+import itertools
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Local stand-ins for the Slack Web API and the LivePM API, used by the
+# benchmark and replay tools. Nothing here imports the bot's own modules.
+
+class FakeLivePMState:
+    def __init__(self, organizations=20, users=20):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(10000)
+        self.teams = {}
+        self.slack_users = {}
+        self.customer_organizations = [{"id": 1, "name": "Benchmark Customer"}]
+        self.organizations = {1: [{"id": i, "name": f"Organization {i}"} for i in range(1, organizations + 1)]}
+        self.users = {1: [{"id": i, "name": f"User {i}"} for i in range(1, users + 1)]}
+        self.signals = 0
+
+    def add_named(self, listing, name, customer_org_id=1):
+        # Adds an organization, user or customer organization called name unless one exists;
+        # returns how many rows were added
+        with self._lock:
+            rows = self.customer_organizations if listing == "customer_organizations" else \
+                getattr(self, listing).setdefault(customer_org_id, [])
+            if any(row["name"].lower() == name.lower() for row in rows):
+                return 0
+            rows.append({"id": next(self._ids), "name": name})
+            return 1
+
+    def handle(self, method, path, params, body):
+        with self._lock:
+            if path == "/customerorganization/slack":
+                team_id = params.get("slack_id")
+                if team_id in self.teams:
+                    return 200, {"customer_organization_id": self.teams[team_id]}
+                return 200, {}
+            if path == "/customerorganization/list":
+                return 200, self.customer_organizations
+            if path == "/customerorganization/create":
+                new_id = next(self._ids)
+                self.customer_organizations.append({"id": new_id, "name": body.get("name")})
+                return 200, {"customerorganization_id": new_id}
+            if path == "/customerorganization/register":
+                self.teams[params.get("slack_id")] = int(params.get("customer_organization_id"))
+                return 200, {"status": "registered"}
+            if path == "/organization/list":
+                return 200, self.organizations.get(int(params.get("customer_organization_id", 0)), [])
+            if path == "/organization/create":
+                new_id = next(self._ids)
+                customer_org_id = int(body.get("Customer_Organization_id"))
+                self.organizations.setdefault(customer_org_id, []).append({"id": new_id, "name": body.get("name")})
+                return 200, {"organization_id": new_id}
+            if path == "/user/list":
+                return 200, self.users.get(int(params.get("customer_organization_id", 0)), [])
+            if path == "/user/create":
+                new_id = next(self._ids)
+                customer_org_id = int(body.get("Customer_Organization_id"))
+                self.users.setdefault(customer_org_id, []).append({"id": new_id, "name": body.get("name")})
+                return 200, {"user_id": new_id}
+            if path == "/user/register":
+                data = body or params
+                self.slack_users[data.get("slack_id")] = int(data.get("user_id"))
+                return 200, {"status": "registered"}
+            if path == "/user/slack":
+                slack_id = params.get("slack_id")
+                if slack_id in self.slack_users:
+                    return 200, {"user_id": self.slack_users[slack_id]}
+                return 200, {}
+            if path == "/signal/create":
+                self.signals += 1
+                return 200, {"signal_id": next(self._ids)}
+            if path == "/signal/bulk_create":
+                self.signals += len(body.get("signals", []))
+                return 200, [{"signal_id": next(self._ids)} for _ in body.get("signals", [])]
+        return 404, {"detail": "Not Found"}
+
+class FakeLivePMServer:
+    def __init__(self, latency=0.0, error_rate=0.0, port=0, state=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.state = state or FakeLivePMState()
+        self.calls = Counter()
+        self._calls_lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately; with Nagle on, keep-alive
+            # responses stall on the client's delayed ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _handle(self, method):
+                url = urlparse(self.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else {}
+                with server._calls_lock:
+                    server.calls[url.path] += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                if server.error_rate and random.random() < server.error_rate:
+                    status, payload = 503, {"detail": "Injected failure"}
+                else:
+                    status, payload = server.state.handle(method, url.path, params, body)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-livepm", daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def call_counts(self):
+        with self._calls_lock:
+            return dict(self.calls)
+
+    def total_calls(self):
+        with self._calls_lock:
+            return sum(self.calls.values())
+
+class FakeSlackClient:
+    def __init__(self, latency=0.0, team_id="TBENCH"):
+        self.latency = latency
+        self.team_id = team_id
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._waiters = {}
+        self._bot_ts = itertools.count(1)
+
+    def _record(self, method):
+        with self._lock:
+            self.calls[method] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def chat_postMessage(self, channel, text="", **kwargs):
+        self._record("chat.postMessage")
+        with self._lock:
+            waiters = list(self._waiters.get(channel, ()))
+        for predicate, event in waiters:
+            if predicate(text):
+                event.set()
+        return {"ok": True, "channel": channel, "ts": f"{next(self._bot_ts)}.000000"}
+
+    def auth_test(self, **kwargs):
+        self._record("auth.test")
+        return {"ok": True, "team_id": self.team_id, "user_id": "UBOT"}
+
+    def conversations_open(self, users, **kwargs):
+        self._record("conversations.open")
+        user_id = users[0] if isinstance(users, (list, tuple)) else users.split(",")[0]
+        return {"ok": True, "channel": {"id": f"D{user_id}"}}
+
+    def conversations_info(self, channel, **kwargs):
+        self._record("conversations.info")
+        return {"ok": True, "channel": {"id": channel, "is_im": channel.startswith("D")}}
+
+    def expect_message(self, channel, predicate):
+        # Returns an Event set when a message to channel matches predicate
+        event = threading.Event()
+        with self._lock:
+            self._waiters.setdefault(channel, []).append((predicate, event))
+        return event
+
+    def forget_expectations(self, channel):
+        with self._lock:
+            self._waiters.pop(channel, None)
+
+    def call_counts(self):
+        with self._lock:
+            return dict(self.calls)
+
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
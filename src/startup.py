@@ -0,0 +1,109 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from metrics import REGISTRY
+from config import WARMUP_TEAM_IDS, WARMUP_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Measured from when this module is first imported, which the entry points do first
+STARTED_AT = time.perf_counter()
+
+_phases = {}
+_phases_lock = threading.Lock()
+_ready = threading.Event()
+_warm_up = {"tasks": 0, "failed": 0}
+
+@contextmanager
+def phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        with _phases_lock:
+            _phases[name] = elapsed
+        logger.info(f"Startup phase {name} took {elapsed * 1000:.0f}ms")
+
+def get_startup_stats():
+    with _phases_lock:
+        stats = {"phases": dict(_phases), **_warm_up}
+    stats["ready"] = _ready.is_set()
+    stats["uptime_seconds"] = time.perf_counter() - STARTED_AT
+    return stats
+
+def is_ready():
+    return _ready.is_set()
+
+def wait_until_ready(timeout=None):
+    return _ready.wait(timeout)
+
+def _attempt(name, load):
+    with _phases_lock:
+        _warm_up["tasks"] += 1
+    try:
+        return load()
+    except Exception as e:
+        with _phases_lock:
+            _warm_up["failed"] += 1
+        logger.warning(f"Warm-up of {name} failed: {str(e)}")
+        return None
+
+def _warm_listing(key, load):
+    # The loaders index the listing as it loads
+    _attempt(key[0], load)
+
+def _warm_team(executor, team_id):
+    from api_client import get_customer_org_id, get_organizations, get_users
+    customer_org_id = _attempt(f"customer organization of {team_id}", lambda: get_customer_org_id(team_id))
+    if not customer_org_id:
+        return []
+    return [
+        executor.submit(_warm_listing, ("organizations", customer_org_id), lambda: get_organizations(customer_org_id)),
+        executor.submit(_warm_listing, ("users", customer_org_id), lambda: get_users(customer_org_id)),
+    ]
+
+def _own_team(client):
+    response = _attempt("auth.test", client.auth_test)
+    return response.get("team_id") if response else None
+
+def _run_warm_up(client, team_ids, workers):
+    # Each workspace's customer organization lookup is followed by its organization
+    # and user listings; all of it runs in parallel with the customer organization listing.
+    from api_client import get_customer_organizations, start_user_cache_snapshots
+    try:
+        # Slack -> LivePM user mappings saved by the previous run, if snapshots are enabled
+        _attempt("user mapping snapshot", start_user_cache_snapshots)
+        with phase("warm_up"), ThreadPoolExecutor(max_workers=workers, thread_name_prefix="warm-up") as executor:
+            pending = [executor.submit(_warm_listing, ("customer_organizations",), get_customer_organizations)]
+            team_ids = list(team_ids)
+            if client is not None:
+                team_ids.append(_own_team(client))
+            teams = [executor.submit(_warm_team, executor, team_id) for team_id in dict.fromkeys(team_ids) if team_id]
+            pending.extend(future for team in teams for future in team.result())
+            for future in pending:
+                future.result()
+    finally:
+        # Ready even if some of it failed; those lookups just happen on first use
+        _ready.set()
+        stats = get_startup_stats()
+        logger.info(f"Ready after {stats['uptime_seconds']:.2f}s ({stats['failed']} of {stats['tasks']} warm-up lookups failed)")
+
+def start_warm_up(client=None, team_ids=WARMUP_TEAM_IDS, workers=WARMUP_WORKERS):
+    # Warms the caches for client's own workspace and team_ids in the background
+    thread = threading.Thread(target=_run_warm_up, args=(client, team_ids, workers), name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+def _collect_metrics():
+    stats = get_startup_stats()
+    return [
+        ("signalbot_ready", "1 once startup warm-up has finished", (), 1 if stats["ready"] else 0),
+        ("signalbot_warmup_failures", "Warm-up lookups that failed", (), stats["failed"]),
+        ("signalbot_startup_phase_seconds", "Time spent in each startup phase", ("phase",),
+         {(name,): seconds for name, seconds in stats["phases"].items()}),
+    ]
+
+REGISTRY.register_collector(_collect_metrics)
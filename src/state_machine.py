@@ -0,0 +1,116 @@
+import logging
+import time
+from metrics import REGISTRY
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Returned by a handler to finish the conversation
+END = "end"
+
+state_handlers = REGISTRY.counter(
+    "signalbot_state_handler_calls_total", "Conversation state handler invocations", ("state", "outcome"))
+state_handler_latency = REGISTRY.histogram(
+    "signalbot_state_handler_seconds", "Time spent in a conversation state handler", ("state",))
+state_transitions = REGISTRY.counter(
+    "signalbot_state_transitions_total", "Conversation state transitions", ("from_state", "to_state"))
+invalid_transitions = REGISTRY.counter(
+    "signalbot_invalid_state_transitions_total", "Transitions rejected by the state table", ("from_state", "to_state"))
+
+class InvalidTransitionError(Exception):
+    def __init__(self, from_state, to_state):
+        super().__init__(f"{from_state} -> {to_state} is not a declared transition")
+        self.from_state = from_state
+        self.to_state = to_state
+
+class _State:
+    __slots__ = ("name", "handler", "transitions")
+
+    def __init__(self, name, handler, transitions):
+        self.name = name
+        self.handler = handler
+        self.transitions = transitions
+
+def record_handler_metrics(state, outcome, elapsed):
+    state_handlers.labels(state, outcome).inc()
+    state_handler_latency.labels(state).observe(elapsed)
+
+def record_transition_metrics(from_state, to_state):
+    state_transitions.labels(from_state, to_state).inc()
+
+class StateMachine:
+    # Handlers take (conversation, user_id, channel_id, text, client) and return the
+    # next state, END, or None to stay put. The machine persists the result.
+    def __init__(self, store):
+        self.store = store
+        self._states = {}
+        self._handler_hooks = [record_handler_metrics]
+        self._transition_hooks = [record_transition_metrics]
+
+    def state(self, name, transitions=()):
+        def decorator(func):
+            if name in self._states:
+                raise ValueError(f"State {name} is already registered")
+            self._states[name] = _State(name, func, frozenset(transitions) | {name})
+            return func
+        return decorator
+
+    def on_handler(self, hook):
+        # hook(state, outcome, elapsed_seconds)
+        self._handler_hooks.append(hook)
+        return hook
+
+    def on_transition(self, hook):
+        # hook(from_state, to_state)
+        self._transition_hooks.append(hook)
+        return hook
+
+    def validate(self):
+        for spec in self._states.values():
+            unknown = spec.transitions - set(self._states) - {END}
+            if unknown:
+                raise ValueError(f"State {spec.name} declares unknown target(s): {', '.join(sorted(unknown))}")
+
+    def __contains__(self, name):
+        return name in self._states
+
+    def transitions(self):
+        return {name: sorted(spec.transitions - {name}) for name, spec in self._states.items()}
+
+    def _run_hooks(self, hooks, *args):
+        for hook in hooks:
+            try:
+                hook(*args)
+            except Exception as e:
+                logger.error(f"State machine hook failed: {str(e)}")
+
+    def dispatch(self, conversation, user_id, channel_id, text, client):
+        current = conversation.state
+        spec = self._states.get(current)
+        if spec is None:
+            logger.error(f"No handler for conversation state {current}")
+            return False
+
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            with tracing.span("handler", state=current):
+                next_state = spec.handler(conversation, user_id, channel_id, text, client)
+            outcome = "ok"
+        finally:
+            self._run_hooks(self._handler_hooks, current, outcome, time.perf_counter() - started)
+
+        if next_state is None:
+            next_state = current
+        if next_state not in spec.transitions:
+            invalid_transitions.labels(current, next_state).inc()
+            raise InvalidTransitionError(current, next_state)
+
+        if next_state == END:
+            self.store.delete(user_id)
+        else:
+            conversation.state = next_state
+            self.store.save(user_id, conversation)
+        if next_state != current:
+            self._run_hooks(self._transition_hooks, current, next_state)
+        return True
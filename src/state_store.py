@@ -0,0 +1,186 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class ConversationState:
+    __slots__ = (
+        "state",
+        "dm_channel_id",
+        "customer_org_id",
+        "selected_org_ids",
+        "slack_id",
+        "team_id",
+        "pending_signal",
+        "livepm_user_id",
+        "trace_id",
+        "updated_at",
+    )
+
+    def __init__(self, state, dm_channel_id, customer_org_id=None, selected_org_ids=None,
+                 slack_id=None, team_id=None, pending_signal=None, livepm_user_id=None,
+                 trace_id=None, updated_at=None):
+        self.state = state
+        self.dm_channel_id = dm_channel_id
+        self.customer_org_id = customer_org_id
+        self.selected_org_ids = selected_org_ids if selected_org_ids is not None else []
+        self.slack_id = slack_id
+        self.team_id = team_id
+        self.pending_signal = pending_signal
+        # Prefetched when the flow starts, so the signal step needn't look it up
+        self.livepm_user_id = livepm_user_id
+        # Ties the command and every reply in the flow into one trace
+        self.trace_id = trace_id
+        self.updated_at = updated_at
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__ if name != "updated_at"}
+
+    @classmethod
+    def from_dict(cls, data, updated_at=None):
+        return cls(updated_at=updated_at, **data)
+
+class ConversationStateStore:
+    def get(self, user_id):
+        raise NotImplementedError
+
+    def save(self, user_id, conversation):
+        raise NotImplementedError
+
+    def delete(self, user_id):
+        raise NotImplementedError
+
+    def sweep(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+class InMemoryStateStore(ConversationStateStore):
+    def __init__(self, ttl=86400, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # Ordered by last save, so expired entries are always at the front
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            conversation = self._states.get(user_id)
+            if conversation is None:
+                return None
+            if conversation.updated_at + self.ttl <= time.time():
+                del self._states[user_id]
+                return None
+            return conversation
+
+    def save(self, user_id, conversation):
+        conversation.updated_at = time.time()
+        with self._lock:
+            self._states[user_id] = conversation
+            self._states.move_to_end(user_id)
+            self._sweep_locked(conversation.updated_at)
+            while len(self._states) > self.max_entries:
+                self._states.popitem(last=False)
+
+    def delete(self, user_id):
+        with self._lock:
+            self._states.pop(user_id, None)
+
+    def sweep(self):
+        with self._lock:
+            return self._sweep_locked(time.time())
+
+    def _sweep_locked(self, now):
+        removed = 0
+        while self._states:
+            oldest = next(iter(self._states.values()))
+            if oldest.updated_at + self.ttl > now:
+                break
+            self._states.popitem(last=False)
+            removed += 1
+        return removed
+
+    def __len__(self):
+        return len(self._states)
+
+class SQLiteStateStore(ConversationStateStore):
+    def __init__(self, path, ttl=86400, max_entries=10000, sweep_every=100):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.sweep_every = sweep_every
+        self._saves = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversation_states ("
+            "user_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS conversation_states_updated_at ON conversation_states (updated_at)"
+        )
+
+    def get(self, user_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, updated_at FROM conversation_states WHERE user_id = ? AND updated_at > ?",
+                (user_id, time.time() - self.ttl)
+            ).fetchone()
+        if row is None:
+            return None
+        return ConversationState.from_dict(json.loads(row[0]), updated_at=row[1])
+
+    def save(self, user_id, conversation):
+        conversation.updated_at = time.time()
+        data = json.dumps(conversation.to_dict(), separators=(",", ":"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO conversation_states (user_id, data, updated_at) VALUES (?, ?, ?)",
+                (user_id, data, conversation.updated_at)
+            )
+            self._saves += 1
+            if self._saves % self.sweep_every == 0:
+                self._sweep_locked()
+
+    def delete(self, user_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM conversation_states WHERE user_id = ?", (user_id,))
+
+    def sweep(self):
+        with self._lock:
+            return self._sweep_locked()
+
+    def _sweep_locked(self):
+        removed = self._conn.execute(
+            "DELETE FROM conversation_states WHERE updated_at <= ?", (time.time() - self.ttl,)
+        ).rowcount
+        overflow = self._conn.execute("SELECT COUNT(*) FROM conversation_states").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            removed += self._conn.execute(
+                "DELETE FROM conversation_states WHERE user_id IN ("
+                "SELECT user_id FROM conversation_states ORDER BY updated_at LIMIT ?)", (overflow,)
+            ).rowcount
+        return removed
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM conversation_states WHERE updated_at > ?", (time.time() - self.ttl,)
+            ).fetchone()[0]
+
+def create_state_store(backend="memory", path="conversation_states.db", ttl=86400, max_entries=10000):
+    if backend == "memory":
+        return InMemoryStateStore(ttl=ttl, max_entries=max_entries)
+    if backend == "sqlite":
+        logger.info(f"Using SQLite conversation state store at {path}")
+        return SQLiteStateStore(path, ttl=ttl, max_entries=max_entries)
+    raise ValueError(f"Unknown conversation state backend: {backend}")
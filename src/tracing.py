@@ -0,0 +1,232 @@
+import atexit
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter, deque
+from contextlib import contextmanager
+from metrics import REGISTRY
+from config import (
+    TRACE_FILE, TRACE_SAMPLE_RATE, TRACE_SLOW_THRESHOLD, TRACE_EXPORT_BATCH_SIZE, TRACE_EXPORT_INTERVAL,
+    TRACE_MAX_QUEUE
+)
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("signalbot_span", default=None)
+
+def new_id():
+    return uuid.uuid4().hex
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start_time", "started", "duration", "attributes",
+                 "error", "segment")
+
+    def __init__(self, trace_id, parent_id, name, attributes, segment):
+        self.trace_id = trace_id
+        self.span_id = new_id()[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.start_time = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.attributes = attributes
+        self.error = None
+        self.segment = segment
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+class JSONLExporter:
+    # Appends one span per line
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        lines = "".join(json.dumps(span.to_dict(), default=str) + "\n" for span in spans)
+        with self._lock, open(self.path, "a") as output:
+            output.write(lines)
+
+class Tracer:
+    # Spans are grouped into segments: everything under one trace() call, e.g. one slash
+    # command or one DM reply. A finished segment is kept if its trace is sampled or if
+    # any span in it was slow, and kept segments are exported in batches by a background thread.
+    def __init__(self, exporter=None, sample_rate=0.1, slow_threshold=1.0, batch_size=100, interval=5.0,
+                 max_queue=10000):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = deque(maxlen=max_queue)
+        self._cond = threading.Condition()
+        self._thread = None
+        self._counts = Counter()
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    def sampled(self, trace_id):
+        # Decided by the trace ID, so every segment of a sampled flow is kept
+        return zlib.crc32(trace_id.encode()) / 2 ** 32 < self.sample_rate
+
+    @contextmanager
+    def trace(self, name, trace_id=None, **attributes):
+        # Starts a segment of trace_id, or of a new trace; yields None when tracing is off
+        if not self.enabled:
+            yield None
+            return
+        segment = []
+        root = Span(trace_id or new_id(), None, name, attributes, segment)
+        try:
+            with self._activate(root):
+                yield root
+        finally:
+            self._finish_segment(root)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        # A child of the current span; does nothing outside a trace
+        parent = _current.get()
+        if parent is None:
+            yield None
+            return
+        span = Span(parent.trace_id, parent.span_id, name, attributes, parent.segment)
+        with self._activate(span):
+            yield span
+
+    @contextmanager
+    def _activate(self, span):
+        token = _current.set(span)
+        try:
+            yield
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {str(e)}"
+            raise
+        finally:
+            _current.reset(token)
+            span.duration = time.perf_counter() - span.started
+            span.segment.append(span)
+
+    def _finish_segment(self, root):
+        spans = list(root.segment)
+        slow = any(span.duration >= self.slow_threshold for span in spans)
+        if not slow and not self.sampled(root.trace_id):
+            self.count("segments_dropped")
+            return
+        self.count("segments_slow" if slow else "segments_sampled")
+        with self._cond:
+            if len(self._queue) + len(spans) > self._queue.maxlen:
+                self._counts["spans_overflowed"] += len(spans)
+            self._queue.extend(spans)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    def count(self, name, amount=1):
+        with self._cond:
+            self._counts[name] += amount
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._queue) < self.batch_size:
+                    self._cond.wait(self.interval)
+            self.flush()
+
+    def flush(self):
+        while True:
+            with self._cond:
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            if not batch:
+                return
+            try:
+                self.exporter.export(batch)
+                self.count("spans_exported", len(batch))
+            except Exception as e:
+                self.count("export_failures")
+                logger.error(f"Exporting {len(batch)} spans failed: {str(e)}")
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counts)
+            stats["queued"] = len(self._queue)
+        return stats
+
+tracer = Tracer(
+    JSONLExporter(TRACE_FILE) if TRACE_FILE else None, sample_rate=TRACE_SAMPLE_RATE,
+    slow_threshold=TRACE_SLOW_THRESHOLD, batch_size=TRACE_EXPORT_BATCH_SIZE, interval=TRACE_EXPORT_INTERVAL,
+    max_queue=TRACE_MAX_QUEUE
+)
+
+def configure(exporter, **settings):
+    # Swaps in another exporter (anything with export(spans)) and optionally other Tracer settings
+    for name, value in settings.items():
+        setattr(tracer, name, value)
+    tracer.exporter = exporter
+
+def trace(name, trace_id=None, **attributes):
+    return tracer.trace(name, trace_id, **attributes)
+
+def span(name, **attributes):
+    return tracer.span(name, **attributes)
+
+def current_trace_id():
+    current = _current.get()
+    return current.trace_id if current is not None else None
+
+def annotate(**attributes):
+    # Adds attributes to the current span, if there is one
+    current = _current.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+def traced(name, **attributes):
+    # Runs each call of the decorated function as a segment of a new trace
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.trace(name, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def bind(func):
+    # For work handed to another thread: runs func inside the caller's current span
+    context = contextvars.copy_context()
+    def run(*args, **kwargs):
+        return context.run(func, *args, **kwargs)
+    return run
+
+def _collect_metrics():
+    stats = tracer.stats()
+    return [
+        ("signalbot_trace_segments", "Finished trace segments by what happened to them", ("outcome",),
+         {(outcome,): stats.get(f"segments_{outcome}", 0) for outcome in ("sampled", "slow", "dropped")}),
+        ("signalbot_trace_spans_exported", "Spans handed to the trace exporter", (), stats.get("spans_exported", 0)),
+        ("signalbot_trace_spans_queued", "Spans waiting to be exported", (), stats["queued"]),
+        ("signalbot_trace_export_failures", "Failed trace export batches", (), stats.get("export_failures", 0)),
+    ]
+
+REGISTRY.register_collector(_collect_metrics)
@@ -1,32 +1,102 @@
-from api_client import call_api
+from api_client import get_organizations, get_users, get_customer_organizations
+from cache import TTLCache, MISSING
+from config import CHANNEL_CACHE_SIZE, CHANNEL_CACHE_TTL
+
+# Channel ID -> whether it is a DM with the bot
+channel_cache = TTLCache(maxsize=CHANNEL_CACHE_SIZE, ttl=CHANNEL_CACHE_TTL)
+
+def remember_dm_channel(channel_id):
+    channel_cache.set(channel_id, True)
+
+# Slack user ID -> ID of their DM with the bot, which doesn't change
+dm_channel_cache = TTLCache(maxsize=CHANNEL_CACHE_SIZE, ttl=CHANNEL_CACHE_TTL)
+
+def open_dm(client, user_id):
+    dm_channel_id = dm_channel_cache.get(user_id)
+    if dm_channel_id is not MISSING:
+        return dm_channel_id
+    dm = client.conversations_open(users=[user_id])
+    dm_channel_id = dm['channel']['id']
+    remember_dm_channel(dm_channel_id)
+    dm_channel_cache.set(user_id, dm_channel_id)
+    return dm_channel_id
+
+def is_dm_channel(client, event):
+    channel_type = event.get('channel_type')
+    if channel_type:
+        return channel_type == 'im'
+    channel_id = event['channel']
+    is_im = channel_cache.get(channel_id)
+    if is_im is MISSING:
+        channel_info = client.conversations_info(channel=channel_id)
+        is_im = channel_info['channel']['is_im']
+        channel_cache.set(channel_id, is_im)
+    return is_im
+
+# Block Kit pickers; their options are served by pickers.py from the listing indexes
+ORGANIZATION_PICKER = "select_organizations"
+USER_PICKER = "select_user"
+CUSTOMER_ORGANIZATION_PICKER = "select_customer_organization"
+# Submits what is picked in a multi-select picker; its value is the picker's block ID
+CONFIRM_PICKER = "confirm_picker"
+
+def post_picker(client, channel_id, title, block_id, action_id, instructions, multi=False):
+    blocks = [
+        {
+            "type": "section",
+            "block_id": block_id,
+            "text": {"type": "mrkdwn", "text": title},
+            "accessory": {
+                "type": "multi_external_select" if multi else "external_select",
+                "action_id": action_id,
+                "placeholder": {"type": "plain_text", "text": "Search by name or ID"},
+                "min_query_length": 0,
+            },
+        },
+    ]
+    if multi:
+        # Each pick in a multi-select fires its own action, so the conversation only moves on at "Done"
+        blocks.append({"type": "actions", "elements": [{
+            "type": "button",
+            "action_id": CONFIRM_PICKER,
+            "text": {"type": "plain_text", "text": "Done"},
+            "style": "primary",
+            "value": block_id,
+        }]})
+    blocks.append({"type": "context", "elements": [{"type": "mrkdwn", "text": instructions}]})
+    client.chat_postMessage(channel=channel_id, text=f"{title}\n\n{instructions}", blocks=blocks)
 
 def show_organizations(client, channel_id, customer_org_id):
-    organizations = call_api("/organization/list", params={"customer_organization_id": customer_org_id})
-    org_list = "\n".join([f"{org['id']}: {org['name']}" for org in organizations])
-    client.chat_postMessage(
-        channel=channel_id,
-        text=f"Here are the available organizations:\n{org_list}\n\nPlease reply with:\n"
-             f"- One or more organization IDs (comma-separated)\n"
-             f"- 'new' to create a new organization\n"
-             f"- 'none' to proceed without selecting any organizations"
+    organizations = get_organizations(customer_org_id)
+    post_picker(
+        client, channel_id,
+        f"Pick from the {len(organizations)} available organizations, then press Done:",
+        f"organizations:{customer_org_id}", ORGANIZATION_PICKER,
+        "Or reply with:\n"
+        "- One or more organization IDs or names (comma-separated)\n"
+        "- 'new' to create a new organization\n"
+        "- 'none' to proceed without selecting any organizations",
+        multi=True
     )
 
 def show_users(client, channel_id, customer_org_id):
-    users = call_api("/user/list", params={"customer_organization_id": customer_org_id})
-    user_list = "\n".join([f"{user['id']}: {user['name']}" for user in users])
-    client.chat_postMessage(
-        channel=channel_id,
-        text=f"Here are the available users:\n{user_list}\n\nPlease reply with:\n"
-             f"- An existing user ID\n"
-             f"- 'new' to create a new user"
+    users = get_users(customer_org_id)
+    post_picker(
+        client, channel_id,
+        f"Pick from the {len(users)} available users:",
+        f"users:{customer_org_id}", USER_PICKER,
+        "Or reply with:\n"
+        "- An existing user ID or name\n"
+        "- 'new' to create a new user"
     )
 
 def show_customer_organizations(client, channel_id):
-    organizations = call_api("/customerorganization/list")
-    org_list = "\n".join([f"{org['id']}: {org['name']}" for org in organizations])
-    client.chat_postMessage(
-        channel=channel_id,
-        text=f"Here are the available customer organizations:\n{org_list}\n\nPlease reply with:\n"
-             f"- An existing customer organization ID\n"
-             f"- 'new' to create a new customer organization"
-    )
\ No newline at end of file
+    organizations = get_customer_organizations()
+    post_picker(
+        client, channel_id,
+        f"Pick from the {len(organizations)} available customer organizations:",
+        "customer_organizations", CUSTOMER_ORGANIZATION_PICKER,
+        "Or reply with:\n"
+        "- An existing customer organization ID or name\n"
+        "- 'new' to create a new customer organization"
+    )
@@ -0,0 +1,121 @@
+import asyncio
+import time
+import pytest
+import requests
+import api_client
+import async_api_client
+from api_client import ApiRejectedError, call_api
+from async_api_client import APIStatusError, call_api_async
+from resilience import RetryBudget
+
+OK = {"ok": True}
+
+# Each case is the method, raise_rejected and what successive attempts get back: a
+# decoded body, (status, Retry-After, body), "connect" for a failed connect or "reset"
+# for a connection dropped without a response
+CASES = [
+    ("GET", False, [OK]),
+    ("GET", False, [(503, None, ""), OK]),
+    ("GET", False, [(503, None, "")] * 5),
+    ("POST", False, [(503, None, ""), OK]),
+    ("GET", False, [(429, "2", ""), OK]),
+    ("POST", False, [(429, "7", ""), OK]),
+    ("GET", False, [(400, None, '{"detail": "bad slack_id"}')]),
+    ("GET", True, [(404, None, '{"detail": "no such workspace"}')]),
+    ("POST", True, [(409, None, "already registered")]),
+    ("POST", False, ["connect", OK]),
+    ("POST", False, ["reset", OK]),
+    ("GET", False, ["reset", "reset", OK]),
+]
+
+def _requests_failure(step):
+    if step == "connect":
+        return requests.exceptions.ConnectTimeout("connect timed out")
+    if step == "reset":
+        return requests.exceptions.ConnectionError("connection reset")
+    status, retry_after, body = step
+    response = requests.Response()
+    response.status_code = status
+    response._content = body.encode()
+    if retry_after:
+        response.headers["Retry-After"] = retry_after
+    return requests.exceptions.HTTPError(f"{status} error", response=response)
+
+def _aiohttp_failure(step):
+    if step == "connect":
+        return APIStatusError(None, connect_failed=True, message="connect timed out")
+    if step == "reset":
+        return APIStatusError(None, message="connection reset")
+    status, retry_after, body = step
+    return APIStatusError(status, retry_after, body.encode())
+
+@pytest.fixture
+def fresh_policy(monkeypatch):
+    monkeypatch.setattr(api_client, "_breakers", {})
+    monkeypatch.setattr(api_client, "retry_budget", RetryBudget(ratio=0.2, reserve=10))
+    # Deterministic backoff so both paths' waits can be compared
+    monkeypatch.setattr(api_client, "backoff_delay", lambda attempt, base, cap: 0.1 * (attempt + 1))
+
+def _outcome(run):
+    try:
+        result = run()
+    except ApiRejectedError as e:
+        result = ("rejected", e.status, e.reason)
+    breaker = api_client.get_breaker("/customerorganization/slack")
+    return result, breaker.consecutive_failures, api_client.retry_budget.tokens
+
+def _run_sync(monkeypatch, method, raise_rejected, steps):
+    steps = list(steps)
+    sleeps = []
+    def send(session, endpoint, method, params, json, timeout, headers=None):
+        step = steps.pop(0)
+        if isinstance(step, dict):
+            return step
+        raise _requests_failure(step)
+    monkeypatch.setattr(api_client, "_send", send)
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    outcome = _outcome(lambda: call_api("/customerorganization/slack", method, raise_rejected=raise_rejected))
+    return outcome, sleeps, len(steps)
+
+def _run_async(monkeypatch, method, raise_rejected, steps):
+    steps = list(steps)
+    sleeps = []
+    async def send(session, endpoint, method, params, json, headers):
+        step = steps.pop(0)
+        if isinstance(step, dict):
+            return step
+        raise _aiohttp_failure(step)
+    async def sleep(delay):
+        sleeps.append(delay)
+    async def get_session():
+        return None
+    monkeypatch.setattr(async_api_client, "_send", send)
+    monkeypatch.setattr(async_api_client, "get_async_session", get_session)
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    outcome = _outcome(lambda: asyncio.run(call_api_async(
+        "/customerorganization/slack", method, raise_rejected=raise_rejected
+    )))
+    return outcome, sleeps, len(steps)
+
+@pytest.mark.parametrize("method, raise_rejected, steps", CASES)
+def test_sync_and_async_calls_classify_responses_alike(monkeypatch, fresh_policy, method, raise_rejected, steps):
+    sync = _run_sync(monkeypatch, method, raise_rejected, steps)
+    monkeypatch.setattr(api_client, "_breakers", {})
+    monkeypatch.setattr(api_client, "retry_budget", RetryBudget(ratio=0.2, reserve=10))
+    assert _run_async(monkeypatch, method, raise_rejected, steps) == sync
+
+def test_retry_after_and_rejections(monkeypatch, fresh_policy):
+    (result, failures, _), sleeps, _ = _run_sync(monkeypatch, "GET", False, [(429, "2", ""), OK])
+    assert (result, failures, sleeps) == (OK, 0, [2.0])
+    (result, failures, _), sleeps, _ = _run_sync(
+        monkeypatch, "GET", True, [(404, None, '{"detail": "no such workspace"}')]
+    )
+    # A 4xx isn't retried and counts as a healthy backend
+    assert (result, failures, sleeps) == (("rejected", 404, "no such workspace"), 0, [])
+
+def test_exhausted_retries_give_up_and_count_against_the_breaker(monkeypatch, fresh_policy):
+    (result, failures, _), sleeps, unused = _run_sync(monkeypatch, "GET", False, [(503, None, "")] * 5)
+    assert result is None
+    assert failures == 1
+    assert len(sleeps) == api_client.API_MAX_RETRIES
+    assert unused == 5 - api_client.API_MAX_RETRIES - 1
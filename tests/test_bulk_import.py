@@ -0,0 +1,82 @@
+import io
+import pytest
+import bulk_import
+from bulk_import import RowError, RowResolver, detect_format, read_rows, split_references
+from cache import MISSING
+
+ORGANIZATIONS = [{"id": 11, "name": "Acme"}, {"id": 12, "name": "Acme Labs"}, {"id": 13, "name": "Globex"}]
+USERS = [{"id": 21, "name": "Dana Scully"}, {"id": 22, "name": "Fox Mulder"}]
+SLACK_USERS = {"U1": 31, "U2": None, "U3": MISSING}
+
+def test_detect_format():
+    assert detect_format("signals.JSONL") == "jsonl"
+    assert detect_format("signals.ndjson") == "jsonl"
+    assert detect_format("signals.csv") == "csv"
+
+def test_csv_rows_are_numbered_by_line_with_normalized_headers():
+    lines = io.StringIO('Signal, Organizations ,User\n"Spans\ntwo lines",Acme;Globex,21\nChurn risk,,\n')
+    rows = list(read_rows(lines, "csv"))
+    assert rows == [
+        (3, {"signal": "Spans\ntwo lines", "organizations": "Acme;Globex", "user": "21"}),
+        (4, {"signal": "Churn risk", "organizations": "", "user": ""}),
+    ]
+
+def test_jsonl_rows_report_bad_lines_without_stopping():
+    lines = ['{"signal": "one"}\n', "\n", "{not json\n", "[1, 2]\n", '{"signal": "two"}\n']
+    rows = list(read_rows(iter(lines), "jsonl"))
+    assert [number for number, _ in rows] == [1, 3, 4, 5]
+    assert rows[0][1] == {"signal": "one"} and rows[3][1] == {"signal": "two"}
+    assert isinstance(rows[1][1], RowError) and str(rows[1][1]).startswith("invalid JSON")
+    assert str(rows[2][1]) == "each line must be a JSON object"
+
+def test_read_rows_is_lazy():
+    def lines():
+        yield '{"signal": "one"}\n'
+        raise AssertionError("read past the first row")
+    assert next(read_rows(lines(), "jsonl")) == (1, {"signal": "one"})
+
+def test_split_references():
+    assert split_references("Acme; Globex, 13") == ["Acme", "Globex", "13"]
+    assert split_references([11, " 12 "]) == ["11", "12"]
+    assert split_references("None") == []
+    assert split_references(None) == []
+    assert split_references(" ; ") == []
+
+@pytest.fixture
+def resolver(monkeypatch):
+    monkeypatch.setattr(bulk_import, "get_organizations", lambda customer_org_id: ORGANIZATIONS)
+    monkeypatch.setattr(bulk_import, "get_users", lambda customer_org_id: USERS)
+    monkeypatch.setattr(bulk_import, "get_livepm_user_id", lambda slack_id: SLACK_USERS[slack_id])
+    return RowResolver(customer_org_id=8001, default_user_id=99)
+
+def test_resolver_builds_the_signal_payload(resolver):
+    payload = resolver.resolve({"signal": " Churn risk ", "organizations": "Globex; 11", "user": "fox mulder"})
+    assert payload["signal"] == "Churn risk"
+    assert payload["organization_ids"] == [13, 11]
+    assert payload["user_id"] == 22
+
+def test_resolver_user_falls_back_to_slack_id_then_the_default(resolver):
+    assert resolver.resolve({"text": "a", "slack_id": "U1"})["user_id"] == 31
+    assert resolver.resolve({"text": "a", "organization_ids": [11]})["user_id"] == 99
+    with pytest.raises(RowError, match="not registered"):
+        resolver.resolve({"text": "a", "slack_id": "U2"})
+    with pytest.raises(RowError, match="could not look up"):
+        resolver.resolve({"text": "a", "slack_id": "U3"})
+    with pytest.raises(RowError, match="no user_id"):
+        RowResolver(customer_org_id=8001).resolve({"text": "a"})
+
+def test_resolver_rejects_missing_text_and_unmatched_or_ambiguous_names(resolver):
+    with pytest.raises(RowError, match="missing signal text"):
+        resolver.resolve({"signal": "  "})
+    with pytest.raises(RowError, match="no organization matches 'Initech'"):
+        resolver.resolve({"signal": "a", "organizations": "Initech"})
+    with pytest.raises(RowError, match="more than one organization") as error:
+        resolver.resolve({"signal": "a", "organizations": "Acm"})
+    assert "Acme (11)" in str(error.value) and "Acme Labs (12)" in str(error.value)
+
+def test_resolver_reports_a_listing_that_could_not_load(resolver, monkeypatch):
+    monkeypatch.setattr(bulk_import, "get_organizations", lambda customer_org_id: None)
+    with pytest.raises(RowError, match="could not load organizations"):
+        resolver.resolve({"signal": "a", "organizations": "Acme"})
+    # IDs don't need the listing
+    assert resolver.resolve({"signal": "a", "organizations": "11"})["organization_ids"] == [11]
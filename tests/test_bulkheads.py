@@ -0,0 +1,92 @@
+import threading
+import pytest
+from bulkheads import FairScheduler, TenantBusyError, OrgBulkheads
+
+def run_in_order(scheduler, jobs):
+    # Holds the only worker on a gate job while jobs are queued, then returns the order they ran in
+    gate_started = threading.Event()
+    release = threading.Event()
+    order = []
+    def gate():
+        gate_started.set()
+        release.wait(5)
+    scheduler.submit("gate", gate)
+    assert gate_started.wait(5)
+    futures = [scheduler.submit(team_id, order.append, team_id) for team_id in jobs]
+    release.set()
+    for future in futures:
+        future.result(5)
+    return order
+
+def test_quiet_workspace_does_not_wait_behind_a_backlog():
+    scheduler = FairScheduler(workers=1, tenant_concurrency=1)
+    order = run_in_order(scheduler, ["noisy"] * 5 + ["quiet"])
+    assert order.index("quiet") == 1
+
+def test_weights_give_extra_turns():
+    scheduler = FairScheduler(workers=1, tenant_concurrency=1, weights={"big": 3})
+    order = run_in_order(scheduler, ["big"] * 6 + ["small"] * 2)
+    assert order == ["big", "big", "big", "small", "big", "big", "big", "small"]
+
+def test_full_queue_turns_work_away():
+    scheduler = FairScheduler(workers=1, tenant_concurrency=1, max_queue=2)
+    started = threading.Event()
+    release = threading.Event()
+    def hold():
+        started.set()
+        release.wait(5)
+    running = scheduler.submit("T1", hold)
+    assert started.wait(5)
+    queued = [scheduler.submit("T1", lambda: None) for _ in range(2)]
+    with pytest.raises(TenantBusyError):
+        scheduler.submit("T1", lambda: None)
+    # Other workspaces have queues of their own
+    other = scheduler.submit("T2", lambda: "ok")
+    release.set()
+    for future in [running, other] + queued:
+        future.result(5)
+    assert other.result() == "ok"
+
+def test_workspace_never_runs_more_than_its_concurrency():
+    scheduler = FairScheduler(workers=4, tenant_concurrency=2)
+    lock = threading.Lock()
+    running = []
+    peak = []
+    def job():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        threading.Event().wait(0.05)
+        with lock:
+            running.pop()
+    futures = [scheduler.submit("T1", job) for _ in range(6)]
+    for future in futures:
+        future.result(5)
+    assert max(peak) == 2
+
+def test_failures_reach_the_future_and_free_the_slot():
+    scheduler = FairScheduler(workers=1, tenant_concurrency=1)
+    def fail():
+        raise ValueError("bad row")
+    with pytest.raises(ValueError):
+        scheduler.submit("T1", fail).result(5)
+    assert scheduler.submit("T1", lambda: "next").result(5) == "next"
+    assert scheduler.stats() == {}
+
+def test_org_bulkhead_caps_calls_in_flight():
+    bulkheads = OrgBulkheads(limit=1)
+    entered = threading.Event()
+    def second_call():
+        with bulkheads.slot(42):
+            entered.set()
+    with bulkheads.slot(42):
+        assert bulkheads.stats() == {"42": 1}
+        blocked = threading.Thread(target=second_call)
+        blocked.start()
+        assert not entered.wait(0.1)
+        # Another organization isn't held up
+        with bulkheads.slot(7):
+            pass
+    assert entered.wait(5)
+    blocked.join(5)
+    assert bulkheads.stats() == {"42": 0, "7": 0}
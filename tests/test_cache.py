@@ -0,0 +1,80 @@
+import threading
+import pytest
+from cache import TTLCache, MISSING
+
+def test_get_or_load_caches_result_but_not_none():
+    cache = TTLCache()
+    calls = []
+    def load():
+        calls.append(1)
+        return "value"
+    assert cache.get_or_load("key", load) == "value"
+    assert cache.get_or_load("key", load) == "value"
+    assert len(calls) == 1
+    assert cache.get_or_load("missing", lambda: None) is None
+    assert cache.get("missing") is MISSING
+
+def test_concurrent_misses_share_one_load():
+    cache = TTLCache()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    def load():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "value"
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get_or_load("key", load)))
+    leader.start()
+    assert started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(cache.get_or_load("key", load)))
+    follower.start()
+    # Wait until the follower has joined the flight
+    while cache.stats()["coalesced"] < 1:
+        follower.join(0.01)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert results == ["value", "value"]
+    assert len(calls) == 1
+
+def test_invalidate_during_load_keeps_result_out_of_cache():
+    cache = TTLCache()
+    started = threading.Event()
+    release = threading.Event()
+    def load():
+        started.set()
+        release.wait(5)
+        return "before the write"
+    results = []
+    loader = threading.Thread(target=lambda: results.append(cache.get_or_load("key", load)))
+    loader.start()
+    assert started.wait(5)
+    cache.invalidate("key")
+    release.set()
+    loader.join(5)
+    # The caller still gets what it loaded, but the next lookup goes back to the source
+    assert results == ["before the write"]
+    assert cache.get("key") is MISSING
+    assert cache.get_or_load("key", lambda: "after the write") == "after the write"
+    assert cache.get("key") == "after the write"
+
+def test_load_error_reaches_caller_and_caches_nothing():
+    cache = TTLCache()
+    def load():
+        raise RuntimeError("backend down")
+    with pytest.raises(RuntimeError, match="backend down"):
+        cache.get_or_load("key", load)
+    assert cache.get("key") is MISSING
+
+def test_expired_and_evicted_entries_are_misses():
+    cache = TTLCache(maxsize=2)
+    cache.set("old", 1, ttl=-1)
+    assert cache.get("old") is MISSING
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("c", 3)
+    assert cache.get("a") is MISSING
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,73 @@
+import time
+import pytest
+from cache import MISSING, TTLCache
+from cache_sync import CacheSync
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "cache_sync.db")
+
+def test_a_change_published_by_one_worker_is_applied_by_the_others(db_path):
+    first = CacheSync(db_path)
+    second = CacheSync(db_path)
+    listings = TTLCache(maxsize=10, ttl=60)
+    listings.set(("organizations", 7), [{"id": 1, "name": "Acme"}])
+    second.on("listing", listings.invalidate)
+    first.publish("listing", ("organizations", 7))
+    assert second.poll() == 1
+    assert listings.get(("organizations", 7)) is MISSING
+    assert (first.published, second.applied) == (1, 1)
+    # Each change is applied once
+    assert second.poll() == 0
+
+def test_keys_round_trip(db_path):
+    first = CacheSync(db_path)
+    second = CacheSync(db_path)
+    received = []
+    second.on("customer_org", received.append)
+    second.on("listing", received.append)
+    first.publish("customer_org", "T123")
+    first.publish("listing", ("customer_organizations",))
+    second.poll()
+    assert received == ["T123", ("customer_organizations",)]
+
+def test_a_worker_ignores_its_own_and_older_changes(db_path):
+    first = CacheSync(db_path)
+    first.publish("listing", ("users", 7))
+    received = []
+    first.on("listing", received.append)
+    late = CacheSync(db_path)
+    late.on("listing", received.append)
+    assert first.poll() == 1
+    assert late.poll() == 0
+    assert received == []
+
+def test_a_failing_handler_does_not_stop_the_rest(db_path):
+    first = CacheSync(db_path)
+    second = CacheSync(db_path)
+    received = []
+    def handler(key):
+        if key == "bad":
+            raise RuntimeError("boom")
+        received.append(key)
+    second.on("livepm_user", handler)
+    for key in ("bad", "U1"):
+        first.publish("livepm_user", key)
+    first.publish("unhandled", "x")
+    assert second.poll() == 3
+    assert received == ["U1"]
+    assert second.applied == 1
+
+def test_prune_drops_events_past_retention(db_path):
+    sync = CacheSync(db_path, retention=0.1)
+    sync.publish("listing", ("users", 7))
+    time.sleep(0.2)
+    sync.publish("listing", ("users", 8))
+    sync.prune()
+    assert sync._conn.execute("SELECT COUNT(*) FROM cache_events").fetchone()[0] == 1
+
+def test_publish_failures_are_swallowed(db_path):
+    sync = CacheSync(db_path)
+    sync._conn.close()
+    sync.publish("listing", ("users", 7))
+    assert sync.published == 0
@@ -0,0 +1,108 @@
+import os
+import subprocess
+import sys
+import time
+import pytest
+from dedupe import SQLiteCoordinator
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "coordination.db")
+
+def test_a_delivery_is_handled_once_across_processes(db_path):
+    first = SQLiteCoordinator(db_path, dedupe_ttl=60)
+    second = SQLiteCoordinator(db_path, dedupe_ttl=60)
+    assert first.first_delivery("Ev01")
+    assert not first.first_delivery("Ev01")
+    # A second process sharing the database sees it too
+    assert not second.first_delivery("Ev01")
+    assert second.first_delivery("Ev02")
+    assert first.tracked_deliveries() == 2
+
+def test_a_delivery_is_handled_again_after_the_dedupe_window(db_path):
+    first = SQLiteCoordinator(db_path, dedupe_ttl=0.2)
+    second = SQLiteCoordinator(db_path, dedupe_ttl=0.2)
+    assert first.first_delivery("Ev01")
+    assert not second.first_delivery("Ev01")
+    time.sleep(0.3)
+    assert second.first_delivery("Ev01")
+    assert not first.first_delivery("Ev01")
+
+def test_expired_deliveries_are_swept(db_path):
+    coordinator = SQLiteCoordinator(db_path, dedupe_ttl=0.1, sweep_every=3)
+    coordinator.first_delivery("Ev01")
+    coordinator.first_delivery("Ev02")
+    time.sleep(0.2)
+    coordinator.first_delivery("Ev03")
+    rows = coordinator._conn.execute("SELECT key FROM deliveries").fetchall()
+    assert rows == [("Ev03",)]
+
+def test_a_user_lock_excludes_other_processes_until_released(db_path):
+    first = SQLiteCoordinator(db_path, lease=60)
+    second = SQLiteCoordinator(db_path, lease=60)
+    token = first.acquire("U1", 0)
+    assert token is not None
+    assert second.acquire("U1", 0) is None
+    assert second.acquire("U1", 0.1) is None
+    # Other users aren't affected
+    other = second.acquire("U2", 0)
+    assert other is not None
+    second.release("U2", other)
+    first.release("U1", token)
+    assert second.acquire("U1", 0) is not None
+
+def test_a_held_lock_is_renewed_past_its_lease(db_path):
+    holder = SQLiteCoordinator(db_path, lease=0.2)
+    other = SQLiteCoordinator(db_path, lease=0.2)
+    token = holder.acquire("U1", 0)
+    # A handler running for several leases keeps the lock
+    time.sleep(0.6)
+    assert other.acquire("U1", 0) is None
+    holder.release("U1", token)
+    assert other.acquire("U1", 0) is not None
+
+def test_a_crashed_holders_lease_expires(db_path):
+    crashed = SQLiteCoordinator(db_path, lease=0.2)
+    survivor = SQLiteCoordinator(db_path, lease=60)
+    stale = crashed.acquire("U1", 0)
+    # As if the process had died: nothing renews the lease any more
+    crashed._held.clear()
+    assert survivor.acquire("U1", 0) is None
+    started = time.monotonic()
+    token = survivor.acquire("U1", 2)
+    assert token is not None
+    assert time.monotonic() - started < 1
+    # The old holder releasing late doesn't drop the new holder's lease
+    crashed.release("U1", stale)
+    assert SQLiteCoordinator(db_path).acquire("U1", 0) is None
+    survivor.release("U1", token)
+
+def test_a_user_lock_held_by_another_os_process(db_path):
+    holder = subprocess.Popen(
+        [sys.executable, "-c", (
+            "import sys, time\n"
+            "from dedupe import SQLiteCoordinator\n"
+            "coordinator = SQLiteCoordinator(sys.argv[1], lease=60)\n"
+            "token = coordinator.acquire('U1', 0)\n"
+            "print('held' if token else 'busy', flush=True)\n"
+            "sys.stdin.readline()\n"
+            "coordinator.release('U1', token)\n"
+            "print('released', flush=True)\n"
+        ), db_path],
+        cwd=SRC, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+    )
+    try:
+        assert holder.stdout.readline().strip() == "held"
+        coordinator = SQLiteCoordinator(db_path, lease=60)
+        assert coordinator.acquire("U1", 0.2) is None
+        holder.stdin.write("\n")
+        holder.stdin.flush()
+        assert holder.stdout.readline().strip() == "released"
+        token = coordinator.acquire("U1", 1)
+        assert token is not None
+        coordinator.release("U1", token)
+    finally:
+        holder.kill()
+        holder.wait()
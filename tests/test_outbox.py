@@ -0,0 +1,134 @@
+import threading
+import time
+import pytest
+import outbox
+from api_client import ApiRejectedError
+from outbox import SignalOutbox, OutboxFlusher, signal_payload, delivery_lease, idempotency_key
+
+class RecordingClient:
+    def __init__(self):
+        self.messages = []
+
+    def chat_postMessage(self, channel, text="", **kwargs):
+        self.messages.append((channel, text))
+
+@pytest.fixture
+def store(tmp_path):
+    return SignalOutbox(str(tmp_path / "outbox.db"))
+
+@pytest.fixture
+def flusher(store):
+    flusher = OutboxFlusher(store, RecordingClient(), concurrency=1, bulk_endpoint=None)
+    yield flusher
+    # Never started; flush() is called directly
+    flusher._executor.shutdown()
+
+def enqueue(store, text="Wants SSO", delay=0):
+    return store.enqueue(signal_payload(text, [1], 7), "U1", "D1", delay=delay)
+
+def test_claim_leases_entries_until_the_lease_runs_out(store):
+    entry_id = enqueue(store)
+    claimed = store.claim_due(10, lease=0.2)
+    assert [entry.id for entry in claimed] == [entry_id]
+    assert claimed[0].payload["signal"] == "Wants SSO"
+    # Leased to this flusher, so nobody else gets it
+    assert store.claim_due(10, lease=0.2) == []
+    time.sleep(0.3)
+    # A flusher that died mid-delivery leaves it to be claimed again
+    assert [entry.id for entry in store.claim_due(10, lease=0.2)] == [entry_id]
+
+def test_claim_respects_limit_order_and_delay(store):
+    first = enqueue(store, "first")
+    second = enqueue(store, "second")
+    enqueue(store, "later", delay=60)
+    assert [entry.id for entry in store.claim_due(1)] == [first]
+    assert [entry.id for entry in store.claim_due(10)] == [second]
+    assert store.pending_count() == 3
+
+def test_delivered_entry_is_removed_and_reported(store, flusher, monkeypatch):
+    monkeypatch.setattr(outbox, "create_signal", lambda entry: {"signal_id": 99})
+    enqueue(store)
+    flusher.flush(store.claim_due(10))
+    assert store.pending_count() == 0
+    assert flusher.delivered == 1
+    assert flusher.client.messages == [("D1", "Signal added successfully: {'signal_id': 99}")]
+
+def test_unreachable_api_reschedules_with_backoff(store, flusher, monkeypatch):
+    monkeypatch.setattr(outbox, "create_signal", lambda entry: None)
+    monkeypatch.setattr(outbox, "OUTBOX_RETRY_DELAY", 60)
+    enqueue(store)
+    flusher.flush(store.claim_due(10))
+    assert store.pending_count() == 1
+    assert flusher.retried == 1
+    # Not due again until the retry delay has passed
+    assert store.claim_due(10) == []
+    assert flusher.client.messages == []
+
+def test_retries_give_up_after_max_attempts(store, flusher, monkeypatch):
+    monkeypatch.setattr(outbox, "create_signal", lambda entry: None)
+    monkeypatch.setattr(outbox, "OUTBOX_RETRY_DELAY", 0)
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 3)
+    enqueue(store)
+    for _ in range(3):
+        flusher.flush(store.claim_due(10))
+    assert store.pending_count() == 0
+    assert flusher.failed == 1
+    assert "could not be reached after 3 attempts" in flusher.client.messages[-1][1]
+
+def test_rejected_signal_fails_without_retrying(store, flusher, monkeypatch):
+    def reject(entry):
+        raise ApiRejectedError("/signal/create", 422, "organization 1 does not exist")
+    monkeypatch.setattr(outbox, "create_signal", reject)
+    enqueue(store)
+    flusher.flush(store.claim_due(10))
+    assert store.pending_count() == 0
+    assert flusher.retried == 0
+    assert flusher.failed == 1
+    assert "organization 1 does not exist" in flusher.client.messages[-1][1]
+
+def test_idempotency_key_is_stable_for_an_entry(store):
+    enqueue(store)
+    first = store.claim_due(10, lease=0)[0]
+    again = store.claim_due(10)[0]
+    assert idempotency_key(first) == idempotency_key(again)
+
+def test_lease_is_a_few_batch_durations_capped_at_outbox_lease(monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_LEASE", 1000)
+    call = outbox.API_CONNECT_TIMEOUT + outbox.API_READ_TIMEOUT
+    # 10 signals over 2 connections: 5 waves of user lookups and 5 of deliveries
+    assert delivery_lease(10, 2, bulk=False) == pytest.approx(2 * 10 * call)
+    # With a bulk endpoint the deliveries are a single call
+    assert delivery_lease(10, 2, bulk=True, batch_window=0.5) == pytest.approx(2 * (0.5 + 6 * call))
+    monkeypatch.setattr(outbox, "OUTBOX_LEASE", 60)
+    assert delivery_lease(50, 4, bulk=False) == 60
+
+def test_extend_lease_only_touches_entries_still_claimed(store):
+    for text in ("in flight", "delivered", "rescheduled"):
+        enqueue(store, text)
+    in_flight, delivered, rescheduled = store.claim_due(10, lease=0.2)
+    store.complete(delivered)
+    store.retry_later(rescheduled, 0.1)
+    store.extend_lease([in_flight, delivered, rescheduled], 60)
+    time.sleep(0.25)
+    # The retry keeps its own schedule and the in-flight entry stays hidden
+    assert [entry.payload["signal"] for entry in store.claim_due(10)] == ["rescheduled"]
+    assert rescheduled.leased_until is None and in_flight.leased_until is not None
+
+def test_a_slow_flush_keeps_its_batch_leased(store, flusher, monkeypatch):
+    def slow_create(entry):
+        time.sleep(0.5)
+        return {"signal_id": 1}
+    monkeypatch.setattr(outbox, "create_signal", slow_create)
+    flusher.lease = 0.15
+    enqueue(store)
+    claimed = store.claim_due(10, lease=flusher.lease)
+    thread = threading.Thread(target=flusher.flush, args=(claimed,))
+    thread.start()
+    seen = []
+    while thread.is_alive():
+        # Another flusher never gets the entry while it is being delivered
+        seen += store.claim_due(10, lease=0)
+        time.sleep(0.02)
+    thread.join()
+    assert seen == []
+    assert store.pending_count() == 0
@@ -0,0 +1,101 @@
+import threading
+import time
+import api_client
+import pickers
+from config import conversation_states
+from pickers import LOADING_OPTION, picker_options
+from state_store import ConversationState
+from utils import CONFIRM_PICKER, ORGANIZATION_PICKER
+
+ROWS = [{"id": 1, "name": "Acme"}, {"id": 2, "name": "Globex"}, {"id": 3, "name": "Acme Labs"}]
+
+def _loader(release=None):
+    calls = []
+    def load(key):
+        calls.append(key)
+        if release is not None:
+            release.wait(5)
+        return api_client._load_listing(key, lambda: list(ROWS))
+    return load, calls
+
+def test_options_load_a_listing_that_is_not_in_memory(monkeypatch):
+    load, calls = _loader()
+    monkeypatch.setattr(pickers, "load_listing", load)
+    options = picker_options("organizations:9001", "acme")
+    assert [option["value"] for option in options] == ["1", "3"]
+    # The second keystroke is answered from memory
+    picker_options("organizations:9001", "glo")
+    assert calls == [("organizations", 9001)]
+
+def test_slow_load_answers_loading_then_finishes_in_the_background(monkeypatch):
+    release = threading.Event()
+    load, calls = _loader(release)
+    monkeypatch.setattr(pickers, "load_listing", load)
+    assert picker_options("organizations:9002", "acme", deadline=0.05) == [LOADING_OPTION]
+    release.set()
+    for _ in range(100):
+        if api_client.search_listing(("organizations", 9002), "") is not None:
+            break
+        time.sleep(0.01)
+    assert [option["value"] for option in picker_options("organizations:9002", "glo")] == ["2"]
+    assert calls == [("organizations", 9002)]
+
+def test_failed_load_offers_nothing(monkeypatch):
+    def load(key):
+        raise RuntimeError("LivePM is down")
+    monkeypatch.setattr(pickers, "load_listing", load)
+    assert picker_options("users:9003", "anyone") == []
+
+class FakeClient:
+    def __init__(self):
+        self.posts = []
+
+    def chat_postMessage(self, **kwargs):
+        self.posts.append(kwargs)
+
+def _picker_handlers():
+    from async_bridge import ListenerCollector
+    collector = ListenerCollector()
+    pickers.register_pickers(collector)
+    return collector.actions
+
+def _multi_select_body(user_id, picked):
+    return {
+        "user": {"id": user_id},
+        "channel": {"id": "D1"},
+        "state": {"values": {"organizations:7": {ORGANIZATION_PICKER: {
+            "type": "multi_external_select",
+            "selected_options": [{"value": value} for value in picked],
+        }}}},
+    }
+
+def test_multi_select_picks_are_submitted_only_on_done(monkeypatch):
+    dispatched = []
+    monkeypatch.setattr(pickers, "dispatch_message", lambda user_id, channel_id, text, client: dispatched.append(text))
+    conversation_states.save("U-picker", ConversationState("awaiting_org_selection", "D1", customer_org_id=7))
+    actions = _picker_handlers()
+    client = FakeClient()
+    for picked in (["1"], ["1", "3"]):
+        actions[ORGANIZATION_PICKER](
+            ack=lambda: None, body=_multi_select_body("U-picker", picked), client=client,
+            action={"action_id": ORGANIZATION_PICKER, "selected_options": [{"value": value} for value in picked]},
+        )
+    assert dispatched == []
+    actions[CONFIRM_PICKER](
+        ack=lambda: None, body=_multi_select_body("U-picker", ["1", "3"]), client=client,
+        action={"action_id": CONFIRM_PICKER, "value": "organizations:7"},
+    )
+    assert dispatched == ["1,3"]
+    assert client.posts == []
+    conversation_states.delete("U-picker")
+
+def test_done_without_picks_asks_for_one(monkeypatch):
+    dispatched = []
+    monkeypatch.setattr(pickers, "dispatch_message", lambda user_id, channel_id, text, client: dispatched.append(text))
+    client = FakeClient()
+    _picker_handlers()[CONFIRM_PICKER](
+        ack=lambda: None, body=_multi_select_body("U-picker", []), client=client,
+        action={"action_id": CONFIRM_PICKER, "value": "organizations:7"},
+    )
+    assert dispatched == []
+    assert client.posts[0]["text"] == "Pick at least one entry first, or reply 'none'."
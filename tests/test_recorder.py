@@ -0,0 +1,92 @@
+import json
+import re
+import pytest
+from recorder import Recorder, mask_text, pseudonymize, pseudonymize_words
+from state_store import ConversationState, InMemoryStateStore
+
+SALT = b"test-salt"
+
+COMMAND = {
+    "command": "/add_signal",
+    "text": "Initech, Umbrella Corp | Wants single sign-on before renewal",
+    "user_id": "U07QWERTY1",
+    "team_id": "T01ASDFGH2",
+    "channel_id": "C05ZXCVBN3",
+    "trigger_id": "1234.5678.deadbeef",
+}
+REPLY = {
+    "event_id": "Ev08POIUYT4",
+    "team_id": "T01ASDFGH2",
+    "event": {"type": "message", "user": "U07QWERTY1", "channel": "D09LKJHGF5", "channel_type": "im",
+              "text": "Umbrella Corp, 12"},
+}
+SIGNAL = {
+    "event_id": "Ev08MNBVCX6",
+    "event": {"type": "message", "user": "U07QWERTY1", "channel": "D09LKJHGF5", "channel_type": "im",
+              "text": "Churn risk: budget frozen until March"},
+}
+
+@pytest.fixture
+def states():
+    return InMemoryStateStore()
+
+def _record(tmp_path, states, text_mode, *bodies):
+    path = tmp_path / "recording.jsonl"
+    recorder = Recorder(str(path), SALT.decode(), text_mode, states)
+    for body in bodies:
+        recorder.record_body(body)
+    recorder.close()
+    return path.read_text(), [json.loads(line) for line in path.read_text().splitlines()]
+
+def test_mask_text_keeps_ids_separators_and_keywords():
+    assert mask_text("12, 14 | Wants SSO") == "12, 14 | xxxxx xxx"
+    assert mask_text("None") == "None"
+    assert mask_text("new") == "new"
+
+def test_pseudonyms_are_stable_and_keep_the_id_type():
+    assert pseudonymize("U07QWERTY1", SALT) == pseudonymize("U07QWERTY1", SALT)
+    assert pseudonymize("U07QWERTY1", SALT).startswith("U")
+    assert pseudonymize("U07QWERTY1", SALT) != pseudonymize("U07QWERTY1", b"other")
+    assert pseudonymize(None, SALT) is None
+
+def test_reference_words_map_to_the_same_stand_ins():
+    first = pseudonymize_words("Umbrella Corp", SALT)
+    assert first != "Umbrella Corp" and len(first) == len("Umbrella Corp")
+    assert pseudonymize_words("umbrella corp, 12", SALT) == first.lower() + ", 12"
+
+def test_mask_mode_never_writes_raw_ids_or_text(tmp_path, states):
+    _record(tmp_path, states, "mask", COMMAND)
+    states.save("U07QWERTY1", ConversationState("awaiting_org_selection", "D09LKJHGF5"))
+    _record(tmp_path, states, "mask", REPLY)
+    states.save("U07QWERTY1", ConversationState("awaiting_signal", "D09LKJHGF5"))
+    log = _record(tmp_path, states, "mask", SIGNAL)[0].lower()
+    ids = [COMMAND[key] for key in ("user_id", "team_id", "channel_id", "trigger_id")]
+    ids += [REPLY["event_id"], REPLY["event"]["channel"], SIGNAL["event_id"]]
+    for slack_id in ids:
+        assert slack_id.lower() not in log, slack_id
+    command, reply, signal = (json.loads(line) for line in log.splitlines())
+    recorded_text = " ".join(entry["text"] for entry in (command, reply, signal))
+    for body in (COMMAND["text"], REPLY["event"]["text"], SIGNAL["event"]["text"]):
+        for word in re.findall(r"[a-z]+", body.lower()):
+            assert word not in recorded_text, word
+    assert command["refs"] == "organizations" and reply["refs"] == "organizations" and "refs" not in signal
+    # The name picked inline matches the name picked in the reply
+    assert command["text"].split("|")[0].split(", ")[1].strip() == reply["text"].split(",")[0]
+    assert signal["text"] == "xxxxx xxxx: xxxxxx xxxxxx xxxxx xxxxx"
+    assert command["user_id"] == reply["user"] == signal["user"] == pseudonymize("U07QWERTY1", SALT).lower()
+
+def test_keep_mode_keeps_text_but_not_ids(tmp_path, states):
+    _, (entry,) = _record(tmp_path, states, "keep", SIGNAL)
+    assert entry["text"] == SIGNAL["event"]["text"]
+    assert entry["user"] == pseudonymize("U07QWERTY1", SALT)
+
+def test_bot_messages_and_other_payloads_are_skipped(tmp_path, states):
+    bot = {"event": {"type": "message", "user": "U1", "bot_id": "B1", "text": "hello"}}
+    action = {"type": "block_actions", "actions": []}
+    raw, _ = _record(tmp_path, states, "mask", bot, action)
+    assert raw == ""
+
+def test_middleware_never_blocks_handling(tmp_path):
+    recorder = Recorder(str(tmp_path / "recording.jsonl"), SALT.decode())
+    recorder.close()
+    assert recorder.middleware(COMMAND, lambda: "handled") == "handled"
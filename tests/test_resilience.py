@@ -0,0 +1,75 @@
+import time
+import pytest
+from resilience import CircuitBreaker, CircuitOpenError, RetryBudget, should_retry
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("/signal/*", failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.allow()
+    assert error.value.family == "/signal/*"
+    assert breaker.stats()["times_opened"] == 1
+    assert breaker.stats()["rejected"] == 1
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker("/user/*", failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_half_open_lets_one_probe_through():
+    breaker = CircuitBreaker("/user/*", failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.1)
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Everyone else waits for the probe's outcome
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+def test_successful_probe_closes_the_breaker():
+    breaker = CircuitBreaker("/user/*", failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.1)
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.allow()
+    breaker.allow()
+
+def test_failed_probe_opens_the_breaker_again():
+    breaker = CircuitBreaker("/user/*", failure_threshold=5, reset_timeout=0.05)
+    for _ in range(5):
+        breaker.record_failure()
+    time.sleep(0.1)
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.stats()["times_opened"] == 2
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+def test_retry_budget_is_a_share_of_requests():
+    budget = RetryBudget(ratio=0.5, reserve=2)
+    assert budget.withdraw()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+    assert budget.stats()["exhausted"] == 1
+
+def test_writes_are_only_retried_when_not_processed():
+    assert should_retry("GET", 502)
+    assert should_retry("GET", None)
+    assert not should_retry("POST", 502)
+    assert not should_retry("POST", None)
+    assert should_retry("POST", None, connect_failed=True)
+    assert should_retry("POST", 503)
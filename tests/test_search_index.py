@@ -0,0 +1,62 @@
+import time
+from search_index import ListingIndex
+
+ROWS = [
+    {"id": 1, "name": "Acme"},
+    {"id": 2, "name": "Acme Corporation"},
+    {"id": 3, "name": "Acme Industries"},
+    {"id": 4, "name": "Globex"},
+    {"id": 5, "name": "Initech"},
+    {"id": 6, "name": "Globex Europe"},
+]
+
+def test_exact_name_wins_over_longer_names_containing_it():
+    assert ListingIndex(ROWS).resolve("acme") == (ROWS[0], [])
+    assert ListingIndex(ROWS).resolve("ACME  corporation") == (ROWS[1], [])
+
+def test_only_complete_match_is_picked():
+    assert ListingIndex(ROWS).resolve("Acme Ind") == (ROWS[2], [])
+
+def test_lone_close_typo_is_picked():
+    assert ListingIndex(ROWS).resolve("Globex Europa") == (ROWS[5], [])
+
+def test_lone_weak_match_is_only_offered():
+    assert ListingIndex(ROWS).resolve("Initek") == (None, [ROWS[4]])
+
+def test_ambiguous_name_gives_shortlist_with_shorter_names_first():
+    match, shortlist = ListingIndex(ROWS).resolve("Acm")
+    assert match is None
+    assert shortlist[0] == ROWS[0]
+    assert {row["id"] for row in shortlist} == {1, 2, 3}
+
+def test_shortlist_is_capped_at_limit():
+    rows = [{"id": n, "name": f"Northwind {n}"} for n in range(1, 12)]
+    match, shortlist = ListingIndex(rows).resolve("Northwind", limit=3)
+    assert match is None
+    assert len(shortlist) == 3
+    # Equal matches prefer the shorter names, so never the two-digit ones
+    assert all(row["id"] < 10 for row in shortlist)
+
+def test_no_match():
+    assert ListingIndex(ROWS).resolve("Umbrella") == (None, [])
+
+def test_added_rows_are_resolvable():
+    index = ListingIndex(ROWS)
+    assert index.resolve("Umbrella") == (None, [])
+    index.add({"id": 7, "name": "Umbrella"})
+    assert index.resolve("umbrella") == ({"id": 7, "name": "Umbrella"}, [])
+    assert index.search("umb") == [{"id": 7, "name": "Umbrella"}]
+
+def test_resolve_stays_fast_on_a_large_listing():
+    rows = [{"id": n, "name": f"Organization {n}"} for n in range(1, 20001)]
+    index = ListingIndex(rows).build()
+    queries = ["Organization 123", "Organization", "Organizaton 123", "Org 12", "organization 19999"] * 20
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        index.resolve(query)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    assert timings[len(timings) // 2] < 0.001
+    assert index.resolve("organization 19999") == (rows[19998], [])
+    assert [row["id"] for row in index.resolve("Organization")[1]] == [1, 2, 3, 4, 5]
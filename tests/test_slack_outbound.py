@@ -0,0 +1,129 @@
+import threading
+import time
+import pytest
+from slack_outbound import MessageScheduler, TokenBucket, hold_messages, merge_messages
+
+class RateLimited(Exception):
+    # Shaped like slack_sdk's SlackApiError for a 429
+    def __init__(self, retry_after):
+        super().__init__("ratelimited")
+        self.response = type("Response", (), {"status_code": 429, "headers": {"Retry-After": retry_after}})()
+
+class FakeSlack:
+    # Stands in for client.post_message_now; failures are queued per channel
+    def __init__(self):
+        self.sent = []
+        self.failures = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, **message):
+        with self._lock:
+            failures = self.failures.get(message["channel"])
+            if failures:
+                raise failures.pop(0)
+            self.sent.append((time.monotonic(), message))
+            return {"ok": True, "ts": str(len(self.sent)), "channel": message["channel"]}
+
+    def texts(self, channel):
+        return [message.get("text") for _, message in self.sent if message["channel"] == channel]
+
+@pytest.fixture
+def slack():
+    return FakeSlack()
+
+@pytest.fixture
+def make_scheduler(slack):
+    schedulers = []
+    def make(**kwargs):
+        kwargs.setdefault("rate", 100)
+        kwargs.setdefault("burst", 10)
+        kwargs.setdefault("workers", 2)
+        scheduler = MessageScheduler(slack, **kwargs)
+        schedulers.append(scheduler)
+        return scheduler
+    yield make
+    for scheduler in schedulers:
+        scheduler.stop(timeout=5)
+
+def test_merge_messages_joins_text_for_the_same_target():
+    merged = merge_messages({"channel": "D1", "text": "one"}, {"channel": "D1", "text": "two"})
+    assert merged == {"channel": "D1", "text": "one\n\ntwo"}
+
+def test_merge_messages_refuses_different_options_or_oversized_posts():
+    assert merge_messages({"channel": "D1", "text": "a"}, {"channel": "D1", "text": "b", "thread_ts": "1.0"}) is None
+    assert merge_messages({"channel": "D1", "text": "a" * 3000}, {"channel": "D1", "text": "b" * 1500}) is None
+
+def test_merge_messages_concatenates_blocks_and_refuses_duplicate_block_ids():
+    picker = {"type": "section", "block_id": "organizations:1", "text": {"type": "mrkdwn", "text": "Pick"}}
+    merged = merge_messages({"channel": "D1", "text": "hello"}, {"channel": "D1", "text": "Pick", "blocks": [picker]})
+    assert [block.get("block_id") for block in merged["blocks"]] == [None, "organizations:1"]
+    assert merged["blocks"][0]["text"]["text"] == "hello"
+    assert merge_messages(merged, {"channel": "D1", "text": "Pick", "blocks": [picker]}) is None
+
+def test_token_bucket_spends_the_burst_then_refills_at_the_rate():
+    bucket = TokenBucket(rate=2, burst=2)
+    now = bucket.updated_at
+    for _ in range(2):
+        assert bucket.delay(now) == 0.0
+        bucket.take()
+    assert bucket.delay(now) == pytest.approx(0.5)
+    assert bucket.delay(now + 0.5) == 0.0
+
+def test_held_messages_become_one_post_sharing_one_response(slack, make_scheduler):
+    scheduler = make_scheduler().start()
+    with hold_messages():
+        futures = [scheduler.post({"channel": "D1", "text": text}) for text in ("one", "two", "three")]
+        other = scheduler.post({"channel": "D2", "text": "elsewhere"})
+    responses = [future.result(timeout=5) for future in futures]
+    assert other.result(timeout=5)["channel"] == "D2"
+    assert slack.texts("D1") == ["one\n\ntwo\n\nthree"]
+    assert all(response is responses[0] for response in responses)
+    assert scheduler.stats()["coalesced"] == 2
+
+def test_messages_queued_for_a_channel_are_merged(slack, make_scheduler):
+    scheduler = make_scheduler()
+    # Not started yet, so both wait in the channel's queue
+    first = scheduler.post({"channel": "D1", "text": "one"})
+    second = scheduler.post({"channel": "D1", "text": "two"})
+    scheduler.start()
+    assert first.result(timeout=5) is second.result(timeout=5)
+    assert slack.texts("D1") == ["one\n\ntwo"]
+
+def test_each_channel_is_paced_by_its_own_bucket(slack, make_scheduler):
+    scheduler = make_scheduler(rate=10, burst=1).start()
+    # Distinct threads can't be merged, so each is its own post
+    futures = [scheduler.post({"channel": "D1", "text": "x", "thread_ts": str(n)}) for n in range(3)]
+    other = scheduler.post({"channel": "D2", "text": "y"})
+    for future in futures + [other]:
+        future.result(timeout=5)
+    times = [sent_at for sent_at, message in slack.sent if message["channel"] == "D1"]
+    assert all(later - earlier >= 0.08 for earlier, later in zip(times, times[1:]))
+    # D2 doesn't wait behind D1's bucket
+    d2_sent_at = next(sent_at for sent_at, message in slack.sent if message["channel"] == "D2")
+    assert d2_sent_at < times[-1]
+
+def test_a_429_pauses_every_channel_and_retries_the_post(slack, make_scheduler):
+    slack.failures["D1"] = [RateLimited("0.3")]
+    scheduler = make_scheduler(workers=1).start()
+    started = time.monotonic()
+    limited = scheduler.post({"channel": "D1", "text": "first"})
+    time.sleep(0.05)
+    other = scheduler.post({"channel": "D2", "text": "second"})
+    assert limited.result(timeout=5)["channel"] == "D1"
+    assert other.result(timeout=5)["channel"] == "D2"
+    # Nothing went out, on any channel, until Retry-After had passed
+    assert min(sent_at for sent_at, _ in slack.sent) - started >= 0.3
+    stats = scheduler.stats()
+    assert stats["rate_limited"] == 1
+    assert stats.get("failed", 0) == 0
+
+def test_a_failed_post_fails_every_merged_future(slack, make_scheduler):
+    error = RuntimeError("channel_not_found")
+    slack.failures["D1"] = [error]
+    scheduler = make_scheduler().start()
+    with hold_messages():
+        futures = [scheduler.post({"channel": "D1", "text": text}) for text in ("one", "two")]
+    for future in futures:
+        assert future.exception(timeout=5) is error
+    assert slack.sent == []
+    assert scheduler.stats()["failed"] == 1
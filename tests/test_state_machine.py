@@ -0,0 +1,89 @@
+import pytest
+from state_machine import END, InvalidTransitionError, StateMachine
+from state_store import ConversationState, InMemoryStateStore
+
+def _machine():
+    store = InMemoryStateStore()
+    machine = StateMachine(store)
+
+    @machine.state("asking", transitions=("confirming", END))
+    def asking(conversation, user_id, channel_id, text, client):
+        # The reply names the next state
+        return text
+
+    @machine.state("confirming", transitions=(END,))
+    def confirming(conversation, user_id, channel_id, text, client):
+        return None if text == "stay" else END
+
+    return machine, store
+
+def _dispatch(machine, store, text, state="asking"):
+    conversation = store.get("U1") or ConversationState(state, "D1")
+    return machine.dispatch(conversation, "U1", "D1", text, client=None)
+
+def test_declared_transitions_are_persisted():
+    machine, store = _machine()
+    transitions = []
+    machine.on_transition(lambda from_state, to_state: transitions.append((from_state, to_state)))
+    assert _dispatch(machine, store, "confirming")
+    assert store.get("U1").state == "confirming"
+    assert _dispatch(machine, store, "stay")
+    assert store.get("U1").state == "confirming"
+    assert _dispatch(machine, store, "done")
+    assert store.get("U1") is None
+    assert transitions == [("asking", "confirming"), ("confirming", END)]
+
+def test_a_handler_returning_none_stays_in_its_state():
+    machine, store = _machine()
+    _dispatch(machine, store, "confirming")
+    _dispatch(machine, store, "stay")
+    assert store.get("U1").state == "confirming"
+
+def test_an_undeclared_transition_is_rejected_and_not_saved():
+    machine, store = _machine()
+    with pytest.raises(InvalidTransitionError) as error:
+        _dispatch(machine, store, "awaiting_signal")
+    assert (error.value.from_state, error.value.to_state) == ("asking", "awaiting_signal")
+    assert store.get("U1") is None
+
+def test_an_unknown_current_state_is_not_dispatched():
+    machine, store = _machine()
+    handled = []
+    machine.on_handler(lambda state, outcome, elapsed: handled.append(state))
+    assert not _dispatch(machine, store, "anything", state="retired_state")
+    assert handled == []
+
+def test_handler_hooks_see_failures():
+    machine, store = _machine()
+    outcomes = []
+    machine.on_handler(lambda state, outcome, elapsed: outcomes.append((state, outcome)))
+
+    @machine.state("broken")
+    def broken(conversation, user_id, channel_id, text, client):
+        raise RuntimeError("backend down")
+
+    with pytest.raises(RuntimeError):
+        _dispatch(machine, store, "anything", state="broken")
+    assert outcomes == [("broken", "error")]
+
+def test_registration_and_validation_catch_bad_tables():
+    machine, _ = _machine()
+    with pytest.raises(ValueError):
+        machine.state("asking")(lambda *args: None)
+    machine.state("dangling", transitions=("nowhere",))(lambda *args: None)
+    with pytest.raises(ValueError) as error:
+        machine.validate()
+    assert "nowhere" in str(error.value)
+
+def test_the_conversation_table():
+    from conversation_handlers import conversation_machine
+    conversation_machine.validate()
+    assert conversation_machine.transitions() == {
+        "awaiting_org_selection": sorted(["awaiting_new_org_name", "awaiting_signal", "awaiting_user_selection", END]),
+        "awaiting_new_org_name": ["awaiting_org_selection"],
+        "awaiting_signal": sorted(["awaiting_user_selection", END]),
+        "awaiting_user_selection": sorted(["awaiting_new_user_name", END]),
+        "awaiting_new_user_name": [END],
+        "awaiting_customer_org_selection": sorted(["awaiting_new_customer_org_name", END]),
+        "awaiting_new_customer_org_name": [END],
+    }
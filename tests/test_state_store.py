@@ -0,0 +1,71 @@
+import time
+import pytest
+from state_store import ConversationState, InMemoryStateStore, SQLiteStateStore, create_state_store
+
+def _conversation():
+    return ConversationState(
+        "awaiting_signal", "D1", customer_org_id=7, selected_org_ids=[3, 5], slack_id="U1", team_id="T1",
+        pending_signal={"text": "Churn risk", "org_ids": [3]}, livepm_user_id=42, trace_id="abc123",
+    )
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "memory":
+            return InMemoryStateStore(**kwargs)
+        return SQLiteStateStore(str(tmp_path / "states.db"), **kwargs)
+    return make
+
+def test_a_saved_conversation_round_trips(make_store):
+    store = make_store()
+    store.save("U1", _conversation())
+    loaded = store.get("U1")
+    assert loaded.to_dict() == _conversation().to_dict()
+    assert loaded.updated_at is not None
+    assert "U1" in store and "U2" not in store
+
+def test_the_sqlite_store_is_shared_through_the_file(tmp_path):
+    path = str(tmp_path / "states.db")
+    SQLiteStateStore(path).save("U1", _conversation())
+    loaded = SQLiteStateStore(path).get("U1")
+    assert loaded.to_dict() == _conversation().to_dict()
+    assert loaded.pending_signal == {"text": "Churn risk", "org_ids": [3]}
+
+def test_conversations_expire_after_the_ttl(make_store):
+    store = make_store(ttl=0.2)
+    store.save("U1", _conversation())
+    assert store.get("U1") is not None
+    time.sleep(0.3)
+    assert store.get("U1") is None
+    assert len(store) == 0
+
+def test_saving_again_extends_the_ttl(make_store):
+    store = make_store(ttl=0.3)
+    store.save("U1", _conversation())
+    time.sleep(0.2)
+    store.save("U1", store.get("U1"))
+    time.sleep(0.2)
+    assert store.get("U1") is not None
+
+def test_sweep_removes_expired_and_overflowing_conversations(make_store):
+    store = make_store(ttl=0.2, max_entries=2)
+    store.save("U1", _conversation())
+    time.sleep(0.3)
+    store.save("U2", _conversation())
+    store.save("U3", _conversation())
+    store.save("U4", _conversation())
+    store.sweep()
+    assert len(store) == 2
+    assert store.get("U1") is None and store.get("U2") is None
+    assert store.get("U4") is not None
+
+def test_delete(make_store):
+    store = make_store()
+    store.save("U1", _conversation())
+    store.delete("U1")
+    store.delete("U1")
+    assert store.get("U1") is None
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        create_state_store("redis")
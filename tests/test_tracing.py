@@ -0,0 +1,97 @@
+import threading
+import time
+import pytest
+from tracing import Tracer, bind, new_id
+
+class MemoryExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+def _tracer(**settings):
+    # A large batch and interval leave exporting to the test's flush()
+    settings.setdefault("batch_size", 10000)
+    settings.setdefault("interval", 60)
+    return Tracer(MemoryExporter(), **settings)
+
+def _run_segment(tracer, trace_id=None, child_seconds=0.0):
+    with tracer.trace("command", trace_id=trace_id) as root:
+        with tracer.span("livepm", endpoint="/user/list"):
+            time.sleep(child_seconds)
+    tracer.flush()
+    return root
+
+def test_sampling_keeps_every_or_no_segment():
+    kept = _tracer(sample_rate=1.0)
+    _run_segment(kept)
+    assert [span.name for span in kept.exporter.spans] == ["livepm", "command"]
+    dropped = _tracer(sample_rate=0.0)
+    _run_segment(dropped)
+    assert dropped.exporter.spans == []
+    assert dropped.stats()["segments_dropped"] == 1
+
+def test_sampling_is_decided_by_trace_id():
+    tracer = _tracer(sample_rate=0.5)
+    trace_ids = [new_id() for _ in range(2000)]
+    sampled = [trace_id for trace_id in trace_ids if tracer.sampled(trace_id)]
+    assert 0.45 < len(sampled) / len(trace_ids) < 0.55
+    # Every segment of a flow gets the same decision
+    for trace_id in trace_ids[:50]:
+        _run_segment(tracer, trace_id)
+        _run_segment(tracer, trace_id)
+    exported = {span.trace_id for span in tracer.exporter.spans}
+    assert exported == {trace_id for trace_id in trace_ids[:50] if tracer.sampled(trace_id)}
+    assert len(tracer.exporter.spans) == 4 * len(exported)
+
+def test_slow_segments_are_kept_even_when_not_sampled():
+    tracer = _tracer(sample_rate=0.0, slow_threshold=0.05)
+    _run_segment(tracer)
+    _run_segment(tracer, child_seconds=0.06)
+    assert len(tracer.exporter.spans) == 2
+    stats = tracer.stats()
+    assert (stats["segments_slow"], stats["segments_dropped"]) == (1, 1)
+
+def test_spans_link_to_their_parent_and_record_errors():
+    tracer = _tracer(sample_rate=1.0)
+    with pytest.raises(ValueError):
+        with tracer.trace("reply", trace_id="t" * 32) as root:
+            with tracer.span("handler", state="awaiting_signal"):
+                raise ValueError("bad input")
+    tracer.flush()
+    child, exported_root = tracer.exporter.spans
+    assert child.parent_id == root.span_id and exported_root.parent_id is None
+    assert child.trace_id == root.trace_id == "t" * 32
+    assert child.attributes == {"state": "awaiting_signal"}
+    assert child.error == "ValueError: bad input"
+
+def test_a_disabled_tracer_records_nothing():
+    tracer = Tracer(None)
+    with tracer.trace("command") as root:
+        with tracer.span("livepm") as child:
+            pass
+    assert root is None and child is None
+
+def test_bind_carries_the_current_span_to_another_thread():
+    tracer = _tracer(sample_rate=1.0)
+    def lookup():
+        with tracer.span("livepm"):
+            pass
+    with tracer.trace("command") as root:
+        thread = threading.Thread(target=bind(lookup))
+        thread.start()
+        thread.join()
+    tracer.flush()
+    child = next(span for span in tracer.exporter.spans if span.name == "livepm")
+    assert child.parent_id == root.span_id
+
+def test_a_full_queue_counts_overflowed_spans():
+    tracer = _tracer(sample_rate=1.0, max_queue=3)
+    with tracer.trace("command"):
+        for _ in range(3):
+            with tracer.span("livepm"):
+                pass
+    assert tracer.stats()["spans_overflowed"] == 4
+    tracer.flush()
+    assert len(tracer.exporter.spans) == 3